@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.MiddlewareMetricas',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,3 +130,106 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Motor del filtrado colaborativo basado en usuarios:
+# 'sparse' (matriz CSR con NumPy/SciPy) o 'dict' (bucles sobre prefs)
+RECSYS_ENGINE = 'sparse'
+
+# Método de recomendación: 'user' (vecinos por usuario, calculados en cada
+# consulta), 'item' (vecinos por película, precalculados en cargar_recsys)
+# o 'mf' (factores latentes entrenados con ALS en cargar_recsys)
+RECSYS_METHOD = 'user'
+
+# Número de películas similares que se guardan por película (solo se
+# calculan con RECSYS_METHOD = 'item')
+RECSYS_ITEMSIM_K = 20
+
+# Filas por bloque al leer las puntuaciones de la BD (leerMatriz)
+RECSYS_LOAD_CHUNK = 5000
+
+# Snapshots binarios del modelo (arrays .npy mapeados en memoria)
+RECSYS_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+
+# Segundos entre comprobaciones de si la BD ha cambiado desde el último modelo
+RECSYS_SNAPSHOT_CHECK = 60
+
+# Usuarios actualizados incrementalmente a partir de los cuales se compacta
+# el modelo (también se puede compactar con manage.py compactar_recsys)
+RECSYS_COMPACT_THRESHOLD = 1000
+
+# Segundos entre comprobaciones de si otro proceso ha publicado un snapshot
+# nuevo; todos los workers del host mapean la misma copia del modelo
+RECSYS_SNAPSHOT_POLL = 1
+
+# Filas por lote al importar los ficheros de datos
+RECSYS_IMPORT_BATCH = 5000
+
+# Películas en común necesarias para considerar a un usuario como vecino
+# (1 o 2 dan el resultado exacto; más descarta vecinos poco fiables)
+RECSYS_MIN_COMUNES = 1
+
+# Índice aproximado de vecinos (LSH) para bases con muchos usuarios; solo con
+# el motor 'sparse'. Más tablas o sondeos: más exhaustivo; más bits: más rápido
+# (ver python manage.py informe_ann). Con Pearson sobre las películas en común
+# el índice apenas distingue vecinos: la exhaustividad (recall@10) sigue a la
+# fracción de usuarios candidatos. Medido con los datos incluidos (522
+# usuarios) y con los sintéticos de 10440, 52200 y 104400 usuarios:
+#   16 tablas x 6 bits, 1 sondeo: ~45% candidatos, recall 0.43-0.45
+#   16 tablas x 4 bits, 1 sondeo: ~90% candidatos, recall 0.89-0.91
+# y en todos los casos la consulta es de 1.5 a 4.5 veces más lenta que la
+# exacta. Por debajo de RECSYS_ANN_MIN_USUARIOS usuarios no se usa el
+# índice: ahí la búsqueda exacta por el índice invertido es siempre más rápida
+RECSYS_ANN = False
+RECSYS_ANN_TABLAS = 16
+RECSYS_ANN_BITS = 4
+RECSYS_ANN_SONDEOS = 1
+RECSYS_ANN_MIN_USUARIOS = 1000000
+
+# Factorización de matrices (RECSYS_METHOD = 'mf'): número de factores,
+# pasadas de ALS, regularización e hilos de entrenamiento
+RECSYS_MF_FACTORES = 20
+RECSYS_MF_ITERACIONES = 10
+RECSYS_MF_REGULARIZACION = 1.0
+RECSYS_MF_HILOS = 4
+
+# Caché de resultados de recomendación: LRU por proceso con caducidad en
+# segundos y, opcionalmente, una caché de Django compartida (alias de CACHES)
+RECSYS_CACHE = True
+RECSYS_CACHE_TTL = 300
+RECSYS_CACHE_MAX = 10000
+RECSYS_CACHE_BACKEND = None
+
+# API JSON: usuarios a partir de los cuales la respuesta es NDJSON en
+# streaming y usuarios por lote al calcular los similares
+RECSYS_API_MAX_JSON = 100
+RECSYS_API_LOTE = 100
+
+# Recomendaciones por usuario que guarda precalcular_recomendaciones
+RECSYS_PRECALCULO_N = 20
+
+# Perfilado con cProfile de una fracción de las peticiones (0 = desactivado);
+# se guardan en RECSYS_PERFIL_DIR (por defecto BASE_DIR/perfiles) las que
+# tardan al menos RECSYS_PERFIL_LENTO segundos, como mucho RECSYS_PERFIL_MAX
+RECSYS_PERFIL_MUESTREO = 0
+RECSYS_PERFIL_LENTO = 0.5
+RECSYS_PERFIL_DIR = None
+RECSYS_PERFIL_MAX = 100
+
+# Vistas asíncronas: hilos que calculan recomendaciones (por defecto, uno por
+# CPU), consultas que pueden esperar además en cola (las siguientes reciben
+# un 503) y segundos máximos de cada cálculo (después, un 504)
+RECSYS_ASYNC_HILOS = None
+RECSYS_ASYNC_COLA = 64
+RECSYS_ASYNC_TIMEOUT = 10
+
+# Caché columnar de los ficheros de datos (ver main/columnar.py); por defecto
+# en BASE_DIR/columnas
+RECSYS_COLUMNAR_DIR = None
+
+# Películas populares (media bayesiana) con las que se completan las
+# recomendaciones cuando el filtrado colaborativo da menos de las pedidas:
+# tamaño del ranking y peso de la media global (None = las puntuaciones
+# medias por película)
+RECSYS_POPULARES = True
+RECSYS_POPULARES_K = 100
+RECSYS_POPULARES_PESO = None
@@ -6,8 +6,12 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('cargar_bd/', views.cargar_bd, name='cargar_bd'),
     path('cargar_recsys/', views.cargar_recsys, name='cargar_recsys'),
+    path('estado_recsys/', views.estado_recsys, name='estado_recsys'),
+    path('metrics/', views.metricas, name='metricas'),
     path('peliculas_por_actor/', views.peliculas_por_actor, name='peliculas_por_actor'),
     path('usuarios_mas_activos/', views.usuarios_mas_activos, name='usuarios_mas_activos'),
     path('recomendar_peliculas/', views.recomendar_peliculas, name='recomendar_peliculas'),
+    path('api/recomendaciones/', views.api_recomendaciones, name='api_recomendaciones'),
+    path('api/recomendaciones/todos/', views.api_recomendaciones_todos, name='api_recomendaciones_todos'),
     path('admin/', admin.site.urls),
 ]
@@ -1,5 +1,193 @@
+#encoding:utf-8
+"""
+Admin de los modelos, preparado para tablas grandes
+
+Las listas de puntuaciones y de películas no usan OFFSET ni COUNT(*): cada
+página empieza después de la última clave de la anterior (?desde=) y el
+total es una estimación. Los filtros por usuario, película y puntuación se escriben en
+lugar de elegirse de una lista, y usan índices (ver main/models.py). Las
+películas se eligen con autocompletado en vez de un desplegable con toda
+la tabla
+"""
 from django.contrib import admin
-from .models import Pelicula, Puntuacion
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connection, models
+from django.utils.functional import cached_property
+
+from .models import ActividadUsuario, Actor, Pelicula, Puntuacion, RecomendacionPrecalculada
+
+# Parámetro con la última clave de la página anterior
+DESDE = 'desde'
+
+
+def estimarFilas(modelo):
+    """
+    Número aproximado de filas de la tabla de modelo sin recorrerla
+    PostgreSQL: estadísticas del planificador; con clave autonumérica,
+    el rango de claves (exacto si no ha habido borrados sueltos)
+    Retorna: el número estimado, o None si no se puede estimar
+    """
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [modelo._meta.db_table])
+                fila = cursor.fetchone()
+                if fila is not None and fila[0] >= 0:
+                    return int(fila[0])
+    except DatabaseError:
+        pass
+    if isinstance(modelo._meta.pk, models.AutoField):
+        rango = modelo._default_manager.aggregate(minimo=models.Min('pk'), maximo=models.Max('pk'))
+        return rango['maximo'] - rango['minimo'] + 1 if rango['maximo'] is not None else 0
+    return None
+
+
+class PaginadorPorClave(Paginator):
+    """
+    Paginador para tablas grandes: ordena por clave primaria y la página
+    pedida empieza después de la clave desde, así que cuesta lo mismo
+    llegar a cualquier página. Sin filtros, el total es una estimación
+    Tras page() deja en siguiente la clave desde de la página que sigue
+    """
+
+    def __init__(self, object_list, per_page, desde=None, **kwargs):
+        super().__init__(object_list.order_by('pk'), per_page, **kwargs)
+        self.desde = desde
+        self.siguiente = None
+        self.estimado = False
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimado = estimarFilas(self.object_list.model)
+            if estimado is not None:
+                self.estimado = True
+                return estimado
+        return super().count
+
+    def page(self, number):
+        filas = self.object_list
+        if self.desde is not None:
+            filas = filas.filter(pk__gt=self.desde)
+        # Una fila de más para saber si hay página siguiente
+        filas = list(filas[:self.per_page + 1])
+        if len(filas) > self.per_page:
+            filas = filas[:self.per_page]
+            self.siguiente = filas[-1].pk
+        return Page(filas, 1, self)
+
+
+class FiltroValor(admin.SimpleListFilter):
+    """
+    Filtro por igualdad con un valor entero que se escribe en un cuadro de
+    texto, para campos con demasiados valores para listarlos
+    """
+    template = 'admin/main/filtro_valor.html'
+    campo = None
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value() in (None, ''):
+            return queryset
+        try:
+            return queryset.filter(**{self.campo: int(self.value())})
+        except ValueError as e:
+            raise IncorrectLookupParameters(e)
+
+    def choices(self, changelist):
+        # Los demás parámetros se conservan como campos ocultos del formulario
+        yield {
+            'parametro': self.parameter_name,
+            'valor': self.value() or '',
+            'ocultos': [(clave, valor) for clave, valor in changelist.params.items()
+                        if clave not in (self.parameter_name, DESDE)],
+        }
+
+
+class FiltroUsuario(FiltroValor):
+    title = 'usuario'
+    parameter_name = 'usuario'
+    campo = 'idUsuario'
+
+
+class FiltroPelicula(FiltroValor):
+    title = 'película (id)'
+    parameter_name = 'pelicula'
+    campo = 'pelicula_id'
+
+
+class FiltroPuntuacion(FiltroValor):
+    title = 'puntuación'
+    parameter_name = 'puntuacion'
+    campo = 'puntuacion'
+
+
+class ListaPorClave(admin.ModelAdmin):
+    """
+    Lista del admin paginada con PaginadorPorClave, ordenada por clave
+    primaria y con enlaces a la primera página y a la siguiente
+    (ver admin/main/pagination_por_clave.html)
+    """
+    # El orden lo fija la paginación por clave
+    sortable_by = ()
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        # desde no es un filtro del ChangeList: se quita antes de crearlo
+        request.GET = request.GET.copy()
+        desde = request.GET.pop(DESDE, [''])[-1]
+        request.desde_admin = int(desde) if desde.isdigit() else None
+
+        response = super().changelist_view(request, extra_context)
+        cl = getattr(response, 'context_data', {}).get('cl')
+        if cl is not None:
+            siguiente = getattr(cl.paginator, 'siguiente', None)
+            cl.url_siguiente = cl.get_query_string({DESDE: siguiente}) if siguiente is not None else None
+            cl.url_primera = cl.get_query_string() if request.desde_admin is not None else None
+        return response
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # El autocompletado (PeliculaAdmin) también pagina con get_paginator,
+        # pero ordenado por título y con números de página
+        if not hasattr(request, 'desde_admin'):
+            return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+        return PaginadorPorClave(queryset, per_page, desde=request.desde_admin,
+                                 orphans=orphans, allow_empty_first_page=allow_empty_first_page)
+
+
+@admin.register(Pelicula)
+class PeliculaAdmin(ListaPorClave):
+    list_display = ('idPelicula', 'titulo', 'fecha', 'director')
+    search_fields = ('titulo',)
+    ordering = ('idPelicula',)
+
+
+@admin.register(Puntuacion)
+class PuntuacionAdmin(ListaPorClave):
+    list_display = ('idUsuario', 'pelicula', 'puntuacion')
+    list_select_related = ('pelicula',)
+    list_filter = (FiltroUsuario, FiltroPelicula, FiltroPuntuacion)
+    autocomplete_fields = ('pelicula',)
+    ordering = ('id',)
+
+
+@admin.register(Actor)
+class ActorAdmin(admin.ModelAdmin):
+    search_fields = ('nombre',)
+    autocomplete_fields = ('peliculas',)
+
+
+@admin.register(RecomendacionPrecalculada)
+class RecomendacionPrecalculadaAdmin(admin.ModelAdmin):
+    list_display = ('idUsuario', 'posicion', 'pelicula', 'recomendacion', 'version')
+    list_select_related = ('pelicula',)
+    autocomplete_fields = ('pelicula',)
+
 
-admin.site.register(Pelicula)
-admin.site.register(Puntuacion)
+admin.site.register(ActividadUsuario)
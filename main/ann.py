@@ -0,0 +1,118 @@
+#encoding:utf-8
+"""
+Índice aproximado de vecinos (LSH por proyecciones aleatorias) sobre los
+vectores de puntuaciones centrados en la media de cada usuario
+
+El coseno entre vectores centrados se aproxima al coeficiente de Pearson, así
+que los usuarios que caen en el mismo cubo son buenos candidatos a vecinos.
+Los candidatos se puntúan después con Pearson exacto (ver
+SparsePrefs.similaridades_filas): el índice solo decide a quién se compara
+
+Controles de exhaustividad / latencia:
+ - tablas: más tablas, más candidatos y más exhaustividad
+ - bits: más bits por tabla, cubos más pequeños y consultas más rápidas
+ - sondeos: cubos vecinos (cambiando los bits más dudosos) que se visitan
+   además del propio en cada tabla
+
+Con pocas películas en común entre usuarios los cubos separan poco a los
+vecinos de Pearson: la exhaustividad es aproximadamente la fracción de
+usuarios que salen como candidatos (medidas en EjercicioRSIII/settings.py)
+"""
+import numpy as np
+from scipy import sparse
+
+# Filas de la matriz que se proyectan a la vez al construir el índice
+BLOQUE = 65536
+
+
+class IndiceLSH:
+    """
+    tablas x bits hiperplanos aleatorios; cada usuario tiene en cada tabla un
+    código de bits (signo de su vector centrado contra cada hiperplano)
+    Los códigos de cada tabla se guardan ordenados para buscar cubos con
+    searchsorted; todos los arrays pueden estar mapeados en memoria
+    """
+
+    def __init__(self, arrays):
+        # planos: películas x (tablas * bits), alineado con las columnas de la matriz
+        # codigos / filas: tablas x usuarios, ordenados por código en cada tabla
+        self.planos = arrays['planos']
+        self.codigos = arrays['codigos']
+        self.filas = arrays['filas']
+        self.tablas, self.usuarios = self.codigos.shape
+        self.bits = self.planos.shape[1] // max(self.tablas, 1)
+
+    @classmethod
+    def from_prefs(cls, matriz, tablas=16, bits=4, semilla=0):
+        """
+        Construye el índice sobre las filas de una SparsePrefs
+        No incluye las actualizaciones pendientes de matriz.modificados
+        """
+        if not 0 < bits < 63:
+            raise ValueError('bits debe estar entre 1 y 62')
+        rng = np.random.default_rng(semilla)
+        planos = rng.standard_normal((len(matriz.peliculas), tablas * bits)).astype(np.float32)
+
+        num_filas = len(matriz.usuarios)
+        codigos = np.empty((tablas, num_filas), dtype=np.int64)
+        indptr = np.asarray(matriz.matriz.indptr, dtype=np.int64)
+        for inicio in range(0, num_filas, BLOQUE):
+            fin = min(inicio + BLOQUE, num_filas)
+            tramo = slice(indptr[inicio], indptr[fin])
+            ratings = matriz.matriz.data[tramo].astype(np.float64)
+            longitudes = np.diff(indptr[inicio:fin + 1])
+            grupo = np.repeat(np.arange(fin - inicio), longitudes)
+            medias = np.bincount(grupo, weights=ratings, minlength=fin - inicio) / np.maximum(longitudes, 1)
+            centrados = sparse.csr_matrix(
+                ((ratings - medias[grupo]).astype(np.float32), matriz.matriz.indices[tramo],
+                 indptr[inicio:fin + 1] - indptr[inicio]),
+                shape=(fin - inicio, len(matriz.peliculas)))
+            codigos[:, inicio:fin] = _codigos(centrados @ planos, tablas, bits).T
+
+        orden = np.argsort(codigos, axis=1, kind='stable')
+        return cls({
+            'planos': planos,
+            'codigos': np.take_along_axis(codigos, orden, axis=1),
+            'filas': orden.astype(np.int64),
+        })
+
+    def to_arrays(self):
+        return {'planos': self.planos, 'codigos': self.codigos, 'filas': self.filas}
+
+    def compatible(self, matriz, tablas, bits):
+        """
+        Indica si el índice se construyó sobre matriz con estos parámetros
+        """
+        return (self.tablas == tablas and self.bits == bits and
+                self.usuarios == len(matriz.usuarios) and len(self.planos) == len(matriz.peliculas))
+
+    def candidatos(self, matriz, person, sondeos=0):
+        """
+        Filas de matriz que comparten cubo con person en alguna tabla,
+        visitando además sondeos cubos vecinos por tabla
+        Retorna: array de filas sin repetidos
+        """
+        columnas, ratings = matriz._columnas_de(person)
+        if len(columnas) == 0:
+            return np.zeros(0, dtype=np.int64)
+        centrados = (ratings - ratings.mean()).astype(np.float32)
+        proyeccion = (centrados @ self.planos[columnas]).reshape(self.tablas, self.bits)
+        codigos = _codigos(proyeccion.reshape(1, -1), self.tablas, self.bits)[0]
+
+        result = []
+        for t in range(self.tablas):
+            sondas = [codigos[t]]
+            # Los bits con la proyección más cercana a 0 son los más dudosos
+            for bit in np.argsort(np.abs(proyeccion[t]))[:sondeos]:
+                sondas.append(codigos[t] ^ (1 << int(bit)))
+            for codigo in sondas:
+                inicio = np.searchsorted(self.codigos[t], codigo, side='left')
+                fin = np.searchsorted(self.codigos[t], codigo, side='right')
+                result.append(self.filas[t, inicio:fin])
+        return np.unique(np.concatenate(result))
+
+
+def _codigos(proyecciones, tablas, bits):
+    # Signo de cada proyección empaquetado en un entero por tabla
+    signos = (proyecciones.reshape(len(proyecciones), tablas, bits) > 0).astype(np.int64)
+    return (signos << np.arange(bits, dtype=np.int64)).sum(axis=2)
@@ -0,0 +1,188 @@
+#encoding:utf-8
+"""
+Banco de pruebas de rendimiento sobre datos sintéticos (ver main/synthetic.py)
+
+Cada paso se mide en una base de datos de pruebas y un directorio de
+snapshots temporales, sin tocar los datos reales: segundos, pico de memoria
+reservada durante el paso (tracemalloc, incluye los arrays de NumPy) y
+consultas SQL ejecutadas. Los resultados se devuelven como un diccionario
+plano "paso.metrica" -> valor, fácil de comparar con umbrales
+"""
+import datetime
+import itertools
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from main import populateDB, recommendations, synthetic
+from main.models import Actor
+
+
+# Consultas SQL del proceso en cualquier hilo (las vistas asíncronas
+# consultan desde el pool de main/ejecutor.py y desde el del ORM asíncrono)
+_consultas = itertools.count()
+
+
+def _contar(execute, sql, params, many, context):
+    next(_consultas)
+    return execute(sql, params, many, context)
+
+
+def _instalar(connection, **kwargs):
+    if _contar not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_contar)
+
+
+@contextmanager
+def medir(resultados, paso):
+    """
+    Mide el bloque y guarda paso.segundos, paso.pico_mb y paso.consultas
+    Si el bloque falla se guarda lo medido hasta el fallo y tracemalloc se
+    detiene igualmente, para no ralentizar el resto del proceso
+    """
+    tracemalloc.start()
+    consultas = next(_consultas)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        resultados[paso + '.segundos'] = time.perf_counter() - inicio
+        resultados[paso + '.pico_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        resultados[paso + '.consultas'] = next(_consultas) - consultas - 1
+        tracemalloc.stop()
+
+
+def ejecutar(escala=1, semilla=0, muestra=50, informar=None):
+    """
+    Genera los datos, los importa en una BD de pruebas y mide la carga del
+    modelo, las recomendaciones (una a una y por lotes) y cada vista
+    Retorna: diccionario {'escala', 'datos', 'resultados'}
+    """
+    avisar = informar or (lambda paso: None)
+    temporal = tempfile.mkdtemp(prefix='recsys-bench-')
+    nombre_bd = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    connection_created.connect(_instalar)
+    _instalar(connection)
+    resultados = {}
+    try:
+        # Sin caché de resultados ni comprobaciones periódicas: se mide el cálculo
+        with override_settings(RECSYS_SNAPSHOT_DIR=temporal + '/snapshots', RECSYS_CACHE=False,
+                               RECSYS_COLUMNAR_DIR=temporal + '/columnas',
+                               RECSYS_SNAPSHOT_CHECK=10 ** 9, RECSYS_SNAPSHOT_POLL=10 ** 9):
+            avisar('generacion')
+            with medir(resultados, 'generacion'):
+                datos = synthetic.generar(temporal + '/data', escala=escala, semilla=semilla)
+
+            avisar('importacion')
+            with medir(resultados, 'importacion'):
+                importacion = populateDB.populate(directorio=temporal + '/data')
+            resultados['importacion.puntuaciones_por_segundo'] = importacion['puntuaciones_por_segundo']
+
+            # La segunda importación ya lee la caché columnar de los ficheros
+            avisar('reimportacion')
+            with medir(resultados, 'reimportacion'):
+                populateDB.populate(directorio=temporal + '/data')
+
+            avisar('carga_modelo')
+            with medir(resultados, 'carga_modelo'):
+                recommendations.reconstruirModelo()
+
+            avisar('carga_snapshot')
+            with medir(resultados, 'carga_snapshot'):
+                recommendations.usarSnapshot(recommendations.snapshot.cargar())
+
+            _medir_consultas(resultados, escala, semilla, muestra, avisar)
+            _medir_vistas(resultados, semilla, avisar)
+    finally:
+        connection_created.disconnect(_instalar)
+        connection.execute_wrappers.remove(_contar)
+        connection.creation.destroy_test_db(nombre_bd, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(temporal, ignore_errors=True)
+    return {'escala': escala, 'datos': datos, 'resultados': resultados}
+
+
+def _medir_consultas(resultados, escala, semilla, muestra, avisar):
+    rng = random.Random(semilla)
+    modelo = recommendations.modelo
+    usuarios = rng.sample(list(modelo.prefs), min(muestra, len(modelo.prefs)))
+    fecha = datetime.date(2000, 1, 1)
+
+    # Funciones del motor de diccionarios, sobre una copia en dict de la
+    # muestra (el coste por par no depende del tamaño de prefs)
+    prefs = {u: dict(modelo.prefs[u]) for u in usuarios}
+    avisar('sim_pearson')
+    with medir(resultados, 'sim_pearson'):
+        for p1 in usuarios:
+            for p2 in usuarios:
+                recommendations.sim_pearson(prefs, p1, p2)
+    resultados['sim_pearson.pares'] = len(usuarios) ** 2
+
+    if escala <= 10:
+        # El motor de diccionarios recorre todos los usuarios por consulta
+        avisar('getRecommendations')
+        completo = {u: dict(modelo.prefs[u]) for u in modelo.prefs}
+        with medir(resultados, 'getRecommendations'):
+            for u in usuarios[:10]:
+                recommendations.getRecommendations(completo, u, n=2)
+
+    avisar('recomendacion_usuario')
+    with medir(resultados, 'recomendacion_usuario'):
+        for u in usuarios:
+            recommendations.recomendar_peliculas_usuario(u, fecha, n=2)
+    resultados['recomendacion_usuario.segundos_por_usuario'] = resultados['recomendacion_usuario.segundos'] / len(usuarios)
+
+    avisar('similares_usuario')
+    with medir(resultados, 'similares_usuario'):
+        for u in usuarios:
+            recommendations.getUsuariosSimilares(u, n=3)
+
+    avisar('similares_lote')
+    with medir(resultados, 'similares_lote'):
+        recommendations.getUsuariosSimilaresVarios(usuarios, n=3)
+
+
+def _medir_vistas(resultados, semilla, avisar):
+    cliente = Client()
+    usuario = recommendations.getUsuariosMasActivos(1)[0][0]
+    actor = Actor.objects.order_by('nombre').values_list('nombre', flat=True).first()
+    usuarios = list(recommendations.modelo.prefs)
+    lote = ','.join(str(u) for u in random.Random(semilla).sample(usuarios, min(100, len(usuarios))))
+    vistas = {
+        'index': lambda: cliente.get('/'),
+        'usuarios_mas_activos': lambda: cliente.get('/usuarios_mas_activos/'),
+        'recomendar_peliculas': lambda: cliente.post('/recomendar_peliculas/',
+                                                     {'idUsuario': usuario, 'fecha': '01/01/2000'}),
+        'peliculas_por_actor': lambda: cliente.post('/peliculas_por_actor/', {'actor': actor}),
+        'api_recomendaciones': lambda: cliente.get('/api/recomendaciones/?usuarios=' + lote),
+    }
+    for nombre, peticion in vistas.items():
+        avisar('vista.' + nombre)
+        with medir(resultados, 'vista.' + nombre):
+            respuesta = peticion()
+        resultados['vista.%s.estado' % nombre] = respuesta.status_code
+
+
+def comprobar(resultados, umbrales):
+    """
+    Compara los resultados con umbrales {"paso.metrica": máximo}
+    Retorna: lista de textos con las métricas que superan su umbral
+    """
+    fallos = []
+    for metrica, maximo in sorted(umbrales.items()):
+        valor = resultados.get(metrica)
+        if valor is None:
+            fallos.append('%s: no medida' % metrica)
+        elif valor > maximo:
+            fallos.append('%s: %.4g > %.4g' % (metrica, valor, maximo))
+    return fallos
@@ -0,0 +1,114 @@
+#encoding:utf-8
+"""
+Caché de resultados de recomendación
+
+Primero se busca en una LRU del proceso con caducidad (TTL) y, si
+RECSYS_CACHE_BACKEND nombra una caché de Django, después en ella, que puede
+estar compartida entre procesos. Las claves incluyen la versión del modelo,
+así que al cambiar el modelo las entradas antiguas dejan de usarse y acaban
+saliendo por antigüedad
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class CacheResultados:
+    """
+    LRU con TTL y contadores de aciertos y fallos
+    """
+
+    def __init__(self):
+        self.entradas = OrderedDict()
+        self.cerrojo = threading.Lock()
+        self.contadores = dict.fromkeys(
+            ('aciertos', 'aciertos_compartida', 'fallos', 'caducadas', 'expulsadas'), 0)
+
+    def activa(self):
+        return getattr(settings, 'RECSYS_CACHE', True)
+
+    def obtener(self, clave, calcular):
+        """
+        Valor de clave (una tupla de valores simples); si no está o ha
+        caducado, se calcula con calcular() y se guarda
+        """
+        if not self.activa():
+            return calcular()
+        valor = self.consultar(clave)
+        if valor is None:
+            valor = calcular()
+            self.guardar(clave, valor)
+        return list(valor)
+
+    def consultar(self, clave):
+        """
+        Retorna: copia del valor guardado para clave, o None (cuenta como fallo)
+        """
+        if not self.activa():
+            return None
+        ahora = time.monotonic()
+        with self.cerrojo:
+            entrada = self.entradas.get(clave)
+            if entrada is not None:
+                if entrada[0] > ahora:
+                    self.entradas.move_to_end(clave)
+                    self.contadores['aciertos'] += 1
+                    return list(entrada[1])
+                del self.entradas[clave]
+                self.contadores['caducadas'] += 1
+
+        compartida = self._compartida()
+        if compartida is not None:
+            valor = compartida.get(_clave_texto(clave))
+            if valor is not None:
+                self._guardar(clave, valor, ahora)
+                with self.cerrojo:
+                    self.contadores['aciertos_compartida'] += 1
+                return list(valor)
+
+        with self.cerrojo:
+            self.contadores['fallos'] += 1
+        return None
+
+    def guardar(self, clave, valor):
+        if not self.activa():
+            return
+        self._guardar(clave, valor, time.monotonic())
+        compartida = self._compartida()
+        if compartida is not None:
+            compartida.set(_clave_texto(clave), valor, getattr(settings, 'RECSYS_CACHE_TTL', 300))
+
+    def _guardar(self, clave, valor, ahora):
+        maximo = getattr(settings, 'RECSYS_CACHE_MAX', 10000)
+        with self.cerrojo:
+            self.entradas[clave] = (ahora + getattr(settings, 'RECSYS_CACHE_TTL', 300), valor)
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > maximo:
+                self.entradas.popitem(last=False)
+                self.contadores['expulsadas'] += 1
+
+    def _compartida(self):
+        alias = getattr(settings, 'RECSYS_CACHE_BACKEND', None)
+        return caches[alias] if alias else None
+
+    def limpiar(self):
+        with self.cerrojo:
+            self.entradas.clear()
+
+    def estadisticas(self):
+        """
+        Retorna: contadores, entradas y tasa de aciertos del proceso
+        """
+        with self.cerrojo:
+            stats = dict(self.contadores, entradas=len(self.entradas))
+        consultas = stats['aciertos'] + stats['aciertos_compartida'] + stats['fallos']
+        stats['tasa_aciertos'] = (stats['aciertos'] + stats['aciertos_compartida']) / consultas if consultas else 0.0
+        return stats
+
+
+def _clave_texto(clave):
+    # Las cachés de Django necesitan claves de texto cortas y sin espacios
+    return 'recsys:' + ':'.join(str(parte).replace(' ', '_') for parte in clave)
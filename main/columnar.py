@@ -0,0 +1,239 @@
+#encoding:utf-8
+"""
+Caché binaria columnar de los ficheros de datos (ratings.* y movies1.*)
+
+La primera lectura de un fichero lo convierte en arrays de NumPy guardados
+como .npy en RECSYS_COLUMNAR_DIR; las siguientes los abren mapeados en
+memoria sin volver a interpretar el texto. Cada conversión anota el tamaño,
+la fecha de modificación y el SHA-256 del fichero de origen: si cambian el
+tamaño o la fecha se compara el hash y, solo si también ha cambiado, se
+vuelve a convertir
+
+Puntuaciones: usuarios y peliculas (int32) y puntuaciones (uint8)
+Películas: ids (int32), fechas como ordinal (int32, 0 = sin fecha) y los
+textos (titulo, director, actores) como un bloque UTF-8 con sus desplazamientos
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+
+# Se incrementa cada vez que cambia el contenido de la caché
+FORMATO = 1
+MANIFEST = 'manifest.json'
+# Bytes de fichero que se convierten de una vez
+BLOQUE = 1 << 20
+
+# Separadores de cada formato de fichero: (películas, puntuaciones)
+SEPARADORES = {
+    'txt': ('\t', '\t'),
+    'csv': (',', ';'),
+}
+
+TEXTOS = ('titulo', 'director', 'actores')
+
+
+def directorio():
+    return getattr(settings, 'RECSYS_COLUMNAR_DIR', None) or os.path.join(settings.BASE_DIR, 'columnas')
+
+
+def leerFilas(fichero, separador, formato):
+    """
+    Recorre un fichero de datos fila a fila sin cargarlo entero en memoria
+    """
+    with open(fichero, "r", encoding='utf-8', newline='') as fileobj:
+        if formato == 'csv':
+            yield from csv.reader(fileobj, delimiter=separador)
+        else:
+            for line in fileobj:
+                yield line.strip().split(separador)
+
+
+def puntuaciones(fichero, formato='txt', forzar=False):
+    """
+    Puntuaciones de fichero como columnas
+    Retorna: diccionario {'usuarios', 'peliculas', 'puntuaciones'} de arrays
+    paralelos mapeados en memoria, en el orden del fichero
+    """
+    return _cargar(fichero, formato, 'puntuaciones', _convertir_puntuaciones, forzar)
+
+
+def peliculas(fichero, formato='txt', forzar=False):
+    """
+    Películas de fichero como columnas (ver filasPeliculas)
+    Retorna: diccionario de arrays mapeados en memoria
+    """
+    return _cargar(fichero, formato, 'peliculas', _convertir_peliculas, forzar)
+
+
+def filasPeliculas(columnas):
+    """
+    Recorre las películas de peliculas() como tuplas
+    (idPelicula, titulo, fecha o None, director, actoresPrincipales)
+    """
+    textos = [_textos(columnas, campo) for campo in TEXTOS]
+    for id_pelicula, ordinal, titulo, director, actores in zip(
+            columnas['ids'].tolist(), columnas['fechas'].tolist(), *textos):
+        yield id_pelicula, titulo, date.fromordinal(ordinal) if ordinal else None, director, actores
+
+
+def _textos(columnas, campo):
+    datos = columnas[campo + '_datos']
+    desplazamientos = columnas[campo + '_desplazamientos'].tolist()
+    for inicio, fin in zip(desplazamientos, desplazamientos[1:]):
+        yield bytes(datos[inicio:fin]).decode('utf-8')
+
+
+def _cargar(fichero, formato, tipo, convertir, forzar):
+    origen = os.path.abspath(fichero)
+    estado = os.stat(origen)
+    clave = hashlib.sha1(('%s\0%s\0%s' % (origen, formato, tipo)).encode()).hexdigest()[:16]
+    ruta = os.path.join(directorio(), '%s-%s' % (clave, os.path.basename(origen)))
+
+    manifest = None if forzar else _manifest(ruta)
+    if manifest is not None and manifest.get('formato') == FORMATO:
+        vigente = manifest['tamano'] == estado.st_size and manifest['mtime_ns'] == estado.st_mtime_ns
+        if not vigente and manifest['tamano'] == estado.st_size and manifest['sha256'] == _hash(origen):
+            # Mismo contenido con otra fecha (copiado, checkout...): se anota la nueva
+            manifest['mtime_ns'] = estado.st_mtime_ns
+            _escribir_manifest(ruta, manifest)
+            vigente = True
+        if vigente:
+            return {nombre: np.load(os.path.join(ruta, nombre + '.npy'), mmap_mode='r')
+                    for nombre in manifest['arrays']}
+
+    arrays = convertir(origen, formato)
+    temporal = '%s.%d.tmp' % (ruta, os.getpid())
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    for nombre, valores in arrays.items():
+        np.save(os.path.join(temporal, nombre + '.npy'), valores)
+    _escribir_manifest(temporal, {
+        'formato': FORMATO,
+        'tipo': tipo,
+        'origen': origen,
+        'tamano': estado.st_size,
+        'mtime_ns': estado.st_mtime_ns,
+        'sha256': _hash(origen),
+        'arrays': sorted(arrays),
+    })
+    shutil.rmtree(ruta, ignore_errors=True)
+    os.replace(temporal, ruta)
+    return {nombre: np.load(os.path.join(ruta, nombre + '.npy'), mmap_mode='r') for nombre in arrays}
+
+
+def _manifest(ruta):
+    try:
+        with open(os.path.join(ruta, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _escribir_manifest(ruta, manifest):
+    temporal = os.path.join(ruta, MANIFEST + '.tmp')
+    with open(temporal, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temporal, os.path.join(ruta, MANIFEST))
+
+
+def _hash(fichero):
+    resumen = hashlib.sha256()
+    with open(fichero, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            resumen.update(bloque)
+    return resumen.hexdigest()
+
+
+def _convertir_puntuaciones(fichero, formato):
+    # El fichero se convierte por bloques de BLOQUE bytes cortados en un fin
+    # de línea, así que la memoria no depende de su tamaño (solo las columnas
+    # compactas del resultado)
+    separador = SEPARADORES[formato][1]
+    bloques = {'usuarios': [], 'peliculas': [], 'puntuaciones': []}
+    tipos = {'usuarios': np.int32, 'peliculas': np.int32, 'puntuaciones': np.uint8}
+    with open(fichero, 'rb') as f:
+        resto = b''
+        while True:
+            datos = f.read(BLOQUE)
+            if datos:
+                datos = resto + datos
+                corte = datos.rfind(b'\n') + 1
+                if corte == 0:
+                    resto = datos
+                    continue
+                datos, resto = datos[:corte], datos[corte:]
+            else:
+                datos, resto = resto, b''
+                if not datos:
+                    break
+            valores = _leer_bloque(datos, separador, formato)
+            for columna, nombre in enumerate(bloques):
+                bloques[nombre].append(_entero(valores[:, columna], tipos[nombre]))
+    # Si algún bloque no cabía en el tipo compacto, el resultado es int64
+    return {nombre: np.concatenate(partes) if partes else np.zeros(0, dtype=tipos[nombre])
+            for nombre, partes in bloques.items()}
+
+
+def _leer_bloque(datos, separador, formato):
+    # Camino rápido: todo el bloque en una sola conversión de NumPy, válido
+    # si todas las filas tienen tres enteros
+    try:
+        valores = np.array(datos.replace(separador.encode(), b' ').split(), dtype=np.int64)
+        if len(valores) % 3 or datos.count(separador.encode()) != 2 * (len(valores) // 3):
+            raise ValueError
+        return valores.reshape(-1, 3)
+    except ValueError:
+        # Comillas, filas incompletas...: fila a fila, como leerFilas
+        texto = io.StringIO(datos.decode('utf-8'), newline='')
+        if formato == 'csv':
+            filas = csv.reader(texto, delimiter=separador)
+        else:
+            filas = (line.strip().split(separador) for line in texto)
+        return np.array([(int(rip[0]), int(rip[1]), int(rip[2])) for rip in filas if len(rip) >= 3],
+                        dtype=np.int64).reshape(-1, 3)
+
+
+def _entero(valores, tipo):
+    # El tipo compacto si caben los valores; si no, int64
+    limites = np.iinfo(tipo)
+    if len(valores) and (valores.min() < limites.min or valores.max() > limites.max):
+        tipo = np.int64
+    return np.ascontiguousarray(valores, dtype=tipo)
+
+
+def _convertir_peliculas(fichero, formato):
+    ids = []
+    fechas = []
+    textos = {campo: [] for campo in TEXTOS}
+    for rip in leerFilas(fichero, SEPARADORES[formato][0], formato):
+        # Las filas que no se pueden leer se saltan, como en populateDB
+        try:
+            id_pelicula = int(rip[0])
+        except (ValueError, IndexError):
+            continue
+        try:
+            # YYYY-MM-DD
+            ordinal = date.fromisoformat(rip[2]).toordinal()
+        except (ValueError, IndexError):
+            ordinal = 0
+        ids.append(id_pelicula)
+        fechas.append(ordinal)
+        textos['titulo'].append(rip[1] if len(rip) > 1 else '')
+        textos['director'].append(rip[3] if len(rip) > 3 else '')
+        textos['actores'].append(rip[4] if len(rip) > 4 else '')
+
+    arrays = {'ids': _entero(np.array(ids, dtype=np.int64), np.int32),
+              'fechas': np.array(fechas, dtype=np.int32)}
+    for campo, valores in textos.items():
+        codificados = [valor.encode('utf-8') for valor in valores]
+        arrays[campo + '_datos'] = np.frombuffer(b''.join(codificados), dtype=np.uint8)
+        arrays[campo + '_desplazamientos'] = np.concatenate(
+            [[0], np.cumsum([len(valor) for valor in codificados], dtype=np.int64)]).astype(np.int64)
+    return arrays
@@ -0,0 +1,94 @@
+#encoding:utf-8
+"""
+Ejecución acotada del cálculo de recomendaciones desde las vistas asíncronas
+
+El filtrado colaborativo es CPU y no debe bloquear el bucle de eventos del
+servidor ASGI, así que se lanza en un pool de RECSYS_ASYNC_HILOS hilos. Se
+usan hilos y no procesos porque comparten el modelo cargado (ver
+main/modelo.py) y NumPy libera el GIL en las operaciones grandes. Como
+mucho esperan RECSYS_ASYNC_COLA consultas más: las siguientes se rechazan
+al momento (Saturado) en lugar de acumular latencia, y la que tarda más de
+RECSYS_ASYNC_TIMEOUT segundos deja de esperarse (TimeoutError)
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from main import metrics, middleware
+
+_cerrojo = threading.Lock()
+_pool = None
+_pendientes = 0
+
+
+class Saturado(Exception):
+    """
+    Todos los hilos están ocupados y la cola está llena
+    """
+
+
+def hilos():
+    return getattr(settings, 'RECSYS_ASYNC_HILOS', None) or os.cpu_count() or 1
+
+
+async def ejecutar(funcion, *args, **kwargs):
+    """
+    Ejecuta funcion(*args, **kwargs) en el pool y espera su resultado
+    La tarea hereda el contexto (métricas de la petición en curso)
+    Lanza Saturado si no cabe en la cola y TimeoutError si no termina a tiempo
+    """
+    global _pendientes
+    with _cerrojo:
+        if _pendientes >= hilos() + getattr(settings, 'RECSYS_ASYNC_COLA', 64):
+            metrics.incrementar('recsys_ejecutor_rechazadas_total')
+            raise Saturado()
+        _pendientes += 1
+        pool = _obtener_pool()
+
+    contexto = contextvars.copy_context()
+    futuro = pool.submit(contexto.run, _tarea, time.perf_counter(), funcion, args, kwargs)
+    futuro.add_done_callback(_liberar)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(futuro), getattr(settings, 'RECSYS_ASYNC_TIMEOUT', 10))
+    except asyncio.TimeoutError:
+        # Si aún no había empezado, no llega a ejecutarse
+        futuro.cancel()
+        metrics.incrementar('recsys_ejecutor_caducadas_total')
+        raise
+
+
+def estadisticas():
+    """
+    Retorna: hilos del pool y consultas en ejecución o en cola
+    """
+    return {'hilos': hilos(), 'pendientes': _pendientes}
+
+
+def _obtener_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=hilos(), thread_name_prefix='recsys-cpu')
+    return _pool
+
+
+def _tarea(encolada, funcion, args, kwargs):
+    metrics.observar('recsys_ejecutor_espera_segundos', time.perf_counter() - encolada)
+    # Como en cada petición, las conexiones caducadas de este hilo se cierran
+    close_old_connections()
+    try:
+        # Si la petición se eligió para perfilar, se perfila aquí, en el hilo que calcula
+        return middleware.perfilar_tarea(funcion, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def _liberar(futuro):
+    global _pendientes
+    with _cerrojo:
+        _pendientes -= 1
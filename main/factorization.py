@@ -0,0 +1,140 @@
+#encoding:utf-8
+"""
+Factorización de la matriz de puntuaciones por mínimos cuadrados alternos (ALS)
+
+Cada usuario y cada película se representan con un vector de factores
+latentes y la puntuación prevista es media + usuario · película. Entrenar
+cuesta varias pasadas por la matriz, pero recomendar es un producto de la
+matriz de factores de películas por el vector del usuario y una selección de
+las n mejores: no depende del número de usuarios
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from main.sparse import _ordenar
+
+# Bytes de productos exteriores (k x k por puntuación) por bloque al resolver
+# los sistemas de cada paso de ALS: las puntuaciones por bloque dependen de k
+MEMORIA_BLOQUE = 32 << 20
+
+
+class FactoresLatentes:
+    """
+    Factores de usuarios (alineados con las filas de la SparsePrefs sobre la
+    que se entrenaron) y de películas (alineados con sus columnas)
+    parametros: media, factores, iteraciones, regularizacion y rmse del
+    entrenamiento; junto con la versión del snapshot identifican el modelo
+    """
+
+    def __init__(self, arrays):
+        self.usuarios = arrays['usuarios']
+        self.peliculas = arrays['peliculas']
+        self.parametros = arrays['parametros']
+        self.media = float(self.parametros[0])
+        self.regularizacion = float(self.parametros[3])
+
+    @classmethod
+    def entrenar(cls, matriz, factores=20, iteraciones=10, regularizacion=1.0, hilos=4, semilla=0):
+        """
+        Entrena los factores con ALS sobre las filas de una SparsePrefs
+        Cada paso resuelve un sistema factores x factores por usuario (o por
+        película); los bloques se reparten entre hilos, ya que NumPy libera
+        el GIL en las operaciones pesadas
+        """
+        filas, columnas = matriz.matriz, matriz.columnas
+        media = float(filas.data.mean()) if filas.nnz else 0.0
+        rng = np.random.default_rng(semilla)
+        U = rng.normal(0, 0.1, (filas.shape[0], factores))
+        V = rng.normal(0, 0.1, (filas.shape[1], factores))
+
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            for _ in range(iteraciones):
+                U = _resolver(filas, V, media, regularizacion, pool)
+                V = _resolver(columnas, U, media, regularizacion, pool)
+
+        usuarios = np.repeat(np.arange(filas.shape[0]), np.diff(filas.indptr))
+        errores = media + np.einsum('ij,ij->i', U[usuarios], V[filas.indices]) - filas.data
+        rmse = float(np.sqrt(np.mean(errores ** 2))) if filas.nnz else 0.0
+        return cls({
+            'usuarios': U.astype(np.float32),
+            'peliculas': V.astype(np.float32),
+            'parametros': np.array([media, factores, iteraciones, regularizacion, rmse]),
+        })
+
+    def to_arrays(self):
+        return {'usuarios': self.usuarios, 'peliculas': self.peliculas, 'parametros': self.parametros}
+
+    def rmse(self):
+        return float(self.parametros[4])
+
+    def compatible(self, matriz):
+        """
+        Indica si los factores se entrenaron sobre una matriz con estas dimensiones
+        """
+        return len(self.usuarios) == len(matriz.usuarios) and len(self.peliculas) == len(matriz.peliculas)
+
+    def vector(self, matriz, person):
+        """
+        Factores de person; los usuarios nuevos o actualizados
+        incrementalmente se proyectan sobre los factores de películas
+        actuales (un solo sistema pequeño) sin reentrenar
+        """
+        i = matriz._fila(person)
+        if i is not None and person not in matriz.modificados:
+            return self.usuarios[i].astype(np.float64)
+        columnas, ratings = matriz._columnas_de(person)
+        V = self.peliculas[columnas].astype(np.float64)
+        A = V.T @ V + self.regularizacion * max(len(columnas), 1) * np.eye(V.shape[1])
+        return np.linalg.solve(A, V.T @ (ratings - self.media))
+
+    def getRecommendations(self, matriz, person, candidatas=None, n=None):
+        """
+        Puntuación prevista de las películas que person no ha visto
+        candidatas (opcional) limita las películas, como en SparsePrefs
+        Retorna: lista de tuplas (puntuacion prevista, idPelicula)
+        """
+        scores = self.media + self.peliculas.astype(np.float64) @ self.vector(matriz, person)
+        mascara = np.ones(len(scores), dtype=bool)
+        mascara[matriz._columnas_de(person)[0]] = False
+        if candidatas is not None:
+            mascara &= candidatas.mascara(matriz.peliculas)
+        if not mascara.any():
+            return []
+        return _ordenar(scores[mascara], matriz.peliculas[mascara], n)
+
+
+def _resolver(matriz, fijos, media, regularizacion, pool):
+    # Un paso de ALS: nuevos factores de cada fila de matriz (CSR o CSC)
+    # dejando fijos los del otro lado, con regularización proporcional al
+    # número de puntuaciones de la fila
+    indptr = np.asarray(matriz.indptr, dtype=np.int64)
+    num_filas = len(indptr) - 1
+    k = fijos.shape[1]
+    por_bloque = max(1, MEMORIA_BLOQUE // (8 * k * k))
+    cortes = np.unique(np.concatenate([
+        np.searchsorted(indptr, np.arange(0, indptr[-1], por_bloque), side='right') - 1, [num_filas]]))
+    cortes[0] = 0
+
+    def bloque(inicio, fin):
+        tramo = slice(indptr[inicio], indptr[fin])
+        F = fijos[matriz.indices[tramo]]
+        r = matriz.data[tramo] - media
+        longitudes = np.diff(indptr[inicio:fin + 1])
+        # Suma por fila de los productos exteriores y de los términos independientes
+        grupos = sparse.csr_matrix((np.ones(len(r)), np.arange(len(r)),
+                                    indptr[inicio:fin + 1] - indptr[inicio]), shape=(fin - inicio, len(r)))
+        if len(r) <= por_bloque:
+            A = (grupos @ np.einsum('ij,ik->ijk', F, F).reshape(len(r), k * k)).reshape(fin - inicio, k, k)
+        else:
+            # El bloque empieza con una fila mayor que por_bloque: FᵀF de cada
+            # fila por separado, sin el producto exterior de cada puntuación
+            limites = indptr[inicio:fin + 1] - indptr[inicio]
+            A = np.stack([F[a:b].T @ F[a:b] for a, b in zip(limites[:-1], limites[1:])])
+        A += regularizacion * np.maximum(longitudes, 1)[:, None, None] * np.eye(k)
+        b = grupos @ (F * r[:, None])
+        return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+    resultados = pool.map(lambda c: bloque(*c), zip(cortes[:-1], cortes[1:]))
+    return np.concatenate(list(resultados)) if num_filas else np.zeros((0, fijos.shape[1]))
@@ -16,6 +16,7 @@ class FormularioConfirmacion(forms.Form):
 class FormularioPeliculasPorActor(forms.Form):
     """
     Formulario para seleccionar un actor
+    actores (opcional): lista de actores ya leída; si no se da, se lee de la BD
     """
     actor = forms.ChoiceField(
         label='Seleccione un actor',
@@ -23,10 +24,11 @@ class FormularioPeliculasPorActor(forms.Form):
         widget=forms.Select(attrs={'class': 'uk-select'})
     )
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, actores=None, **kwargs):
         super(FormularioPeliculasPorActor, self).__init__(*args, **kwargs)
         try:
-            actores = recommendations.obtener_actores_unicos()
+            if actores is None:
+                actores = recommendations.obtener_actores_unicos()
             self.fields['actor'].choices = [(actor, actor) for actor in actores]
         except:
             self.fields['actor'].choices = []
@@ -49,3 +51,21 @@ class FormularioRecomendarPeliculas(forms.Form):
             'placeholder': 'dd/mm/aaaa'
         })
     )
+
+class FormularioApiRecomendaciones(forms.Form):
+    """
+    Parámetros de la API JSON de recomendaciones
+    usuarios: ids separados por comas (o una lista en un cuerpo JSON)
+    """
+    usuarios = forms.CharField(required=False)
+    fecha = forms.DateField(required=False, input_formats=['%Y-%m-%d', '%d/%m/%Y'])
+    n = forms.IntegerField(required=False, min_value=1, max_value=100)
+    similares = forms.IntegerField(required=False, min_value=0, max_value=100)
+    formato = forms.ChoiceField(required=False, choices=[('json', 'json'), ('ndjson', 'ndjson')])
+
+    def clean_usuarios(self):
+        texto = self.cleaned_data['usuarios']
+        try:
+            return [int(u) for u in texto.split(',') if u.strip()]
+        except ValueError:
+            raise forms.ValidationError('usuarios debe ser una lista de enteros separados por comas')
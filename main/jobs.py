@@ -0,0 +1,144 @@
+#encoding:utf-8
+"""
+Reconstrucción del modelo en segundo plano
+
+Un trabajo recorre las etapas importacion (opcional), preferencias,
+similitud (solo con RECSYS_METHOD = 'item'), factores (solo con
+RECSYS_METHOD = 'mf') y publicacion en un hilo aparte, así que las vistas
+que lo lanzan responden al momento. Mientras tanto se sigue sirviendo el
+modelo anterior: el nuevo solo se usa cuando su snapshot está publicado
+(ver recommendations.reconstruirModelo)
+
+El estado del último trabajo se guarda en un JSON junto a los snapshots,
+para que cualquier proceso del host pueda consultarlo
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from main import populateDB, recommendations, snapshot
+
+logger = logging.getLogger(__name__)
+
+ESTADO = 'trabajo.json'
+
+# Un solo hilo: los trabajos de este proceso se ejecutan de uno en uno
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recsys')
+_cerrojo = threading.Lock()
+_pendiente = None
+
+
+def encolar(importar=False, huella_esperada=None, **opciones):
+    """
+    Lanza un trabajo en segundo plano, salvo que este proceso ya tenga uno
+    en cola o en ejecución que haga lo mismo, en cuyo caso se devuelve ese
+    Una importación pedida mientras hay una reconstrucción sin importación
+    (o con otras opciones) se pone en cola detrás de ella
+    importar: importa antes los ficheros de datos; opciones se pasan a
+    populateDB.populate (modo, formato, directorio, batch_size)
+    huella_esperada: ver recommendations.reconstruirModelo
+    Retorna: diccionario con el estado del trabajo
+    """
+    global _pendiente
+    with _cerrojo:
+        if _pendiente is not None and not _pendiente[1].done():
+            trabajo, _, pendiente_importa, pendiente_opciones = _pendiente
+            if not importar or (pendiente_importa and pendiente_opciones == opciones):
+                return trabajo
+        trabajo = _nuevo(importar)
+        _escribir(trabajo)
+        # El pool tiene un solo hilo: si hay otro trabajo, este espera a que acabe
+        futuro = _pool.submit(ejecutar, trabajo, importar, huella_esperada, opciones)
+        _pendiente = (trabajo, futuro, importar, opciones)
+    return trabajo
+
+
+def ejecutar(trabajo=None, importar=False, huella_esperada=None, opciones=None, informar=None):
+    """
+    Ejecuta un trabajo en el hilo actual, actualizando su estado en cada etapa
+    informar (opcional) recibe el estado tras cada cambio
+    Retorna: diccionario con el estado final del trabajo
+    """
+    trabajo = trabajo or _nuevo(importar)
+    etapas = trabajo['etapas']
+
+    def actualizar(**cambios):
+        trabajo.update(cambios, actualizado=time.time())
+        if 'etapa' in cambios:
+            trabajo['progreso'] = etapas.index(cambios['etapa']) / len(etapas)
+        _escribir(trabajo)
+        if informar is not None:
+            informar(trabajo)
+
+    try:
+        actualizar(estado='ejecutando', inicio=time.time())
+        columnas = None
+        if importar:
+            opciones = opciones or {}
+            actualizar(etapa='importacion')
+            trabajo['importacion'] = populateDB.populate(
+                progreso=lambda tipo, filas: actualizar(detalle='%d %s importadas' % (filas, tipo)),
+                **opciones)
+            if opciones.get('modo', 'truncate') == 'truncate':
+                # La BD es ahora una copia de los ficheros: el modelo se lee de su caché columnar
+                columnas = populateDB.puntuacionesImportadas(trabajo['importacion']['huella'],
+                                                             opciones.get('formato', 'txt'),
+                                                             opciones.get('directorio'))
+        version = recommendations.reconstruirModelo(
+            huella_esperada=huella_esperada, columnas=columnas,
+            progreso=lambda etapa: actualizar(etapa=etapa, detalle=None) if etapa in etapas else None)
+        actualizar(estado='completado', progreso=1.0, fin=time.time(), version=version,
+                   estadisticas=recommendations.estadisticas_carga)
+    except Exception as e:
+        logger.exception('Error reconstruyendo el modelo de recomendación')
+        actualizar(estado='error', fin=time.time(), error=str(e))
+    finally:
+        # Cada hilo abre su propia conexión; no debe quedar abierta
+        connection.close()
+    return trabajo
+
+
+def estado():
+    """
+    Retorna: estado del último trabajo lanzado en el host, o None
+    """
+    try:
+        with open(os.path.join(snapshot.directorio(), ESTADO)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _nuevo(importar):
+    etapas = ['importacion'] if importar else []
+    etapas.append('preferencias')
+    if getattr(settings, 'RECSYS_METHOD', 'user') == 'item':
+        etapas.append('similitud')
+    if getattr(settings, 'RECSYS_METHOD', 'user') == 'mf':
+        etapas.append('factores')
+    etapas.append('publicacion')
+    return {
+        'id': '%x' % time.time_ns(),
+        'estado': 'en_cola',
+        'etapas': etapas,
+        'etapa': None,
+        'detalle': None,
+        'progreso': 0.0,
+        'creado': time.time(),
+        'actualizado': time.time(),
+    }
+
+
+def _escribir(trabajo):
+    base = snapshot.directorio()
+    os.makedirs(base, exist_ok=True)
+    temporal = os.path.join(base, '%s.%d.tmp' % (ESTADO, threading.get_ident()))
+    with open(temporal, 'w') as f:
+        json.dump(trabajo, f)
+    os.replace(temporal, os.path.join(base, ESTADO))
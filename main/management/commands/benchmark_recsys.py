@@ -0,0 +1,35 @@
+#encoding:utf-8
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Mide importación, carga del modelo, recomendaciones y vistas sobre datos sintéticos, en JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', type=float, default=1, help='1, 10, 100, 1000...')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--muestra', type=int, default=50, help='usuarios de la muestra de consultas')
+        parser.add_argument('--salida', default=None, help='fichero JSON de resultados (por defecto, la salida estándar)')
+        parser.add_argument('--umbrales', default=None,
+                            help='fichero JSON {"paso.metrica": máximo}; falla si se supera alguno')
+
+    def handle(self, *args, **options):
+        informe = benchmark.ejecutar(escala=options['escala'], semilla=options['semilla'], muestra=options['muestra'],
+                                     informar=lambda paso: self.stderr.write('... %s' % paso))
+        if options['umbrales']:
+            with open(options['umbrales']) as f:
+                informe['fallos'] = benchmark.comprobar(informe['resultados'], json.load(f))
+
+        texto = json.dumps(informe, indent=2, sort_keys=True)
+        if options['salida']:
+            with open(options['salida'], 'w') as f:
+                f.write(texto)
+        else:
+            sys.stdout.write(texto + '\n')
+        if informe.get('fallos'):
+            raise CommandError('Umbrales superados:\n' + '\n'.join(informe['fallos']))
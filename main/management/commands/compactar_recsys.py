@@ -0,0 +1,15 @@
+#encoding:utf-8
+from django.core.management.base import BaseCommand
+
+from main import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Reconcilia el modelo de recomendación con la BD y publica un snapshot nuevo'
+
+    def handle(self, *args, **options):
+        version = recommendations.compactarModelo()
+        stats = recommendations.estadisticas_carga
+        self.stdout.write(self.style.SUCCESS(
+            'Snapshot %s: %d puntuaciones de %d usuarios en %.2f s' % (
+                version, stats['puntuaciones'], stats['usuarios'], stats['segundos'])))
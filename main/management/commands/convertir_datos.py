@@ -0,0 +1,25 @@
+#encoding:utf-8
+import os
+
+from django.core.management.base import BaseCommand
+
+from main import columnar, populateDB
+
+
+class Command(BaseCommand):
+    help = 'Convierte los ficheros de datos a la caché columnar que leen la importación y el modelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=['txt', 'csv'], default='txt')
+        parser.add_argument('--directorio', default=None,
+                            help='directorio con movies1.* y ratings.* (por defecto data/)')
+        parser.add_argument('--forzar', action='store_true',
+                            help='convierte aunque la caché esté al día')
+
+    def handle(self, *args, **options):
+        directorio = options['directorio'] or populateDB.path
+        formato = options['formato']
+        peliculas = columnar.peliculas(os.path.join(directorio, 'movies1.' + formato), formato, options['forzar'])
+        puntuaciones = columnar.puntuaciones(os.path.join(directorio, 'ratings.' + formato), formato, options['forzar'])
+        self.stdout.write(self.style.SUCCESS('%d películas y %d puntuaciones en %s' % (
+            len(peliculas['ids']), len(puntuaciones['usuarios']), columnar.directorio())))
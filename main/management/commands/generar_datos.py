@@ -0,0 +1,18 @@
+#encoding:utf-8
+from django.core.management.base import BaseCommand
+
+from main import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Genera movies1.txt y ratings.txt sintéticos a la escala indicada (1 = tamaño del dataset incluido)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directorio')
+        parser.add_argument('--escala', type=float, default=1)
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        datos = synthetic.generar(options['directorio'], escala=options['escala'], semilla=options['semilla'])
+        self.stdout.write(self.style.SUCCESS('%d películas, %d usuarios y %d puntuaciones en %s' % (
+            datos['peliculas'], datos['usuarios'], datos['puntuaciones'], options['directorio'])))
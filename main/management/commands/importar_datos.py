@@ -0,0 +1,23 @@
+#encoding:utf-8
+from django.core.management.base import BaseCommand
+
+from main import populateDB
+
+
+class Command(BaseCommand):
+    help = 'Importa películas y puntuaciones desde los ficheros de datos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modo', choices=['truncate', 'append'], default='truncate',
+                            help='truncate borra y recarga; append inserta o actualiza')
+        parser.add_argument('--formato', choices=['txt', 'csv'], default='txt')
+        parser.add_argument('--directorio', default=None,
+                            help='directorio con movies1.* y ratings.* (por defecto data/)')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        stats = populateDB.populate(modo=options['modo'], formato=options['formato'],
+                                    directorio=options['directorio'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            '%d películas y %d puntuaciones en %.2f s (%.0f puntuaciones/s)' % (
+                stats['peliculas'], stats['puntuaciones'], stats['segundos'], stats['puntuaciones_por_segundo'])))
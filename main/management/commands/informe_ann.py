@@ -0,0 +1,69 @@
+#encoding:utf-8
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import recommendations
+from main.ann import IndiceLSH
+
+
+class Command(BaseCommand):
+    help = 'Mide la exhaustividad (recall@k) y la latencia del índice aproximado de vecinos frente a topMatches exacto'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10, help='vecinos comparados por usuario')
+        parser.add_argument('--muestra', type=int, default=200, help='usuarios de la muestra')
+        parser.add_argument('--tablas', type=int, default=None)
+        parser.add_argument('--bits', type=int, default=None)
+        parser.add_argument('--sondeos', type=int, default=None)
+        parser.add_argument('--min-comunes', type=int, default=None)
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        tablas = options['tablas'] or getattr(settings, 'RECSYS_ANN_TABLAS', 16)
+        bits = options['bits'] or getattr(settings, 'RECSYS_ANN_BITS', 4)
+        sondeos = options['sondeos'] if options['sondeos'] is not None else getattr(settings, 'RECSYS_ANN_SONDEOS', 1)
+        k = options['k']
+        min_comunes = options['min_comunes'] or recommendations.min_comunes()
+
+        matriz = recommendations.asegurarModelo().matriz
+        inicio = time.perf_counter()
+        indice = IndiceLSH.from_prefs(matriz, tablas=tablas, bits=bits)
+        construccion = time.perf_counter() - inicio
+
+        usuarios = list(matriz)
+        muestra = random.Random(options['semilla']).sample(usuarios, min(options['muestra'], len(usuarios)))
+        aciertos = relevantes = candidatos = 0
+        t_exacto = t_aprox = 0.0
+        for person in muestra:
+            inicio = time.perf_counter()
+            exactos = matriz.topMatches(person, n=k, min_comunes=min_comunes)
+            t_exacto += time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            filas = indice.candidatos(matriz, person, sondeos=sondeos)
+            aproximados = matriz.topMatches(person, n=k, min_comunes=min_comunes, filas=filas)
+            t_aprox += time.perf_counter() - inicio
+
+            # Solo cuentan los vecinos con similaridad positiva: los de
+            # similaridad 0 que completan la lista exacta son arbitrarios
+            esperados = {other for sim, other in exactos if sim > 0}
+            aciertos += len(esperados & {other for _, other in aproximados})
+            relevantes += len(esperados)
+            candidatos += len(filas)
+
+        n = max(len(muestra), 1)
+        self.stdout.write('tablas=%d bits=%d sondeos=%d, índice construido en %.2f s' % (
+            tablas, bits, sondeos, construccion))
+        self.stdout.write('candidatos por consulta: %.1f de %d usuarios (%.1f%%)' % (
+            candidatos / n, len(usuarios), 100.0 * candidatos / n / max(len(usuarios), 1)))
+        self.stdout.write('latencia media: exacto %.2f ms, aproximado %.2f ms' % (
+            1000 * t_exacto / n, 1000 * t_aprox / n))
+        self.stdout.write(self.style.SUCCESS('recall@%d: %.3f (%d usuarios)' % (
+            k, aciertos / relevantes if relevantes else 1.0, len(muestra))))
+        minimo = getattr(settings, 'RECSYS_ANN_MIN_USUARIOS', 1000000)
+        if len(usuarios) < minimo:
+            self.stdout.write(self.style.WARNING(
+                'con menos de %d usuarios (RECSYS_ANN_MIN_USUARIOS) se usa siempre la búsqueda exacta' % minimo))
@@ -0,0 +1,29 @@
+#encoding:utf-8
+from django.core.management.base import BaseCommand
+
+from main import precompute
+
+
+class Command(BaseCommand):
+    help = 'Calcula en paralelo las mejores recomendaciones de cada usuario y las guarda en RecomendacionPrecalculada'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--n', type=int, default=None,
+                            help='recomendaciones por usuario (por defecto RECSYS_PRECALCULO_N)')
+        parser.add_argument('--procesos', type=int, default=None, help='procesos del pool (por defecto, uno por CPU)')
+        parser.add_argument('--lote', type=int, default=None, help='usuarios por tramo')
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='descarta lo ya calculado para este modelo en lugar de reanudar')
+
+    def handle(self, *args, **options):
+        def informar(stats):
+            self.stdout.write('%d usuarios en %.1f s' % (stats['usuarios'], stats['segundos']))
+
+        stats = precompute.precalcular(n=options['n'], procesos=options['procesos'], lote=options['lote'],
+                                       reiniciar=options['reiniciar'], informar=informar)
+        for pid, proceso in sorted(stats['procesos'].items()):
+            self.stdout.write('proceso %d: %d usuarios, %.0f usuarios/s' % (
+                pid, proceso['usuarios'], proceso['usuarios_por_segundo']))
+        self.stdout.write(self.style.SUCCESS(
+            '%d usuarios calculados y %d ya hechos en %.2f s (modelo %s)' % (
+                stats['usuarios'], stats['saltados'], stats['segundos'], stats['version'])))
@@ -0,0 +1,34 @@
+#encoding:utf-8
+from django.core.management.base import BaseCommand, CommandError
+
+from main import jobs
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta el trabajo de reconstrucción del modelo (importación opcional, preferencias, similitud y publicación)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--importar', action='store_true',
+                            help='importa antes los ficheros de datos')
+        parser.add_argument('--modo', choices=['truncate', 'append'], default='truncate')
+        parser.add_argument('--formato', choices=['txt', 'csv'], default='txt')
+        parser.add_argument('--directorio', default=None)
+
+    def handle(self, *args, **options):
+        vistas = set()
+
+        def informar(trabajo):
+            clave = (trabajo['etapa'], trabajo['detalle'])
+            if trabajo['estado'] == 'ejecutando' and trabajo['etapa'] and clave not in vistas:
+                vistas.add(clave)
+                self.stdout.write('[%3.0f%%] %s%s' % (100 * trabajo['progreso'], trabajo['etapa'],
+                                                      ': ' + trabajo['detalle'] if trabajo['detalle'] else ''))
+
+        opciones = {'modo': options['modo'], 'formato': options['formato'], 'directorio': options['directorio']}
+        trabajo = jobs.ejecutar(importar=options['importar'], opciones=opciones, informar=informar)
+        if trabajo['estado'] != 'completado':
+            raise CommandError(trabajo.get('error'))
+        stats = trabajo['estadisticas']
+        self.stdout.write(self.style.SUCCESS(
+            'Snapshot %s: %d puntuaciones de %d usuarios en %.2f s' % (
+                trabajo['version'], stats['puntuaciones'], stats['usuarios'], stats['segundos'])))
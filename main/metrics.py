@@ -0,0 +1,170 @@
+#encoding:utf-8
+"""
+Métricas de rendimiento del proceso en formato de texto de Prometheus
+
+Contadores, valores e histogramas con etiquetas, en memoria y protegidos por
+un cerrojo. Cada proceso (worker) lleva los suyos: Prometheus debe leer
+/metrics de cada uno por separado
+
+etapa() mide una parte de una consulta (candidatos, similitud, puntuacion,
+filtro_fecha, metadatos...) y, si hay una petición en curso (ver
+main/middleware.py), la anota también en ella con las consultas SQL que se
+hicieron dentro
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+CUBOS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CUBOS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Texto de ayuda y cubos de cada histograma (por defecto, CUBOS_SEGUNDOS)
+AYUDA = {
+    'recsys_peticion_segundos': 'Duración de las peticiones HTTP por vista, método y estado',
+    'recsys_peticion_consultas': 'Consultas SQL por petición HTTP',
+    'recsys_etapa_segundos': 'Duración de cada etapa de una consulta de recomendación',
+    'recsys_etapa_consultas': 'Consultas SQL hechas dentro de cada etapa',
+    'recsys_modelo_carga_segundos': 'Duración de las cargas y reconstrucciones del modelo',
+    'recsys_modelo_etapa_segundos': 'Duración de cada etapa de la construcción del modelo',
+    'recsys_perfiles_total': 'Perfiles de peticiones lentas guardados en disco',
+    'recsys_ejecutor_espera_segundos': 'Espera en cola de las consultas lanzadas desde vistas asíncronas',
+    'recsys_ejecutor_rechazadas_total': 'Consultas rechazadas por tener la cola del ejecutor llena',
+    'recsys_ejecutor_caducadas_total': 'Consultas que superaron RECSYS_ASYNC_TIMEOUT',
+}
+CUBOS = {
+    'recsys_peticion_consultas': CUBOS_CONSULTAS,
+    'recsys_etapa_consultas': CUBOS_CONSULTAS,
+}
+
+_cerrojo = threading.Lock()
+_contadores = {}
+_valores = {}
+_histogramas = {}
+
+# Etapas de la petición en curso: {'consultas': n, 'etapas': {nombre: [segundos, consultas]}}
+peticion = ContextVar('recsys_peticion', default=None)
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    clave = (nombre, _etiquetas(etiquetas))
+    with _cerrojo:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def fijar(nombre, valor, **etiquetas):
+    with _cerrojo:
+        _valores[(nombre, _etiquetas(etiquetas))] = valor
+
+
+def observar(nombre, valor, **etiquetas):
+    clave = (nombre, _etiquetas(etiquetas))
+    cubos = CUBOS.get(nombre, CUBOS_SEGUNDOS)
+    with _cerrojo:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = [[0] * len(cubos), 0, 0.0]
+        cuentas = histograma[0]
+        for i, limite in enumerate(cubos):
+            if valor <= limite:
+                cuentas[i] += 1
+        histograma[1] += 1
+        histograma[2] += valor
+
+
+@contextmanager
+def cronometro(nombre, **etiquetas):
+    """
+    Observa en el histograma nombre los segundos que dura el bloque
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+
+@contextmanager
+def etapa(nombre):
+    """
+    Mide una etapa de una consulta de recomendación
+    Las etapas anidadas se miden cada una por su cuenta
+    """
+    actual = peticion.get()
+    consultas = actual['consultas'] if actual is not None else 0
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        observar('recsys_etapa_segundos', segundos, etapa=nombre)
+        if actual is not None:
+            hechas = actual['consultas'] - consultas
+            if hechas:
+                observar('recsys_etapa_consultas', hechas, etapa=nombre)
+            acumulado = actual['etapas'].setdefault(nombre, [0.0, 0])
+            acumulado[0] += segundos
+            acumulado[1] += hechas
+
+
+def exportar(extra=()):
+    """
+    Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)
+    extra: tuplas (nombre, valor, etiquetas) de valores calculados al exportar
+    """
+    with _cerrojo:
+        contadores = sorted(_contadores.items())
+        valores = sorted(_valores.items())
+        histogramas = sorted((clave, (list(h[0]), h[1], h[2])) for clave, h in _histogramas.items())
+    valores += sorted(((nombre, _etiquetas(etiquetas)), valor) for nombre, valor, etiquetas in extra)
+
+    lineas = []
+    vistos = set()
+
+    def cabecera(nombre, tipo):
+        if nombre not in vistos:
+            vistos.add(nombre)
+            if nombre in AYUDA:
+                lineas.append('# HELP %s %s' % (nombre, AYUDA[nombre]))
+            lineas.append('# TYPE %s %s' % (nombre, tipo))
+
+    for (nombre, etiquetas), valor in contadores:
+        cabecera(nombre, 'counter')
+        lineas.append('%s%s %s' % (nombre, _texto(etiquetas), _numero(valor)))
+    for (nombre, etiquetas), valor in valores:
+        cabecera(nombre, 'gauge')
+        lineas.append('%s%s %s' % (nombre, _texto(etiquetas), _numero(valor)))
+    for (nombre, etiquetas), (cuentas, total, suma) in histogramas:
+        cabecera(nombre, 'histogram')
+        for limite, cuenta in zip(CUBOS.get(nombre, CUBOS_SEGUNDOS), cuentas):
+            lineas.append('%s_bucket%s %d' % (nombre, _texto(etiquetas + (('le', _numero(limite)),)), cuenta))
+        lineas.append('%s_bucket%s %d' % (nombre, _texto(etiquetas + (('le', '+Inf'),)), total))
+        lineas.append('%s_sum%s %s' % (nombre, _texto(etiquetas), _numero(suma)))
+        lineas.append('%s_count%s %d' % (nombre, _texto(etiquetas), total))
+    return '\n'.join(lineas) + '\n'
+
+
+def limpiar():
+    with _cerrojo:
+        _contadores.clear()
+        _valores.clear()
+        _histogramas.clear()
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((clave, str(valor)) for clave, valor in etiquetas.items()))
+
+
+def _texto(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (clave, valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for clave, valor in etiquetas)
+
+
+def _numero(valor):
+    if isinstance(valor, bool):
+        return '1' if valor else '0'
+    if isinstance(valor, int):
+        return str(valor)
+    return repr(float(valor))
@@ -0,0 +1,180 @@
+#encoding:utf-8
+"""
+Instrumentación de las peticiones HTTP (ver main/metrics.py)
+
+MiddlewareMetricas mide la duración y las consultas SQL de cada petición
+y de sus etapas, las añade a las métricas del proceso y las devuelve en la
+cabecera Server-Timing. En las respuestas en streaming solo se mide hasta
+que empieza el envío. Funciona con vistas síncronas y asíncronas: las
+consultas se atribuyen a la petición por su contexto, así que cuentan
+también las del ORM asíncrono y las del pool de main/ejecutor.py
+
+Con RECSYS_PERFIL_MUESTREO > 0 se perfila con cProfile esa fracción de las
+peticiones síncronas (de una en una) y se guardan en RECSYS_PERFIL_DIR las
+que tardan al menos RECSYS_PERFIL_LENTO segundos, para abrirlas con pstats
+o snakeviz. De las asíncronas no se perfila el bucle de eventos, que
+mezclaría las demás peticiones, sino cada cálculo que lanzan en su hilo de
+main/ejecutor.py (ver perfilar_tarea)
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from main import metrics
+
+# cProfile no admite dos perfiles activos a la vez
+_perfilando = threading.Lock()
+
+
+class MiddlewareMetricas:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        for conexion in connections.all(initialized_only=True):
+            instalar_contador(conexion)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self._acall(request)
+        estado = {'consultas': 0, 'etapas': {}}
+        token = metrics.peticion.set(estado)
+        perfil = self._perfil()
+        inicio = time.perf_counter()
+        try:
+            if perfil is not None:
+                perfil.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if perfil is not None:
+                    perfil.disable()
+        finally:
+            segundos = time.perf_counter() - inicio
+            metrics.peticion.reset(token)
+            if perfil is not None:
+                _perfilando.release()
+
+        if perfil is not None and segundos >= getattr(settings, 'RECSYS_PERFIL_LENTO', 0.5):
+            _guardar_perfil(perfil, _vista(request), segundos)
+        return _anotar(request, response, estado, segundos)
+
+    async def _acall(self, request):
+        estado = {'consultas': 0, 'etapas': {}}
+        if _muestrear():
+            # Las tareas del ejecutor heredan estado y se perfilan en su hilo
+            estado['perfilar'] = request
+        token = metrics.peticion.set(estado)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            segundos = time.perf_counter() - inicio
+            metrics.peticion.reset(token)
+        return _anotar(request, response, estado, segundos)
+
+    def _perfil(self):
+        if not _muestrear() or not _perfilando.acquire(blocking=False):
+            return None
+        return cProfile.Profile()
+
+
+def perfilar_tarea(funcion, *args, **kwargs):
+    """
+    Ejecuta funcion(*args, **kwargs) en el hilo actual; si la petición en
+    curso se eligió para perfilar, con cProfile activo en este hilo, y el
+    perfil se guarda si tarda al menos RECSYS_PERFIL_LENTO segundos
+    (main/ejecutor.py la usa para cada tarea de una vista asíncrona)
+    """
+    estado = metrics.peticion.get()
+    request = estado.get('perfilar') if estado is not None else None
+    if request is None or not _perfilando.acquire(blocking=False):
+        return funcion(*args, **kwargs)
+    perfil = cProfile.Profile()
+    inicio = time.perf_counter()
+    try:
+        perfil.enable()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            perfil.disable()
+    finally:
+        segundos = time.perf_counter() - inicio
+        _perfilando.release()
+        if segundos >= getattr(settings, 'RECSYS_PERFIL_LENTO', 0.5):
+            _guardar_perfil(perfil, _vista(request), segundos)
+
+
+def _muestrear():
+    muestreo = getattr(settings, 'RECSYS_PERFIL_MUESTREO', 0)
+    return bool(muestreo) and random.random() < muestreo
+
+
+def instalar_contador(connection, **kwargs):
+    """
+    Añade a la conexión el contador de consultas de la petición en curso
+    (receptor de connection_created: cada hilo abre sus conexiones)
+    """
+    if _contar not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_contar)
+
+
+connection_created.connect(instalar_contador)
+
+
+def _contar(execute, sql, params, many, context):
+    estado = metrics.peticion.get()
+    if estado is not None:
+        estado['consultas'] += 1
+    return execute(sql, params, many, context)
+
+
+def _anotar(request, response, estado, segundos):
+    vista = _vista(request)
+    metrics.observar('recsys_peticion_segundos', segundos,
+                     vista=vista, metodo=request.method, estado=response.status_code)
+    metrics.observar('recsys_peticion_consultas', estado['consultas'], vista=vista)
+
+    partes = ['%s;dur=%.2f;desc="%d consultas"' % (nombre, s * 1000, consultas)
+              for nombre, (s, consultas) in estado['etapas'].items()]
+    partes.append('total;dur=%.2f;desc="%d consultas"' % (segundos * 1000, estado['consultas']))
+    response['Server-Timing'] = ', '.join(partes)
+    return response
+
+
+def _vista(request):
+    # Nombre de la URL, no la ruta: las etiquetas no deben crecer sin límite
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return 'desconocida'
+    return coincidencia.view_name or coincidencia._func_path
+
+
+def _guardar_perfil(perfil, vista, segundos):
+    directorio = getattr(settings, 'RECSYS_PERFIL_DIR', None) or os.path.join(settings.BASE_DIR, 'perfiles')
+    os.makedirs(directorio, exist_ok=True)
+    # Con las tareas del ejecutor puede haber varios perfiles por segundo
+    nombre = '%s-%s-%dms-%x.prof' % (time.strftime('%Y%m%d-%H%M%S'), vista.replace(':', '_'), segundos * 1000,
+                                     time.time_ns())
+    perfil.dump_stats(os.path.join(directorio, nombre))
+    metrics.incrementar('recsys_perfiles_total', vista=vista)
+
+    # Solo se guardan los RECSYS_PERFIL_MAX más recientes
+    maximo = getattr(settings, 'RECSYS_PERFIL_MAX', 100)
+    perfiles = sorted(f for f in os.listdir(directorio) if f.endswith('.prof'))
+    for antiguo in perfiles[:max(len(perfiles) - maximo, 0)]:
+        try:
+            os.remove(os.path.join(directorio, antiguo))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+def indexar_actores(apps, schema_editor):
+    # Índice actor -> películas para las películas ya cargadas
+    Pelicula = apps.get_model('main', 'Pelicula')
+    Actor = apps.get_model('main', 'Actor')
+    reparto = {}
+    for id_pelicula, texto in Pelicula.objects.values_list('idPelicula', 'actoresPrincipales').iterator():
+        for nombre in dict.fromkeys(' '.join(a.split()) for a in (texto or '').split(',')):
+            if nombre:
+                reparto.setdefault(nombre, []).append(id_pelicula)
+    Actor.objects.bulk_create([Actor(nombre=nombre) for nombre in reparto], batch_size=1000)
+    ids = dict(Actor.objects.values_list('nombre', 'id'))
+    Reparto = Actor.peliculas.through
+    Reparto.objects.bulk_create([Reparto(actor_id=ids[nombre], pelicula_id=id_pelicula)
+                                 for nombre, peliculas in reparto.items() for id_pelicula in peliculas],
+                                batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Actor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, unique=True, verbose_name='Nombre')),
+                ('peliculas', models.ManyToManyField(related_name='actores', to='main.pelicula')),
+            ],
+            options={
+                'ordering': ('nombre',),
+            },
+        ),
+        migrations.RunPython(indexar_actores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def contar_puntuaciones(apps, schema_editor):
+    # Recuentos por usuario de las puntuaciones ya cargadas
+    Puntuacion = apps.get_model('main', 'Puntuacion')
+    ActividadUsuario = apps.get_model('main', 'ActividadUsuario')
+    recuentos = Puntuacion.objects.values_list('idUsuario').annotate(n=Count('id')).order_by()
+    ActividadUsuario.objects.bulk_create(
+        [ActividadUsuario(idUsuario=usuario, numPuntuaciones=n) for usuario, n in recuentos.iterator()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_actor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActividadUsuario',
+            fields=[
+                ('idUsuario', models.IntegerField(primary_key=True, serialize=False, verbose_name='ID Usuario')),
+                ('numPuntuaciones', models.IntegerField(default=0, verbose_name='Número de Puntuaciones')),
+            ],
+            options={
+                'ordering': ('-numPuntuaciones', 'idUsuario'),
+                'indexes': [models.Index(fields=['-numPuntuaciones', 'idUsuario'], name='actividad_ranking_idx')],
+            },
+        ),
+        migrations.RunPython(contar_puntuaciones, migrations.RunPython.noop),
+    ]
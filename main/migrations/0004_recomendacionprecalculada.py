@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_actividadusuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecomendacionPrecalculada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idUsuario', models.IntegerField(verbose_name='ID Usuario')),
+                ('posicion', models.PositiveSmallIntegerField(verbose_name='Posición')),
+                ('recomendacion', models.FloatField(verbose_name='Recomendación')),
+                ('version', models.CharField(max_length=64, verbose_name='Versión del modelo')),
+                ('completa', models.BooleanField(default=False)),
+                ('pelicula', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.pelicula')),
+            ],
+            options={
+                'ordering': ('idUsuario', 'posicion'),
+                'indexes': [models.Index(fields=['version', 'idUsuario'], name='precalculada_version_idx')],
+                'unique_together': {('idUsuario', 'posicion')},
+            },
+        ),
+    ]
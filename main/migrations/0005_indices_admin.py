@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_recomendacionprecalculada'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='pelicula',
+            options={'ordering': ('titulo',), 'verbose_name': 'película'},
+        ),
+        migrations.AlterModelOptions(
+            name='puntuacion',
+            options={'ordering': ('idUsuario', 'pelicula'), 'verbose_name': 'puntuación', 'verbose_name_plural': 'puntuaciones'},
+        ),
+        migrations.AddIndex(
+            model_name='pelicula',
+            index=models.Index(fields=['titulo'], name='pelicula_titulo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='puntuacion',
+            index=models.Index(fields=['puntuacion', 'id'], name='puntuacion_valor_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+def crear_revision(apps, schema_editor):
+    # La única fila del contador; los snapshots anteriores no coinciden con
+    # ella y se reconstruyen una vez
+    RevisionDatos = apps.get_model('main', 'RevisionDatos')
+    RevisionDatos.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_indices_admin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevisionDatos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.BigIntegerField(default=0, verbose_name='Revisión')),
+            ],
+        ),
+        migrations.RunPython(crear_revision, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+def marcar_precalculados(apps, schema_editor):
+    # Usuarios con filas ya precalculadas; los de lista vacía se recalculan una vez
+    RecomendacionPrecalculada = apps.get_model('main', 'RecomendacionPrecalculada')
+    PrecalculoUsuario = apps.get_model('main', 'PrecalculoUsuario')
+    usuarios = RecomendacionPrecalculada.objects.values_list('idUsuario', 'version').distinct().order_by()
+    PrecalculoUsuario.objects.bulk_create(
+        [PrecalculoUsuario(idUsuario=usuario, version=version) for usuario, version in usuarios.iterator()],
+        batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_revisiondatos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecalculoUsuario',
+            fields=[
+                ('idUsuario', models.IntegerField(primary_key=True, serialize=False, verbose_name='ID Usuario')),
+                ('version', models.CharField(max_length=64, verbose_name='Versión del modelo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['version', 'idUsuario'], name='precalculo_version_idx')],
+            },
+        ),
+        migrations.RunPython(marcar_precalculados, migrations.RunPython.noop),
+    ]
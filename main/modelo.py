@@ -0,0 +1,71 @@
+#encoding:utf-8
+"""
+Versión inmutable del modelo de recomendación que sirve el proceso
+
+Todas las piezas de una versión (matriz, índices, factores, huella...) van
+juntas en un Modelo que no se modifica una vez publicado. Una recarga o una
+actualización incremental construye aparte un Modelo nuevo y lo publica
+sustituyendo una sola referencia (ver recommendations.publicar). Cada
+consulta toma esa referencia una vez al empezar, así que nunca mezcla piezas
+de dos versiones ni ve un modelo a medio cargar, y no necesita cerrojos
+
+Una versión se libera al terminar la última consulta que la usaba; sus
+arrays mapeados siguen siendo válidos aunque el snapshot ya se haya purgado
+del disco
+"""
+from main.sparse import IndiceInvertido
+
+
+class Modelo:
+    """
+    matriz: SparsePrefs (None mientras no hay modelo cargado)
+    itemsim: vecinos por película (ListasVecinos o diccionario)
+    fechas: IndiceFechas; ann: IndiceLSH o None; factores: FactoresLatentes o None
+    populares: RankingPopular o None (se construye bajo demanda)
+    huella: huella de la BD que refleja; version: snapshot del que sale
+    itemsim_pendientes: películas cuya lista de itemsim puede haber cambiado
+    desde que se calculó (todas las de los usuarios actualizados); se
+    recalculan al leerlas (ver recommendations.vecinosItems)
+    """
+
+    CAMPOS = ('matriz', 'itemsim', 'fechas', 'ann', 'factores', 'populares', 'huella', 'version',
+              'itemsim_pendientes')
+    __slots__ = CAMPOS + ('raters',)
+
+    def __init__(self, matriz=None, itemsim=None, fechas=None, ann=None, factores=None, populares=None,
+                 huella=None, version=None, itemsim_pendientes=frozenset()):
+        valores = dict(matriz=matriz, itemsim=itemsim if itemsim is not None else {}, fechas=fechas, ann=ann,
+                       factores=factores, populares=populares, huella=huella, version=version,
+                       itemsim_pendientes=frozenset(itemsim_pendientes))
+        # Índice invertido película -> {usuario: puntuacion} sobre la matriz
+        valores['raters'] = IndiceInvertido(matriz) if matriz is not None else None
+        for nombre, valor in valores.items():
+            object.__setattr__(self, nombre, valor)
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError('Modelo es inmutable: usa con() para obtener una versión nueva')
+
+    @property
+    def prefs(self):
+        """
+        La matriz, que se comporta como el diccionario prefs de siempre
+        """
+        return self.matriz if self.matriz is not None else {}
+
+    def con(self, **cambios):
+        """
+        Retorna: copia del modelo con los campos indicados sustituidos
+        """
+        valores = {nombre: getattr(self, nombre) for nombre in self.CAMPOS}
+        valores.update(cambios)
+        return Modelo(**valores)
+
+    def con_puntuaciones(self, idUsuario, ratings, idPelicula, huella):
+        """
+        Retorna: copia del modelo con las puntuaciones de idUsuario
+        sustituidas por ratings (ver SparsePrefs.con) y marcadas como
+        pendientes en itemsim idPelicula y las demás películas del usuario,
+        cuya similaridad con ella ha cambiado
+        """
+        return self.con(matriz=self.matriz.con(idUsuario, ratings), huella=huella,
+                        itemsim_pendientes=self.itemsim_pendientes | {idPelicula} | set(ratings))
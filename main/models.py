@@ -3,6 +3,20 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+def normalizar_actor(nombre):
+    """
+    Forma canónica de un nombre de actor: sin espacios sobrantes
+    """
+    return ' '.join(nombre.split())
+
+def normalizar_actores(texto):
+    """
+    Separa la lista de actores (por comas) y normaliza cada nombre
+    """
+    if not texto:
+        return []
+    return list(dict.fromkeys(n for n in (normalizar_actor(a) for a in texto.split(',')) if n))
+
 class Pelicula(models.Model):
     idPelicula = models.IntegerField(primary_key=True)
     titulo = models.TextField(verbose_name='Título')
@@ -13,8 +27,26 @@ class Pelicula(models.Model):
     def __str__(self):
         return self.titulo
     
+    def reparto(self):
+        """
+        Nombres normalizados de los actores principales, sin repetidos
+        """
+        return normalizar_actores(self.actoresPrincipales)
+    
     class Meta:
         ordering = ('titulo', )
+        verbose_name = 'película'
+        indexes = [models.Index(fields=['titulo'], name='pelicula_titulo_idx')]
+
+class Actor(models.Model):
+    nombre = models.CharField(max_length=255, unique=True, verbose_name='Nombre')
+    peliculas = models.ManyToManyField(Pelicula, related_name='actores')
+
+    def __str__(self):
+        return self.nombre
+    
+    class Meta:
+        ordering = ('nombre', )
 
 class Puntuacion(models.Model):
     idUsuario = models.IntegerField(verbose_name='ID Usuario')
@@ -30,3 +62,71 @@ class Puntuacion(models.Model):
     class Meta:
         ordering = ('idUsuario', 'pelicula')
         unique_together = ('idUsuario', 'pelicula')
+        verbose_name = 'puntuación'
+        verbose_name_plural = 'puntuaciones'
+        # Filtro por puntuación del admin, ordenado por clave (ver main/admin.py)
+        indexes = [models.Index(fields=['puntuacion', 'id'], name='puntuacion_valor_idx')]
+
+class ActividadUsuario(models.Model):
+    """
+    Número de puntuaciones de cada usuario, materializado para no agrupar
+    toda la tabla Puntuacion en cada consulta de usuarios más activos
+    Se mantiene al importar y con las señales de Puntuacion
+    """
+    idUsuario = models.IntegerField(primary_key=True, verbose_name='ID Usuario')
+    numPuntuaciones = models.IntegerField(default=0, verbose_name='Número de Puntuaciones')
+
+    def __str__(self):
+        return f"Usuario {self.idUsuario}: {self.numPuntuaciones} puntuaciones"
+    
+    class Meta:
+        ordering = ('-numPuntuaciones', 'idUsuario')
+        indexes = [models.Index(fields=['-numPuntuaciones', 'idUsuario'], name='actividad_ranking_idx')]
+
+class RecomendacionPrecalculada(models.Model):
+    """
+    Mejores recomendaciones de cada usuario calculadas por adelantado con
+    python manage.py precalcular_recomendaciones
+    version identifica el modelo (y el método) con el que se calcularon;
+    completa indica que la lista no se cortó en el máximo de películas
+    """
+    idUsuario = models.IntegerField(verbose_name='ID Usuario')
+    posicion = models.PositiveSmallIntegerField(verbose_name='Posición')
+    pelicula = models.ForeignKey(Pelicula, on_delete=models.CASCADE)
+    recomendacion = models.FloatField(verbose_name='Recomendación')
+    version = models.CharField(max_length=64, verbose_name='Versión del modelo')
+    completa = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Usuario {self.idUsuario} - {self.posicion}: {self.pelicula_id} ({self.recomendacion:.2f})"
+    
+    class Meta:
+        ordering = ('idUsuario', 'posicion')
+        unique_together = ('idUsuario', 'posicion')
+        indexes = [models.Index(fields=['version', 'idUsuario'], name='precalculada_version_idx')]
+
+class PrecalculoUsuario(models.Model):
+    """
+    Usuarios cuyas recomendaciones ya se han precalculado con una versión
+    del modelo, también los que no tienen ninguna: un precálculo
+    interrumpido se reanuda con los que faltan
+    """
+    idUsuario = models.IntegerField(primary_key=True, verbose_name='ID Usuario')
+    version = models.CharField(max_length=64, verbose_name='Versión del modelo')
+
+    def __str__(self):
+        return f"Usuario {self.idUsuario} ({self.version})"
+    
+    class Meta:
+        indexes = [models.Index(fields=['version', 'idUsuario'], name='precalculo_version_idx')]
+
+class RevisionDatos(models.Model):
+    """
+    Contador con una sola fila que aumenta con cada cambio en películas o
+    puntuaciones (ver snapshot.nueva_revision); es la huella con la que se
+    comprueba si un modelo o un snapshot reflejan la BD
+    """
+    revision = models.BigIntegerField(default=0, verbose_name='Revisión')
+
+    def __str__(self):
+        return f"Revisión {self.revision}"
@@ -1,75 +1,239 @@
-from main.models import Pelicula, Puntuacion
-from datetime import datetime
+from main.models import (ActividadUsuario, Actor, Pelicula, PrecalculoUsuario, Puntuacion,
+                         RecomendacionPrecalculada, normalizar_actores)
+from main import columnar, signals, snapshot
+from contextlib import contextmanager
+from itertools import islice
 import os
+import time
+import numpy as np
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
 
 
 path = os.path.join(settings.BASE_DIR, "data")
 
-def populate():
-    m = populateMovies()
-    populateRatings(m)
-
-def populateMovies():
-    Pelicula.objects.all().delete()
-    
-    lista_peliculas = []
-    dict_peliculas = {} 
-    
-    fileobj = open(os.path.join(path, "movies1.txt"), "r", encoding='utf-8')
-    for line in fileobj.readlines():
-        try:
-            rip = line.strip().split('\t')
-            
-            # YYYY-MM-DD
-            try:
-                fecha = datetime.strptime(rip[2], '%Y-%m-%d').date()
-            except:
-                fecha = None
-            
-            pelicula = Pelicula(
-                idPelicula=int(rip[0]),
-                titulo=rip[1] if len(rip) > 1 else '',
-                fecha=fecha,
-                director=rip[3] if len(rip) > 3 else '',
-                actoresPrincipales=rip[4] if len(rip) > 4 else ''
+# Pragmas de SQLite para cargas masivas dentro de una transacción
+PRAGMAS_CARGA = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': '-65536',
+}
+
+def populate(modo='truncate', formato='txt', directorio=None, batch_size=None, progreso=None):
+    """
+    Importa películas y puntuaciones desde la caché columnar de los ficheros
+    (ver main/columnar.py), que se convierten la primera vez
+    modo: 'truncate' borra y recarga todo; 'append' inserta lo nuevo y
+    actualiza lo existente (upsert)
+    formato: 'txt' (separado por tabuladores) o 'csv'
+    Todo se escribe en una única transacción, por lotes de batch_size filas
+    progreso (opcional) recibe ('peliculas' o 'puntuaciones', filas) tras cada lote
+    Retorna: diccionario con filas importadas, segundos, filas por segundo y
+    la huella de la BD al terminar (ver snapshot.huella_bd)
+    """
+    if modo not in ('truncate', 'append'):
+        raise ValueError("modo debe ser 'truncate' o 'append'")
+    directorio = directorio or path
+    batch_size = batch_size or getattr(settings, 'RECSYS_IMPORT_BATCH', 5000)
+    extension = 'txt' if formato == 'txt' else 'csv'
+    inicio = time.perf_counter()
+
+    with signals.sin_actualizaciones(), pragmas_carga(), transaction.atomic():
+        if modo == 'truncate':
+            for modelo in (Puntuacion, RecomendacionPrecalculada, PrecalculoUsuario, ActividadUsuario,
+                           Actor.peliculas.through, Actor, Pelicula):
+                vaciar(modelo)
+
+        num_peliculas = populateMovies(os.path.join(directorio, "movies1." + extension),
+                                       formato, batch_size, upsert=(modo == 'append'), progreso=progreso)
+        num_puntuaciones = populateRatings(os.path.join(directorio, "ratings." + extension),
+                                           formato, batch_size, upsert=(modo == 'append'), progreso=progreso)
+        contarActividad()
+        # bulk_create no envía señales
+        _, huella = snapshot.nueva_revision()
+
+    segundos = time.perf_counter() - inicio
+    return {
+        'peliculas': num_peliculas,
+        'puntuaciones': num_puntuaciones,
+        'segundos': segundos,
+        'puntuaciones_por_segundo': num_puntuaciones / segundos if segundos else 0,
+        'huella': huella,
+    }
+
+@contextmanager
+def pragmas_carga():
+    """
+    Relaja la durabilidad de SQLite durante la carga y la restaura al final
+    En otros motores, o dentro de una transacción ya abierta (SQLite no
+    deja cambiar synchronous en ella), no hace nada
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        anteriores = {}
+        for pragma, valor in PRAGMAS_CARGA.items():
+            cursor.execute('PRAGMA %s' % pragma)
+            anteriores[pragma] = cursor.fetchone()[0]
+            cursor.execute('PRAGMA %s = %s' % (pragma, valor))
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for pragma, valor in anteriores.items():
+                cursor.execute('PRAGMA %s = %s' % (pragma, valor))
+
+def vaciar(modelo):
+    """
+    Borra todas las filas de modelo con un solo DELETE: con receptores de
+    señales conectados, delete() las cargaría y notificaría una a una
+    Las tablas que apuntan a modelo deben vaciarse antes
+    """
+    modelo.objects.all()._raw_delete(modelo.objects.db)
+
+def lotes(iterable, tamano):
+    iterador = iter(iterable)
+    while True:
+        lote = list(islice(iterador, tamano))
+        if not lote:
+            return
+        yield lote
+
+def leerPeliculas(fichero, formato):
+    for id_pelicula, titulo, fecha, director, actores in columnar.filasPeliculas(columnar.peliculas(fichero, formato)):
+        yield Pelicula(
+            idPelicula=id_pelicula,
+            titulo=titulo,
+            fecha=fecha,
+            director=director,
+            actoresPrincipales=actores
+        )
+
+def columnasPuntuaciones(fichero, formato, peliculas):
+    """
+    Puntuaciones del fichero de películas existentes, como tres columnas
+    paralelas (usuarios, peliculas, puntuaciones) en el orden del fichero
+    peliculas: array o lista de ids de películas existentes
+    """
+    columnas = columnar.puntuaciones(fichero, formato)
+    validas = _existentes(columnas['peliculas'], np.unique(np.asarray(peliculas, dtype=np.int64)))
+    if validas.all():
+        return columnas['usuarios'], columnas['peliculas'], columnas['puntuaciones']
+    return columnas['usuarios'][validas], columnas['peliculas'][validas], columnas['puntuaciones'][validas]
+
+def _existentes(ids, peliculas):
+    # Máscara de los ids que están en peliculas (array ordenado)
+    if len(peliculas) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    k = np.minimum(np.searchsorted(peliculas, ids), len(peliculas) - 1)
+    return peliculas[k] == ids
+
+def leerPuntuaciones(fichero, formato, peliculas, bloque=5000):
+    # Las columnas se recorren por tramos de bloque filas: solo se crean los
+    # objetos de un lote a la vez
+    columnas = columnar.puntuaciones(fichero, formato)
+    peliculas = np.unique(np.asarray(peliculas, dtype=np.int64))
+    for inicio in range(0, len(columnas['usuarios']), bloque):
+        tramo = slice(inicio, inicio + bloque)
+        validas = _existentes(columnas['peliculas'][tramo], peliculas)
+        for usuario, pelicula, puntuacion in zip(columnas['usuarios'][tramo][validas].tolist(),
+                                                 columnas['peliculas'][tramo][validas].tolist(),
+                                                 columnas['puntuaciones'][tramo][validas].tolist()):
+            yield Puntuacion(
+                idUsuario=usuario,
+                pelicula_id=pelicula,
+                puntuacion=puntuacion
             )
-            lista_peliculas.append(pelicula)
-            dict_peliculas[int(rip[0])] = pelicula
-        except:
-            # Si hay error en alguna línea, la saltamos
-            continue
-    
-    fileobj.close()
-    Pelicula.objects.bulk_create(lista_peliculas)
-    
-    return dict_peliculas
-
-def populateRatings(m):
-    Puntuacion.objects.all().delete()
-    
-    lista = []
-    fileobj = open(os.path.join(path, "ratings.txt"), "r", encoding='utf-8')
-    for line in fileobj.readlines():
-        rip = line.strip().split('\t')
-        if len(rip) < 3:
-            continue
-        
-        id_pelicula = int(rip[1])
-        if id_pelicula in m:  
-            lista.append(Puntuacion(
-                idUsuario=int(rip[0]),
-                pelicula=m[id_pelicula],
-                puntuacion=int(rip[2])
-            ))
-    
-    fileobj.close()
-    Puntuacion.objects.bulk_create(lista)
+
+def puntuacionesImportadas(huella, formato='txt', directorio=None):
+    """
+    Puntuaciones que deja en la BD populate(modo='truncate'), leídas de la
+    caché columnar en vez de la BD (ver recommendations.leerMatriz)
+    huella: la que retorna populate
+    Retorna: (huella, usuarios, peliculas, puntuaciones)
+    """
+    directorio = directorio or path
+    extension = 'txt' if formato == 'txt' else 'csv'
+    peliculas = columnar.peliculas(os.path.join(directorio, "movies1." + extension), formato)['ids']
+    return (huella,) + columnasPuntuaciones(os.path.join(directorio, "ratings." + extension), formato, peliculas)
+
+def populateMovies(fichero, formato='txt', batch_size=5000, upsert=False, progreso=None):
+    """
+    Importa las películas por lotes y reconstruye el índice de actores
+    Retorna: número de películas leídas
+    """
+    opciones = {}
+    if upsert:
+        opciones = dict(update_conflicts=True, unique_fields=['idPelicula'],
+                        update_fields=['titulo', 'fecha', 'director', 'actoresPrincipales'])
+
+    total = 0
+    for lote in lotes(leerPeliculas(fichero, formato), batch_size):
+        Pelicula.objects.bulk_create(lote, batch_size=batch_size, **opciones)
+        total += len(lote)
+        if progreso is not None:
+            progreso('peliculas', total)
+
+    indexarActores(Pelicula.objects.values_list('idPelicula', 'actoresPrincipales').iterator())
+    return total
+
+def populateRatings(fichero, formato='txt', batch_size=5000, upsert=False, progreso=None):
+    """
+    Importa las puntuaciones por lotes, descartando las de películas inexistentes
+    Retorna: número de puntuaciones leídas
+    """
+    opciones = {}
+    if upsert:
+        opciones = dict(update_conflicts=True, unique_fields=['idUsuario', 'pelicula'],
+                        update_fields=['puntuacion'])
+
+    peliculas = list(Pelicula.objects.values_list('idPelicula', flat=True))
+    total = 0
+    for lote in lotes(leerPuntuaciones(fichero, formato, peliculas, batch_size), batch_size):
+        Puntuacion.objects.bulk_create(lote, batch_size=batch_size, **opciones)
+        total += len(lote)
+        if progreso is not None:
+            progreso('puntuaciones', total)
+
+    return total
+
+def indexarActores(peliculas):
+    """
+    Construye el índice invertido actor -> películas con nombres normalizados
+    a partir de tuplas (idPelicula, actoresPrincipales)
+    """
+    Actor.objects.all().delete()
+
+    reparto = {}
+    for id_pelicula, actores in peliculas:
+        for nombre in normalizar_actores(actores):
+            reparto.setdefault(nombre, []).append(id_pelicula)
+
+    Actor.objects.bulk_create([Actor(nombre=nombre) for nombre in reparto])
+    ids = dict(Actor.objects.values_list('nombre', 'id'))
+    Reparto = Actor.peliculas.through
+    Reparto.objects.bulk_create([
+        Reparto(actor_id=ids[nombre], pelicula_id=id_pelicula)
+        for nombre, ids_peliculas in reparto.items() for id_pelicula in ids_peliculas
+    ], batch_size=5000)
+
+def contarActividad():
+    """
+    Recalcula los recuentos materializados de puntuaciones por usuario
+    """
+    ActividadUsuario.objects.all().delete()
+    recuentos = Puntuacion.objects.values_list('idUsuario').annotate(n=Count('id')).order_by()
+    ActividadUsuario.objects.bulk_create(
+        [ActividadUsuario(idUsuario=usuario, numPuntuaciones=n) for usuario, n in recuentos.iterator()],
+        batch_size=5000)
 
 def get_database_stats():
     num_peliculas = Pelicula.objects.count()
     num_puntuaciones = Puntuacion.objects.count()
-    
+
     return {
         'peliculas': num_peliculas,
         'puntuaciones': num_puntuaciones
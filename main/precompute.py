@@ -0,0 +1,104 @@
+#encoding:utf-8
+"""
+Cálculo por adelantado de las recomendaciones de todos los usuarios
+
+Los usuarios del snapshot publicado se reparten en tramos de filas
+consecutivas entre un pool de procesos. Cada proceso abre el mismo snapshot
+mapeado en memoria (una sola copia de solo lectura en el host) y no toca la
+base de datos; el proceso principal escribe cada tramo en
+RecomendacionPrecalculada en una transacción, junto con una fila de
+PrecalculoUsuario por usuario (también si su lista está vacía), así que una
+ejecución interrumpida se reanuda con los usuarios que faltan
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from main import recommendations, snapshot
+from main.models import PrecalculoUsuario, RecomendacionPrecalculada
+
+
+def precalcular(n=None, procesos=None, lote=None, reiniciar=False, informar=None):
+    """
+    Calcula y guarda las n mejores recomendaciones (sin filtro de fecha) de
+    cada usuario del modelo publicado
+    Se saltan los usuarios ya calculados con esta versión del modelo (ver
+    PrecalculoUsuario), salvo con reiniciar; al terminar se borran las de otras versiones
+    informar (opcional) recibe las estadísticas tras cada tramo
+    Retorna: diccionario con usuarios, segundos y rendimiento por proceso
+    """
+    n = n or getattr(settings, 'RECSYS_PRECALCULO_N', 20)
+    procesos = procesos or os.cpu_count() or 1
+    lote = lote or 500
+
+    modelo = recommendations.asegurarModelo()
+    version_snapshot = modelo.version
+    etiqueta = recommendations.versionPrecalculo(modelo)
+    usuarios = modelo.matriz.usuarios.tolist()
+
+    hechos = set()
+    if reiniciar:
+        RecomendacionPrecalculada.objects.filter(version=etiqueta).delete()
+        PrecalculoUsuario.objects.filter(version=etiqueta).delete()
+    else:
+        hechos = set(PrecalculoUsuario.objects.filter(version=etiqueta).values_list('idUsuario', flat=True))
+    # Tramos de filas consecutivas con a lo sumo lote usuarios pendientes
+    pendientes = [u for u in usuarios if u not in hechos]
+    tramos = [pendientes[i:i + lote] for i in range(0, len(pendientes), lote)]
+
+    stats = {'usuarios': 0, 'saltados': len(usuarios) - len(pendientes), 'segundos': 0.0, 'procesos': {}}
+    inicio = time.perf_counter()
+    # Los procesos hijos no deben heredar las conexiones abiertas
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar, initargs=(version_snapshot,)) as pool:
+        futuros = [pool.submit(_calcular, tramo, n) for tramo in tramos]
+        for futuro in as_completed(futuros):
+            pid, resultados, segundos = futuro.result()
+            _guardar(resultados, etiqueta, n)
+            proceso = stats['procesos'].setdefault(pid, {'usuarios': 0, 'segundos': 0.0})
+            proceso['usuarios'] += len(resultados)
+            proceso['segundos'] += segundos
+            proceso['usuarios_por_segundo'] = proceso['usuarios'] / proceso['segundos'] if proceso['segundos'] else 0
+            stats['usuarios'] += len(resultados)
+            stats['segundos'] = time.perf_counter() - inicio
+            if informar is not None:
+                informar(stats)
+
+    RecomendacionPrecalculada.objects.exclude(version=etiqueta).delete()
+    PrecalculoUsuario.objects.exclude(version=etiqueta).delete()
+    recommendations.hayPrecalculadas(modelo, comprobar=True)
+    stats['segundos'] = time.perf_counter() - inicio
+    stats['version'] = etiqueta
+    return stats
+
+
+def _iniciar(version):
+    # Cada proceso abre el snapshot publicado en modo solo lectura
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    recommendations.usarSnapshot(snapshot.cargar(version))
+
+
+def _calcular(usuarios, n):
+    inicio = time.perf_counter()
+    resultados = [(u, recommendations.calcularRecomendaciones(u, n=n)) for u in usuarios]
+    return os.getpid(), resultados, time.perf_counter() - inicio
+
+
+def _guardar(resultados, etiqueta, n):
+    usuarios = [u for u, _ in resultados]
+    with transaction.atomic():
+        RecomendacionPrecalculada.objects.filter(idUsuario__in=usuarios).delete()
+        PrecalculoUsuario.objects.filter(idUsuario__in=usuarios).delete()
+        PrecalculoUsuario.objects.bulk_create([PrecalculoUsuario(idUsuario=u, version=etiqueta) for u in usuarios],
+                                              batch_size=5000)
+        RecomendacionPrecalculada.objects.bulk_create([
+            RecomendacionPrecalculada(idUsuario=u, posicion=posicion, pelicula_id=id_pelicula,
+                                      recomendacion=rec, version=etiqueta, completa=len(recs) < n)
+            for u, recs in resultados for posicion, (rec, id_pelicula) in enumerate(recs)
+        ], batch_size=5000)
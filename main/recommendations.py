@@ -1,38 +1,119 @@
 #encoding:utf-8
-from django.db.models import Count
 from math import sqrt
-from main.models import Puntuacion, Pelicula
+from django.conf import settings
+from main.models import (ActividadUsuario, Actor, Puntuacion, Pelicula, RecomendacionPrecalculada,
+                         normalizar_actor)
+from main.sparse import IndiceFechas, ListasActualizadas, ListasVecinos, RankingPopular, SparsePrefs
+from main import metrics, snapshot
+from main.cache import CacheResultados
+from main.ann import IndiceLSH
+from main.factorization import FactoresLatentes
+from main.modelo import Modelo
 from datetime import datetime
+from array import array
+import heapq
+import threading
+import time
+import numpy as np
 
 
-prefs = {}  
-itemsim = {}  
+# Modelo servido: una versión inmutable que se sustituye entera (ver main/modelo.py)
+modelo = Modelo()
+estadisticas_carga = None
+_comprobado = 0.0
+_sondeado = 0.0
+# Serializa a quienes publican versiones nuevas; las consultas no lo usan
+_publicando = threading.RLock()
+# Resultados ya calculados de getUsuariosSimilares y recomendar_peliculas_usuario
+resultados = CacheResultados()
+# Si hay precalculadas de la versión actual: {versión: (hay, instante)} (ver hayPrecalculadas)
+_precalculadas = {}
+
+def publicar(nuevo):
+    """
+    Pasa a servir el modelo nuevo con una sola asignación: las consultas
+    en curso terminan con la versión que tomaron al empezar
+    """
+    global modelo
+    modelo = nuevo
+    return nuevo
+
+def _completar(base, **piezas):
+    # Añade al modelo servido piezas calculadas sobre base (un índice o unos
+    # factores construidos bajo demanda) si sigue sirviendo los mismos arrays
+    with _publicando:
+        if modelo.matriz is not None and base.matriz is not None and modelo.matriz.usuarios is base.matriz.usuarios:
+            publicar(modelo.con(**piezas))
+
+def motor_sparse(m=None):
+    """
+    Indica si las consultas deben usar la matriz dispersa en lugar de prefs
+    m: versión del modelo (por defecto, la servida)
+    """
+    m = modelo if m is None else m
+    return getattr(settings, 'RECSYS_ENGINE', 'sparse') == 'sparse' and m.matriz is not None
+
+def min_comunes():
+    """
+    Películas en común necesarias para que un usuario cuente como vecino
+    Con 1 o 2 el resultado es exacto; valores mayores descartan vecinos
+    con pocas películas en común
+    """
+    return getattr(settings, 'RECSYS_MIN_COMUNES', 1)
+
+def usar_ann(m=None):
+    """
+    Indica si los vecinos de un usuario se buscan con el índice aproximado
+    (ver main/ann.py) en lugar de con la búsqueda exacta
+    Con menos de RECSYS_ANN_MIN_USUARIOS usuarios se usa siempre la exacta
+    """
+    m = modelo if m is None else m
+    return (getattr(settings, 'RECSYS_ANN', False) and motor_sparse(m) and
+            _ann_compensa(m.matriz))
+
+def _ann_compensa(matriz):
+    return len(matriz.usuarios) >= getattr(settings, 'RECSYS_ANN_MIN_USUARIOS', 1000000)
+
+def metodo_factores(m=None):
+    """
+    Indica si se recomienda con factorización de matrices (main/factorization.py)
+    """
+    m = modelo if m is None else m
+    return getattr(settings, 'RECSYS_METHOD', 'user') == 'mf' and m.matriz is not None
+
+def metodo_items(m=None):
+    """
+    Indica si las recomendaciones deben salir del índice de películas similares
+    """
+    m = modelo if m is None else m
+    return getattr(settings, 'RECSYS_METHOD', 'user') == 'item' and m.matriz is not None
 
 # Returns the Pearson correlation coefficient for p1 and p2
 def sim_pearson(prefs, p1, p2):
+    ratings1 = prefs[p1]
+    ratings2 = prefs[p2]
+
     # Get the list of mutually rated items
-    si = {}
-    for item in prefs[p1]: 
-        if item in prefs[p2]: 
-            si[item] = 1
+    si = ratings1.keys() & ratings2.keys()
 
-    # if they are no ratings in common, return 0
-    if len(si) == 0: 
+    # With fewer than two ratings in common the deviation of each side is zero,
+    # so r is 0: return before doing any sums
+    if len(si) < 2: 
         return 0
 
     # Sum calculations
     n = len(si)
 
     # Sums of all the preferences
-    sum1 = sum([prefs[p1][it] for it in si])
-    sum2 = sum([prefs[p2][it] for it in si])
+    sum1 = sum([ratings1[it] for it in si])
+    sum2 = sum([ratings2[it] for it in si])
 
     # Sums of the squares
-    sum1Sq = sum([pow(prefs[p1][it], 2) for it in si])
-    sum2Sq = sum([pow(prefs[p2][it], 2) for it in si])	
+    sum1Sq = sum([pow(ratings1[it], 2) for it in si])
+    sum2Sq = sum([pow(ratings2[it], 2) for it in si])	
 
     # Sum of the products
-    pSum = sum([prefs[p1][it] * prefs[p2][it] for it in si])
+    pSum = sum([ratings1[it] * ratings2[it] for it in si])
 
     # Calculate r (Pearson score)
     num = pSum - (sum1 * sum2 / n)
@@ -44,37 +125,89 @@ def sim_pearson(prefs, p1, p2):
     r = num / den
     return r
 
+# Returns {other: r} for every user that shares at least min_common items with person.
+# The co-rated sums are accumulated in a single pass over the item -> users posting
+# lists of itemPrefs, so no pair of user dicts is ever intersected.
+def sim_pearson_candidates(prefs, itemPrefs, person, min_common=1):
+    sums = {}
+    for item, r1 in prefs[person].items():
+        for other, r2 in itemPrefs.get(item, {}).items():
+            if other == person:
+                continue
+            acc = sums.get(other)
+            if acc is None:
+                acc = sums[other] = [0, 0, 0, 0, 0, 0]
+            acc[0] += 1
+            acc[1] += r1
+            acc[2] += r2
+            acc[3] += r1 * r1
+            acc[4] += r2 * r2
+            acc[5] += r1 * r2
+
+    result = {}
+    for other, (n, sum1, sum2, sum1Sq, sum2Sq, pSum) in sums.items():
+        if n < min_common:
+            continue
+        # Same formula as sim_pearson
+        num = pSum - (sum1 * sum2 / n)
+        den = (sum1Sq - pow(sum1, 2) / n) * (sum2Sq - pow(sum2, 2) / n)
+        result[other] = num / sqrt(den) if den > 0 else 0
+    return result
+
 # Returns the best matches for person from the prefs dictionary. 
 # Number of results and similarity function are optional params.
-def topMatches(prefs, person, n=5, similarity=sim_pearson):
-    scores = [(similarity(prefs, person, other), other) 
-              for other in prefs if other != person]
-    scores.sort()
-    scores.reverse()
-    return scores[0:n]
-
-# Gets recommendations for a person by using a weighted average of every other user's rankings
-def getRecommendations(prefs, person, similarity=sim_pearson):
+# Only the n best are kept (bounded heap) instead of sorting every user.
+# With itemPrefs (item -> users index), only users sharing items are compared.
+# Neighbours are pruned by overlap only (min_common, and fewer than two shared
+# items scoring 0), not by a similarity upper bound: the only bound Pearson
+# has before the sums are known is 1, whatever the overlap, and the sums of
+# every candidate come out of the same single pass, so there is nothing left
+# to skip without changing which ties make the top n.
+def topMatches(prefs, person, n=5, similarity=sim_pearson, itemPrefs=None, min_common=1):
+    if itemPrefs is not None:
+        sims = sim_pearson_candidates(prefs, itemPrefs, person, min_common)
+        scores = ((sims.get(other, 0), other) for other in prefs if other != person)
+    else:
+        scores = ((similarity(prefs, person, other), other) 
+                  for other in prefs if other != person)
+    return heapq.nlargest(n, scores)
+
+# Gets recommendations for a person by using a weighted average of every other user's rankings.
+# If candidates is given, only those items are scored; if n is given, only the n best are returned.
+# With itemPrefs (item -> users index), only users sharing items are compared.
+def getRecommendations(prefs, person, similarity=sim_pearson, candidates=None, n=None,
+                       itemPrefs=None, min_common=1):
     totals = {}
     simSums = {}
+    sims = None
+    if itemPrefs is not None:
+        sims = sim_pearson_candidates(prefs, itemPrefs, person, min_common)
+    # Each row is read once: with a SparsePrefs every prefs[x] builds a dict
+    myRatings = prefs[person]
     
     for other in prefs:
         # don't compare me to myself
         if other == person: 
             continue
         
-        sim = similarity(prefs, person, other)
+        if sims is not None:
+            sim = sims.get(other, 0)
+        else:
+            sim = similarity(prefs, person, other)
         
         # ignore scores of zero or lower
         if sim <= 0: 
             continue
         
-        for item in prefs[other]:
+        for item, rating in prefs[other].items():
+            # skip filtered-out movies before accumulating anything
+            if candidates is not None and item not in candidates:
+                continue
             # only score movies I haven't seen yet
-            if item not in prefs[person] or prefs[person][item] == 0:
+            if item not in myRatings or myRatings[item] == 0:
                 # Similarity * Score
                 totals.setdefault(item, 0)
-                totals[item] += prefs[other][item] * sim
+                totals[item] += rating * sim
                 # Sum of similarities
                 simSums.setdefault(item, 0)
                 simSums[item] += sim
@@ -84,98 +217,687 @@ def getRecommendations(prefs, person, similarity=sim_pearson):
     
     # Create the normalized list
     rankings = [(total / simSums[item], item) for item, total in totals.items()]
-    # Return the sorted list
+    # Return the sorted list (or just the n best)
+    return _mejores(rankings, n)
+
+def _mejores(rankings, n=None):
+    # Same order as sort() + reverse(); with n, a bounded heap instead of a full sort
+    if n is not None:
+        return heapq.nlargest(n, rankings)
     rankings.sort()
     rankings.reverse()
     return rankings
 
 def transformPrefs(prefs):
     result = {}
-    for person in prefs:
-        for item in prefs[person]:
+    for person, ratings in prefs.items():
+        for item, rating in ratings.items():
             result.setdefault(item, {})
             
             # Flip item and person
-            result[item][person] = prefs[person][item]
+            result[item][person] = rating
     return result
 
-def loadPrefs():
-    global prefs
-    prefs = {}
-    
-    puntuaciones = Puntuacion.objects.all()
-    for p in puntuaciones:
-        usuario = p.idUsuario
-        pelicula = p.pelicula.idPelicula
-        puntuacion = p.puntuacion
-        
-        if usuario not in prefs:
-            prefs[usuario] = {}
-        prefs[usuario][pelicula] = puntuacion
-    
-    return prefs
+# Returns the n most similar items for every item in prefs.
+# Meant to be computed offline: item neighbourhoods change slowly.
+def calculateSimilarItems(prefs, n=10):
+    result = {}
+    # Invert the preference matrix to be item-centric
+    itemPrefs = transformPrefs(prefs)
+    itemMatrix = SparsePrefs.from_prefs(itemPrefs)
+    for item in itemPrefs:
+        # Find the most similar items to this one
+        result[item] = itemMatrix.topMatches(item, n=n)
+    return result
+
+# Gets recommendations for a person from the precomputed item neighbourhoods.
+# If candidates is given, only those items are scored; if n is given, only the n best are returned.
+def getRecommendedItems(prefs, itemMatch, user, candidates=None, n=None):
+    userRatings = prefs[user]
+    scores = {}
+    totalSim = {}
+
+    # Loop over items rated by this user
+    for (item, rating) in userRatings.items():
+        # Loop over items similar to this one
+        for (similarity, item2) in itemMatch.get(item, []):
+            # Ignore if this user has already rated this item
+            # or if the items are not positively correlated
+            if item2 in userRatings or similarity <= 0:
+                continue
+            if candidates is not None and item2 not in candidates:
+                continue
+            # Weighted sum of rating times similarity
+            scores.setdefault(item2, 0)
+            scores[item2] += similarity * rating
+            # Sum of all the similarities
+            totalSim.setdefault(item2, 0)
+            totalSim[item2] += similarity
 
-def getUsuariosMasActivos(n=5):    
-    usuarios = Puntuacion.objects.values('idUsuario').annotate(
-        num_peliculas=Count('pelicula')
-    ).order_by('-num_peliculas')[:n]
+    # Divide each total score by total weighting to get an average
+    rankings = [(score / totalSim[item], item) for item, score in scores.items()]
+    # Return the rankings from highest to lowest (or just the n best)
+    return _mejores(rankings, n)
+
+def iterPuntuaciones(chunk_size=None):
+    """
+    Recorre la tabla de puntuaciones en un único scan, por bloques,
+    como tuplas (idUsuario, idPelicula, puntuacion) sin crear modelos
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'RECSYS_LOAD_CHUNK', 5000)
+    return Puntuacion.objects.order_by('idUsuario', 'pelicula_id').values_list(
+        'idUsuario', 'pelicula_id', 'puntuacion'
+    ).iterator(chunk_size=chunk_size)
+
+def leerMatriz(columnas=None):
+    """
+    Lee las puntuaciones de la base de datos en una matriz nueva, sin tocar
+    el modelo que se está sirviendo
+    columnas (opcional): (huella, usuarios, peliculas, puntuaciones), las
+    puntuaciones de la BD con esa huella ya leídas como arrays paralelos (ver
+    populateDB.puntuacionesImportadas); evitan recorrer la BD
+    Retorna: (matriz, huella de la BD, estadísticas de la carga)
+    """
+    inicio = time.perf_counter()
+    if columnas is not None:
+        huella_carga, usuarios, peliculas, puntuaciones = columnas
+        # El mismo orden que iterPuntuaciones, para obtener la misma matriz
+        orden = np.lexsort((peliculas, usuarios))
+        usuarios, peliculas, puntuaciones = usuarios[orden], peliculas[orden], puntuaciones[orden]
+    else:
+        # Antes de leer: una escritura durante la lectura deja el modelo con
+        # una huella anterior y se reconcilia en la siguiente comprobación
+        huella_carga = snapshot.huella_bd()
+        usuarios = array('q')
+        peliculas = array('q')
+        puntuaciones = array('q')
+
+        for usuario, pelicula, puntuacion in iterPuntuaciones():
+            usuarios.append(usuario)
+            peliculas.append(pelicula)
+            puntuaciones.append(puntuacion)
     
-    return [(u['idUsuario'], u['num_peliculas']) for u in usuarios]
+    nueva_matriz = SparsePrefs.from_arrays(usuarios, peliculas, puntuaciones)
+    return nueva_matriz, huella_carga, {
+        'puntuaciones': len(puntuaciones),
+        'usuarios': len(nueva_matriz),
+        'segundos': time.perf_counter() - inicio,
+    }
+
+def _leerFechas():
+    return IndiceFechas.from_pares(Pelicula.objects.values_list('idPelicula', 'fecha').iterator())
+
+def loadAnn(m=None):
+    """
+    Construye el índice aproximado de vecinos sobre la matriz con los
+    parámetros RECSYS_ANN_TABLAS y RECSYS_ANN_BITS
+    """
+    base = modelo if m is None else m
+    with metrics.cronometro('recsys_modelo_carga_segundos', origen='ann'):
+        ann = _construirAnn(base.matriz)
+    _completar(base, ann=ann)
+    return ann
+
+def _construirAnn(m):
+    return IndiceLSH.from_prefs(m,
+                                tablas=getattr(settings, 'RECSYS_ANN_TABLAS', 16),
+                                bits=getattr(settings, 'RECSYS_ANN_BITS', 4))
+
+def candidatosAnn(idUsuario, m=None):
+    """
+    Filas de la matriz candidatas a vecinos de idUsuario según el índice
+    aproximado, o None si se usa la búsqueda exacta
+    Si el índice falta o se construyó con otros parámetros, se reconstruye
+    """
+    m = modelo if m is None else m
+    if not usar_ann(m):
+        return None
+    ann = m.ann
+    if ann is None or not ann.compatible(m.matriz, getattr(settings, 'RECSYS_ANN_TABLAS', 16),
+                                         getattr(settings, 'RECSYS_ANN_BITS', 4)):
+        ann = loadAnn(m)
+    return ann.candidatos(m.matriz, idUsuario, sondeos=getattr(settings, 'RECSYS_ANN_SONDEOS', 1))
+
+def loadFactores(m=None):
+    """
+    Entrena los factores latentes sobre la matriz con los parámetros RECSYS_MF_*
+    """
+    base = modelo if m is None else m
+    with metrics.cronometro('recsys_modelo_carga_segundos', origen='factores'):
+        factores = _entrenarFactores(base.matriz)
+    _completar(base, factores=factores)
+    return factores
+
+def _entrenarFactores(m):
+    return FactoresLatentes.entrenar(m,
+                                     factores=getattr(settings, 'RECSYS_MF_FACTORES', 20),
+                                     iteraciones=getattr(settings, 'RECSYS_MF_ITERACIONES', 10),
+                                     regularizacion=getattr(settings, 'RECSYS_MF_REGULARIZACION', 1.0),
+                                     hilos=getattr(settings, 'RECSYS_MF_HILOS', 4))
+
+def modeloFactores(m=None):
+    """
+    Factores latentes de la matriz del modelo; si faltan en el snapshot o
+    no corresponden a la matriz, se entrenan
+    """
+    m = modelo if m is None else m
+    if m.factores is None or not m.factores.compatible(m.matriz):
+        return loadFactores(m)
+    return m.factores
+
+def loadItemsim(m=None):
+    """
+    Calcula los RECSYS_ITEMSIM_K vecinos de cada película sobre la matriz
+    """
+    base = modelo if m is None else m
+    with metrics.cronometro('recsys_modelo_carga_segundos', origen='itemsim'):
+        itemsim = _construirItemsim(base.matriz)
+    _completar(base, itemsim=itemsim)
+    return itemsim
+
+def _construirItemsim(m):
+    return m.vecinosPeliculas(n=getattr(settings, 'RECSYS_ITEMSIM_K', 20))
+
+def vecinosItems(m=None):
+    """
+    Vecinos por película del modelo; si faltan en el snapshot (se construyó
+    con otro RECSYS_METHOD), se calculan
+    Las listas de las películas de itemsim_pendientes (tocadas por
+    actualizaciones incrementales) se recalculan al leerlas y se guardan en
+    la caché de resultados, así que coinciden con las de una reconstrucción
+    """
+    m = modelo if m is None else m
+    itemsim = m.itemsim
+    if len(itemsim) == 0 and len(m.matriz.peliculas) > 0:
+        itemsim = loadItemsim(m)
+    if not m.itemsim_pendientes:
+        return itemsim
+    k = getattr(settings, 'RECSYS_ITEMSIM_K', 20)
+    clave = claveModelo(m)
+    return ListasActualizadas(itemsim, m.itemsim_pendientes, lambda item: resultados.obtener(
+        ('vecinos', item, k) + clave, lambda: m.matriz.vecinosPelicula(item, n=k)))
+
+def loadPopulares(m=None):
+    """
+    Construye el ranking de películas populares (ver sparse.RankingPopular)
+    con RECSYS_POPULARES_K y RECSYS_POPULARES_PESO
+    """
+    base = modelo if m is None else m
+    with metrics.cronometro('recsys_modelo_carga_segundos', origen='populares'):
+        populares = _construirPopulares(base.matriz, base.fechas)
+    _completar(base, populares=populares)
+    return populares
+
+def _construirPopulares(m, fechas):
+    return RankingPopular.from_prefs(m, fechas,
+                                     k=getattr(settings, 'RECSYS_POPULARES_K', 100),
+                                     peso=getattr(settings, 'RECSYS_POPULARES_PESO', None))
+
+def rankingPopular(m=None):
+    """
+    Ranking de películas populares del modelo; si falta en el snapshot, se construye
+    Las actualizaciones incrementales no lo cambian hasta la siguiente reconstrucción
+    """
+    m = modelo if m is None else m
+    if m.populares is None:
+        return loadPopulares(m)
+    return m.populares
+
+def actualizarPuntuacion(idUsuario, idPelicula, puntuacion, revision, anterior=None):
+    """
+    Aplica al modelo el alta o la edición de una puntuación sin recargar
+    la tabla completa: se publica una versión con la fila del usuario
+    sustituida, con coste proporcional a sus puntuaciones
+    revision: (huella anterior, huella nueva) de snapshot.nueva_revision
+    anterior (opcional): (idUsuario, idPelicula) que tenía la puntuación si
+    la edición la ha movido; se quita en la misma versión publicada
+    El cambio solo llega al modelo de este proceso: los demás lo ven cuando
+    su siguiente comprobación de la huella (RECSYS_SNAPSHOT_CHECK, ver
+    asegurarModelo) encuentra la BD cambiada y reconstruye el modelo entero
+    (un solo proceso; el resto carga el snapshot que publique)
+    """
+    with _publicando:
+        if modelo.matriz is None:
+            return
+        huella = _huellaSiguiente(revision)
+        nuevo = modelo
+        if anterior is not None and anterior[1] in nuevo.prefs.get(anterior[0], {}):
+            ratings = dict(nuevo.prefs[anterior[0]])
+            del ratings[anterior[1]]
+            nuevo = nuevo.con_puntuaciones(anterior[0], ratings, anterior[1], huella)
+        ratings = dict(nuevo.prefs.get(idUsuario, {}))
+        ratings[idPelicula] = puntuacion
+        publicar(nuevo.con_puntuaciones(idUsuario, ratings, idPelicula, huella))
+
+def eliminarPuntuacion(idUsuario, idPelicula, revision):
+    """
+    Aplica al modelo el borrado de una puntuación (solo en este proceso,
+    ver actualizarPuntuacion)
+    """
+    with _publicando:
+        if modelo.matriz is None or idPelicula not in modelo.prefs.get(idUsuario, {}):
+            return
+        ratings = dict(modelo.prefs[idUsuario])
+        del ratings[idPelicula]
+        publicar(modelo.con_puntuaciones(idUsuario, ratings, idPelicula, _huellaSiguiente(revision)))
+
+def _huellaSiguiente(revision):
+    # El modelo pasa a la revisión nueva si reflejaba la anterior. Si otro
+    # proceso ha escrito entre medias, la huella (única por escritura, por
+    # la caché) ya no coincide con ninguna de la BD y la siguiente
+    # comprobación reconcilia el modelo
+    if modelo.huella == revision[0]:
+        return revision[1]
+    return revision[1] + '*'
+
+def usarSnapshot(cargado):
+    """
+    Pasa a servir el modelo de un snapshot abierto con snapshot.cargar
+    Todas las piezas se construyen antes de publicarlo de una vez. Los arrays
+    quedan mapeados en memoria de solo lectura, así que todos los procesos
+    del host comparten una única copia
+    """
+    nueva_version, nueva_huella, arrays = cargado
+    nuevo = Modelo(
+        matriz=SparsePrefs(arrays),
+        itemsim=ListasVecinos(_con_prefijo(arrays, 'itemsim_')),
+        fechas=IndiceFechas(_con_prefijo(arrays, 'fechas_')),
+        ann=IndiceLSH(_con_prefijo(arrays, 'ann_')) if 'ann_codigos' in arrays else None,
+        factores=FactoresLatentes(_con_prefijo(arrays, 'mf_')) if 'mf_parametros' in arrays else None,
+        populares=RankingPopular(_con_prefijo(arrays, 'populares_')) if 'populares_fechas' in arrays else None,
+        huella=nueva_huella,
+        version=nueva_version,
+    )
+    with _publicando:
+        return publicar(nuevo)
+
+def _con_prefijo(arrays, prefijo):
+    return {nombre[len(prefijo):]: valores for nombre, valores in arrays.items() if nombre.startswith(prefijo)}
+
+def construirModelo(progreso=None, columnas=None):
+    """
+    Calcula desde la base de datos todos los arrays de un modelo nuevo sin
+    tocar el que se está sirviendo
+    progreso (opcional) recibe el nombre de cada etapa al empezarla
+    columnas: ver leerMatriz
+    Retorna: (arrays, huella de la BD, estadísticas de la carga)
+    """
+    avisar = progreso or (lambda etapa: None)
+    avisar('preferencias')
+    with metrics.cronometro('recsys_modelo_etapa_segundos', etapa='preferencias'):
+        nueva_matriz, nueva_huella, stats = leerMatriz(columnas)
+        arrays = nueva_matriz.to_arrays()
+        fechas = _leerFechas()
+        arrays.update(('fechas_' + nombre, valores) for nombre, valores in fechas.to_arrays().items())
+
+    # Los vecinos de cada película solo se usan con RECSYS_METHOD = 'item';
+    # con otro método itemsim queda vacío
+    vecinos = ListasVecinos.from_dict({})
+    if getattr(settings, 'RECSYS_METHOD', 'user') == 'item':
+        avisar('similitud')
+        with metrics.cronometro('recsys_modelo_etapa_segundos', etapa='similitud'):
+            vecinos = _construirItemsim(nueva_matriz)
+    arrays.update(('itemsim_' + nombre, valores) for nombre, valores in vecinos.to_arrays().items())
+    with metrics.cronometro('recsys_modelo_etapa_segundos', etapa='populares'):
+        arrays.update(('populares_' + nombre, valores)
+                      for nombre, valores in _construirPopulares(nueva_matriz, fechas).to_arrays().items())
+    # (usar_ann() depende de la matriz servida, que aún puede no existir)
+    if (getattr(settings, 'RECSYS_ANN', False) and getattr(settings, 'RECSYS_ENGINE', 'sparse') == 'sparse' and
+            _ann_compensa(nueva_matriz)):
+        with metrics.cronometro('recsys_modelo_etapa_segundos', etapa='ann'):
+            arrays.update(('ann_' + nombre, valores)
+                          for nombre, valores in _construirAnn(nueva_matriz).to_arrays().items())
+    if getattr(settings, 'RECSYS_METHOD', 'user') == 'mf':
+        avisar('factores')
+        with metrics.cronometro('recsys_modelo_etapa_segundos', etapa='factores'):
+            arrays.update(('mf_' + nombre, valores)
+                          for nombre, valores in _entrenarFactores(nueva_matriz).to_arrays().items())
+    return arrays, nueva_huella, stats
+
+def reconstruirModelo(huella_esperada=None, progreso=None, columnas=None):
+    """
+    Recalcula el modelo completo desde la base de datos, lo publica en disco
+    y pasa a usar la copia publicada; hasta entonces se sigue sirviendo el
+    modelo anterior
+    Solo reconstruye un proceso a la vez: si se indica huella_esperada y otro
+    proceso ya ha publicado un snapshot con esa huella, se usa ese
+    progreso, columnas: ver construirModelo
+    """
+    global estadisticas_carga
+    with snapshot.bloqueo():
+        cargado = snapshot.cargar()
+        if huella_esperada is not None and cargado is not None and cargado[1] == huella_esperada:
+            return usarSnapshot(cargado).version
+        with metrics.cronometro('recsys_modelo_carga_segundos', origen='reconstruccion'):
+            arrays, nueva_huella, stats = construirModelo(progreso, columnas)
+            if progreso is not None:
+                progreso('publicacion')
+            nueva = snapshot.guardar(arrays, nueva_huella)
+    usarSnapshot(snapshot.cargar(nueva))
+    estadisticas_carga = stats
+    return nueva
+
+def compactarModelo():
+    """
+    Incorpora a la matriz las actualizaciones incrementales acumuladas,
+    recalcula los vecinos de itemsim y reconcilia el modelo con la BD
+    """
+    return reconstruirModelo()
+
+def asegurarModelo():
+    """
+    Carga el modelo bajo demanda la primera vez que se usa en este proceso
+    Usa el último snapshot si corresponde al contenido actual de la BD y,
+    si no, lo reconstruye
+    Cada RECSYS_SNAPSHOT_POLL segundos se mira si otro proceso ha publicado
+    una versión nueva, para que todos los procesos cambien de versión a la vez
+    Cada RECSYS_SNAPSHOT_CHECK segundos se vuelve a comprobar la huella de la
+    BD y, si se han acumulado demasiados usuarios actualizados
+    incrementalmente, se compacta el modelo; ambas cosas en segundo plano
+    (ver main/jobs.py) si ya hay un modelo cargado
+    Retorna: la versión del modelo que se sirve (ver main/modelo.py)
+    """
+    _comprobar()
+    return modelo
+
+def _comprobar():
+    global _comprobado, _sondeado
+    ahora = time.monotonic()
+    if modelo.matriz is not None:
+        if ahora - _sondeado >= getattr(settings, 'RECSYS_SNAPSHOT_POLL', 1):
+            _sondeado = ahora
+            publicada = snapshot.version_actual()
+            if publicada is not None and publicada != modelo.version:
+                cargado = snapshot.cargar(publicada)
+                if cargado is not None:
+                    usarSnapshot(cargado)
+        if ahora - _comprobado < getattr(settings, 'RECSYS_SNAPSHOT_CHECK', 60):
+            return
+    _comprobado = _sondeado = ahora
+
+    # Con un modelo ya cargado, las reconstrucciones van a segundo plano y
+    # mientras tanto se sigue sirviendo el actual (import diferido: jobs
+    # depende de este módulo)
+    from main import jobs
+
+    m = modelo
+    if m.matriz is not None and len(m.matriz.modificados) >= getattr(settings, 'RECSYS_COMPACT_THRESHOLD', 1000):
+        jobs.encolar()
+        return
+
+    actual = snapshot.huella_bd()
+    if m.matriz is not None and m.huella == actual:
+        return
+
+    cargado = snapshot.cargar()
+    if cargado is not None and cargado[1] == actual:
+        usarSnapshot(cargado)
+    elif m.matriz is not None:
+        jobs.encolar(huella_esperada=actual)
+    else:
+        reconstruirModelo(huella_esperada=actual)
+
+def getUsuariosMasActivos(n=5):
+    """
+    Devuelve los n usuarios con más puntuaciones, leídos de los recuentos
+    materializados en ActividadUsuario
+    Retorna: lista de tuplas (idUsuario, num_peliculas)
+    """
+    return list(ActividadUsuario.objects.values_list('idUsuario', 'numPuntuaciones')[:n])
+
+async def agetUsuariosMasActivos(n=5):
+    """
+    Versión asíncrona de getUsuariosMasActivos
+    """
+    return [fila async for fila in ActividadUsuario.objects.values_list('idUsuario', 'numPuntuaciones')[:n]]
+
+def claveModelo(m=None):
+    """
+    Identifica el modelo servido y la forma de consultarlo: la versión del
+    snapshot, la huella (que cambia también con cada actualización
+    incremental) y los ajustes que cambian los resultados
+    """
+    m = modelo if m is None else m
+    return (m.version, m.huella, getattr(settings, 'RECSYS_METHOD', 'user'),
+            getattr(settings, 'RECSYS_ENGINE', 'sparse'), usar_ann(m), min_comunes())
 
 def getUsuariosSimilares(idUsuario, n=3):
     """
     Devuelve los n usuarios más similares a idUsuario
+    Los resultados se guardan en caché por usuario, n y versión del modelo
     Retorna: lista de tuplas (similaridad, idUsuario)
     """
-    if idUsuario not in prefs:
+    m = asegurarModelo()
+    return resultados.obtener(('similares', idUsuario, n) + claveModelo(m),
+                              lambda: _usuariosSimilares(m, idUsuario, n))
+
+def _usuariosSimilares(m, idUsuario, n):
+    if idUsuario not in m.prefs:
         return []
     
-    return topMatches(prefs, idUsuario, n=n, similarity=sim_pearson)
+    if motor_sparse(m):
+        with metrics.etapa('candidatos'):
+            filas = candidatosAnn(idUsuario, m)
+        with metrics.etapa('similitud'):
+            return m.matriz.topMatches(idUsuario, n=n, min_comunes=min_comunes(), filas=filas)
+    with metrics.etapa('similitud'):
+        return topMatches(m.prefs, idUsuario, n=n, similarity=sim_pearson,
+                          itemPrefs=m.raters, min_common=min_comunes())
+
+def getUsuariosSimilaresVarios(idsUsuario, n=3):
+    """
+    Devuelve los n usuarios más similares a cada uno de idsUsuario,
+    compartiendo una sola pasada por el índice invertido entre todos ellos
+    Solo se calculan los que no están en la caché de getUsuariosSimilares
+    Retorna: diccionario {idUsuario: lista de tuplas (similaridad, idUsuario)}
+    """
+    m = asegurarModelo()
+    clave = claveModelo(m)
+    result = {}
+    for u in idsUsuario:
+        guardado = resultados.consultar(('similares', u, n) + clave)
+        if guardado is not None:
+            result[u] = guardado
+    faltan = [u for u in idsUsuario if u not in result]
+    presentes = [u for u in faltan if u in m.prefs]
+    calculados = {u: [] for u in faltan}
+    if usar_ann(m):
+        for u in presentes:
+            calculados[u] = _usuariosSimilares(m, u, n)
+    elif motor_sparse(m):
+        with metrics.etapa('similitud'):
+            calculados.update(m.matriz.topMatchesVarios(presentes, n=n, min_comunes=min_comunes()))
+    else:
+        with metrics.etapa('similitud'):
+            for u in presentes:
+                calculados[u] = topMatches(m.prefs, u, n=n, similarity=sim_pearson,
+                                           itemPrefs=m.raters, min_common=min_comunes())
+    for u, similares in calculados.items():
+        resultados.guardar(('similares', u, n) + clave, similares)
+    result.update(calculados)
+    return result
 
 def recomendar_peliculas_usuario(idUsuario, fecha_limite=None, n=2):
     """
     Recomienda n películas a un usuario que no haya puntuado
     Si se proporciona fecha_limite, solo recomienda películas anteriores a esa fecha
-    Usa filtrado colaborativo basado en usuarios
+    Usa filtrado colaborativo basado en usuarios, o en películas si
+    RECSYS_METHOD = 'item' (ver vecinosItems), o factores
+    latentes si RECSYS_METHOD = 'mf'
+    Los resultados se guardan en caché por usuario, fecha, n y versión del modelo
+    Si hay recomendaciones precalculadas con el modelo actual se leen de la
+    tabla (ver recomendacionesPrecalculadas); si no, se calculan
+    Si salen menos de n (usuario nuevo, sin vecinos útiles...), se completan
+    con las películas populares (ver recomendacionesPopulares)
     Retorna: lista de tuplas (recomendacion, idPelicula)
     """
-    if idUsuario not in prefs:
-        return []
+    m = asegurarModelo()
+    return resultados.obtener(('recomendar', idUsuario, fecha_limite or '', n) + claveModelo(m),
+                              lambda: _recomendarPeliculas(m, idUsuario, fecha_limite, n))
+
+def recomendar_peliculas_varios(idsUsuario, fecha_limite=None, n=2):
+    """
+    recomendar_peliculas_usuario de cada uno de idsUsuario, leyendo las
+    precalculadas de todos los que no están en la caché con una sola consulta
+    Retorna: diccionario {idUsuario: lista de tuplas (recomendacion, idPelicula)}
+    """
+    m = asegurarModelo()
+    clave = claveModelo(m)
+    result = {}
+    for u in idsUsuario:
+        guardado = resultados.consultar(('recomendar', u, fecha_limite or '', n) + clave)
+        if guardado is not None:
+            result[u] = guardado
+    faltan = [u for u in idsUsuario if u not in result]
+    filas = filasPrecalculadas(faltan, m)
+    for u in faltan:
+        result[u] = _recomendarPeliculas(m, u, fecha_limite, n, filas.get(u, []))
+        resultados.guardar(('recomendar', u, fecha_limite or '', n) + clave, result[u])
+    return result
+
+def _recomendarPeliculas(m, idUsuario, fecha_limite, n, filas=None):
+    recs = recomendacionesPrecalculadas(idUsuario, fecha_limite, n, m, filas)
+    if recs is None:
+        recs = calcularRecomendaciones(idUsuario, fecha_limite, n, m)
+    if len(recs) < n and getattr(settings, 'RECSYS_POPULARES', True) and m.matriz is not None:
+        recs = recs + recomendacionesPopulares(idUsuario, fecha_limite, n - len(recs), m,
+                                               excluidas={id_pelicula for (_, id_pelicula) in recs})
+    return recs
+
+def recomendacionesPopulares(idUsuario, fecha_limite=None, n=2, m=None, excluidas=()):
+    """
+    Las n películas con mejor media bayesiana estrenadas antes de
+    fecha_limite que idUsuario no ha puntuado, sin las de excluidas
+    Completa las recomendaciones de usuarios nuevos o sin vecinos útiles
+    Retorna: lista de tuplas (media, idPelicula)
+    """
+    m = modelo if m is None else m
+    with metrics.etapa('populares'):
+        puntuadas = m.prefs[idUsuario] if idUsuario in m.prefs else {}
+        if excluidas:
+            puntuadas = set(puntuadas) | set(excluidas)
+        return rankingPopular(m).mejores(fecha_limite, n, puntuadas)
+
+def versionPrecalculo(m=None):
+    """
+    Versión con la que se etiquetan las recomendaciones precalculadas:
+    snapshot del modelo y método de recomendación
+    """
+    m = modelo if m is None else m
+    return '%s:%s' % (m.version, getattr(settings, 'RECSYS_METHOD', 'user'))
+
+def hayPrecalculadas(m=None, comprobar=False):
+    """
+    Indica si la tabla tiene recomendaciones precalculadas con el modelo
+    actual; si no, las consultas se ahorran buscarlas
+    Una respuesta negativa se guarda RECSYS_SNAPSHOT_CHECK segundos, así que
+    un precálculo lanzado desde otro proceso puede tardar ese tiempo en
+    usarse; con comprobar se vuelve a consultar la tabla
+    """
+    m = modelo if m is None else m
+    version = versionPrecalculo(m)
+    ahora = time.monotonic()
+    guardado = None if comprobar else _precalculadas.get(version)
+    if guardado is not None and (guardado[0] or ahora - guardado[1] < getattr(settings, 'RECSYS_SNAPSHOT_CHECK', 60)):
+        return guardado[0]
+    hay = RecomendacionPrecalculada.objects.filter(version=version).exists()
+    _precalculadas.clear()
+    _precalculadas[version] = (hay, ahora)
+    return hay
+
+def filasPrecalculadas(idsUsuario, m=None):
+    """
+    Filas precalculadas de varios usuarios con el modelo actual, en una sola
+    consulta por índice (ver recomendacionesPrecalculadas)
+    Retorna: diccionario {idUsuario: lista de (recomendacion, idPelicula, completa)}
+    """
+    m = modelo if m is None else m
+    result = {}
+    if m.matriz is None or not idsUsuario or not hayPrecalculadas(m):
+        return result
+    with metrics.etapa('precalculadas'):
+        filas = RecomendacionPrecalculada.objects.filter(
+            idUsuario__in=list(idsUsuario), version=versionPrecalculo(m)
+        ).order_by('idUsuario', 'posicion').values_list('idUsuario', 'recomendacion', 'pelicula_id', 'completa')
+        for idUsuario, rec, id_pelicula, completa in filas:
+            result.setdefault(idUsuario, []).append((rec, id_pelicula, completa))
+    return result
+
+def recomendacionesPrecalculadas(idUsuario, fecha_limite=None, n=2, m=None, filas=None):
+    """
+    Las n mejores recomendaciones de idUsuario leídas de la tabla
+    RecomendacionPrecalculada con una sola consulta por índice, o de filas
+    si ya se han leído (ver filasPrecalculadas)
+    La lista guardada está ordenada sin filtrar por fecha; como la puntuación
+    de cada película no depende del filtro, quitar las posteriores a
+    fecha_limite da el mismo resultado que calcularlas con el filtro
+    Retorna: lista de tuplas (recomendacion, idPelicula), o None si no hay
+    datos válidos para el modelo actual o no bastan para llegar a n
+    """
+    m = modelo if m is None else m
+    if m.matriz is None or idUsuario in m.matriz.modificados:
+        return None
+    if filas is None:
+        filas = filasPrecalculadas([idUsuario], m).get(idUsuario, [])
+    if not filas:
+        return None
     
-    recomendaciones = getRecommendations(prefs, idUsuario)
+    recs = [(rec, id_pelicula) for (rec, id_pelicula, _) in filas]
+    if fecha_limite:
+        with metrics.etapa('filtro_fecha'):
+            candidatas = m.fechas.anteriores(fecha_limite)
+            recs = [(rec, id_pelicula) for (rec, id_pelicula) in recs if id_pelicula in candidatas]
+    if len(recs) >= n or filas[0][2]:
+        return recs[:n]
+    return None
+
+def calcularRecomendaciones(idUsuario, fecha_limite=None, n=2, m=None):
+    """
+    Calcula las recomendaciones con el modelo cargado (o la versión m), sin
+    caché ni tabla de precalculadas y sin comprobar si el modelo está al día
+    Retorna: lista de tuplas (recomendacion, idPelicula)
+    """
+    m = modelo if m is None else m
+    if idUsuario not in m.prefs:
+        return []
     
+    # Las películas posteriores a la fecha se descartan antes de puntuarlas
+    candidatas = None
     if fecha_limite:
-        peliculas_filtradas = []
-        for (rec, id_pelicula) in recomendaciones:
-            try:
-                pelicula = Pelicula.objects.get(pk=id_pelicula)
-                if pelicula.fecha and pelicula.fecha < fecha_limite:
-                    peliculas_filtradas.append((rec, id_pelicula))
-                    if len(peliculas_filtradas) >= n:
-                        break
-            except Pelicula.DoesNotExist:
-                continue
-        return peliculas_filtradas
+        with metrics.etapa('filtro_fecha'):
+            if m.fechas.posicion(fecha_limite) == 0:
+                return []
+            candidatas = m.fechas.anteriores(fecha_limite)
     
-    return recomendaciones[:n]
+    if motor_sparse(m) and not metodo_factores(m) and not metodo_items(m):
+        # La matriz mide por separado la similitud y la puntuación
+        with metrics.etapa('candidatos'):
+            filas = candidatosAnn(idUsuario, m)
+        return m.matriz.getRecommendations(idUsuario, candidatas=candidatas, n=n, min_comunes=min_comunes(),
+                                           filas=filas)
+    with metrics.etapa('puntuacion'):
+        if metodo_factores(m):
+            return modeloFactores(m).getRecommendations(m.matriz, idUsuario, candidatas=candidatas, n=n)
+        if metodo_items(m):
+            return getRecommendedItems(m.prefs, vecinosItems(m), idUsuario, candidates=candidatas, n=n)
+        return getRecommendations(m.prefs, idUsuario, candidates=candidatas, n=n,
+                                  itemPrefs=m.raters, min_common=min_comunes())
 
 def obtener_actores_unicos():
     """
-    Obtiene la lista de actores únicos de todas las películas
+    Obtiene la lista ordenada de actores del índice de actores
     """
-    actores_set = set()
-    peliculas = Pelicula.objects.all()
-    
-    for pelicula in peliculas:
-        if pelicula.actoresPrincipales:
-            actores = [actor.strip() for actor in pelicula.actoresPrincipales.split(',')]
-            actores_set.update(actores)
-    
-    return sorted(list(actores_set))
+    return list(Actor.objects.order_by('nombre').values_list('nombre', flat=True))
+
+async def aobtener_actores_unicos():
+    """
+    Versión asíncrona de obtener_actores_unicos
+    """
+    return [nombre async for nombre in Actor.objects.order_by('nombre').values_list('nombre', flat=True)]
 
 def obtener_peliculas_por_actor(nombre_actor):
     """
-    Obtiene todas las películas de un actor específico
+    Obtiene todas las películas de un actor específico (coincidencia exacta)
     """
-    peliculas = Pelicula.objects.filter(actoresPrincipales__icontains=nombre_actor)
-    return peliculas
+    return Pelicula.objects.filter(actores__nombre=normalizar_actor(nombre_actor))
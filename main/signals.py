@@ -0,0 +1,97 @@
+#encoding:utf-8
+import contextvars
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from main import recommendations, snapshot
+from main.models import ActividadUsuario, Pelicula, Puntuacion
+
+# Activo en el contexto (hilo o tarea) que hace una carga masiva
+_carga_masiva = contextvars.ContextVar('recsys_carga_masiva', default=False)
+
+
+def ajustar_actividad(idUsuario, cambio):
+    """
+    Suma cambio al recuento materializado de puntuaciones de idUsuario,
+    creando o borrando su fila cuando hace falta
+    """
+    actualizadas = ActividadUsuario.objects.filter(pk=idUsuario).update(
+        numPuntuaciones=F('numPuntuaciones') + cambio)
+    if not actualizadas and cambio > 0:
+        ActividadUsuario.objects.create(idUsuario=idUsuario, numPuntuaciones=cambio)
+    elif cambio < 0:
+        ActividadUsuario.objects.filter(pk=idUsuario, numPuntuaciones__lte=0).delete()
+
+
+def recordar_anterior(sender, instance, raw=False, **kwargs):
+    # Una edición puede cambiar el usuario o la película de la puntuación
+    instance._anterior = None
+    if not raw and instance.pk is not None and not _carga_masiva.get():
+        instance._anterior = Puntuacion.objects.filter(pk=instance.pk).values_list(
+            'idUsuario', 'pelicula_id').first()
+
+
+def puntuacion_guardada(sender, instance, created=False, raw=False, **kwargs):
+    if _carga_masiva.get():
+        return
+    if raw:
+        snapshot.nueva_revision()
+        return
+    anterior = getattr(instance, '_anterior', None)
+    clave = (instance.idUsuario, instance.pelicula_id)
+
+    # El recuento se actualiza dentro de la misma transacción que la puntuación
+    if anterior is None:
+        ajustar_actividad(instance.idUsuario, 1)
+    elif anterior[0] != instance.idUsuario:
+        ajustar_actividad(anterior[0], -1)
+        ajustar_actividad(instance.idUsuario, 1)
+    revision = snapshot.nueva_revision()
+
+    def aplicar():
+        recommendations.actualizarPuntuacion(*clave, instance.puntuacion, revision,
+                                             anterior=anterior if anterior != clave else None)
+
+    transaction.on_commit(aplicar)
+
+
+def puntuacion_eliminada(sender, instance, **kwargs):
+    if _carga_masiva.get():
+        return
+    clave = (instance.idUsuario, instance.pelicula_id)
+    ajustar_actividad(instance.idUsuario, -1)
+    revision = snapshot.nueva_revision()
+    transaction.on_commit(lambda: recommendations.eliminarPuntuacion(*clave, revision))
+
+
+def pelicula_modificada(sender, **kwargs):
+    # Las películas no se actualizan incrementalmente: con la revisión nueva
+    # el modelo deja de coincidir con la BD y se reconstruye
+    if not _carga_masiva.get():
+        snapshot.nueva_revision()
+
+
+def conectar():
+    pre_save.connect(recordar_anterior, sender=Puntuacion)
+    post_save.connect(puntuacion_guardada, sender=Puntuacion)
+    post_delete.connect(puntuacion_eliminada, sender=Puntuacion)
+    post_save.connect(pelicula_modificada, sender=Pelicula)
+    post_delete.connect(pelicula_modificada, sender=Pelicula)
+
+
+@contextmanager
+def sin_actualizaciones():
+    """
+    Desactiva los receptores de este módulo en el contexto actual, por
+    ejemplo durante una carga masiva que después recalcula los recuentos y
+    la revisión y reconstruye el modelo. Las puntuaciones que se guardan a
+    la vez desde otros hilos siguen actualizándolos
+    """
+    token = _carga_masiva.set(True)
+    try:
+        yield
+    finally:
+        _carga_masiva.reset(token)
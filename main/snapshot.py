@@ -0,0 +1,143 @@
+#encoding:utf-8
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin exclusión entre procesos
+    fcntl = None
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from main import metrics
+from main.models import RevisionDatos
+
+# Se incrementa cada vez que cambia el conjunto de arrays guardados
+FORMATO = 4
+
+MANIFEST = 'manifest.json'
+ACTUAL = 'CURRENT'
+
+
+def directorio():
+    return str(getattr(settings, 'RECSYS_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'snapshots')))
+
+
+def huella_bd():
+    """
+    Huella exacta del contenido de la base de datos: la revisión de
+    RevisionDatos, que aumenta con cada cambio en películas o puntuaciones
+    """
+    revision = RevisionDatos.objects.filter(pk=1).values_list('revision', flat=True).first()
+    return str(revision or 0)
+
+
+def nueva_revision():
+    """
+    Incrementa la revisión de los datos dentro de la transacción en curso
+    Las señales de Pelicula y Puntuacion la llaman en cada save() y delete();
+    cualquier otra escritura (bulk_create, update, SQL) debe llamarla también
+    Retorna: (huella anterior, huella nueva)
+    """
+    with transaction.atomic():
+        if not RevisionDatos.objects.filter(pk=1).update(revision=F('revision') + 1):
+            RevisionDatos.objects.create(pk=1, revision=1)
+        revision = RevisionDatos.objects.filter(pk=1).values_list('revision', flat=True).get()
+    return str(revision - 1), str(revision)
+
+
+def version_actual():
+    """
+    Nombre de la última versión publicada, o None si no hay ninguna
+    """
+    try:
+        with open(os.path.join(directorio(), ACTUAL)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def bloqueo():
+    """
+    Exclusión entre los procesos del host mientras uno reconstruye el modelo
+    """
+    os.makedirs(directorio(), exist_ok=True)
+    with open(os.path.join(directorio(), '.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def guardar(arrays, huella):
+    """
+    Escribe los arrays como ficheros .npy en un directorio nuevo y lo publica
+    reemplazando atómicamente el puntero CURRENT
+    Retorna: nombre de la versión creada
+    """
+    base = directorio()
+    version = '%d-%x' % (FORMATO, time.time_ns())
+    destino = os.path.join(base, version)
+    temporal = destino + '.tmp'
+    os.makedirs(temporal)
+
+    for nombre, valores in arrays.items():
+        np.save(os.path.join(temporal, nombre + '.npy'), np.ascontiguousarray(valores))
+    with open(os.path.join(temporal, MANIFEST), 'w') as f:
+        json.dump({'formato': FORMATO, 'huella': huella, 'arrays': sorted(arrays)}, f)
+
+    os.rename(temporal, destino)
+    puntero = os.path.join(base, ACTUAL + '.tmp')
+    with open(puntero, 'w') as f:
+        f.write(version)
+    os.replace(puntero, os.path.join(base, ACTUAL))
+
+    _purgar(base, version)
+    return version
+
+
+def cargar(version=None):
+    """
+    Abre una versión (por defecto la actual) con los arrays mapeados en memoria
+    Retorna: (version, huella, arrays) o None si no hay una versión compatible
+    """
+    version = version or version_actual()
+    if version is None:
+        return None
+    ruta = os.path.join(directorio(), version)
+    try:
+        with open(os.path.join(ruta, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('formato') != FORMATO:
+        return None
+
+    with metrics.cronometro('recsys_modelo_carga_segundos', origen='snapshot'):
+        arrays = {nombre: np.load(os.path.join(ruta, nombre + '.npy'), mmap_mode='r')
+                  for nombre in manifest['arrays']}
+    return version, manifest['huella'], arrays
+
+
+def _purgar(base, actual):
+    # Conserva la versión publicada y la anterior; los procesos que aún
+    # tengan mapeada una versión borrada la siguen leyendo sin problema
+    conservar = getattr(settings, 'RECSYS_SNAPSHOT_KEEP', 2)
+    versiones = sorted(
+        (d for d in os.listdir(base) if os.path.isdir(os.path.join(base, d)) and not d.endswith('.tmp')),
+        key=lambda d: os.path.getmtime(os.path.join(base, d)),
+        reverse=True
+    )
+    for d in versiones[conservar:]:
+        if d != actual:
+            shutil.rmtree(os.path.join(base, d), ignore_errors=True)
@@ -0,0 +1,844 @@
+#encoding:utf-8
+import copy
+import heapq
+from collections.abc import Mapping
+from math import sqrt
+
+import numpy as np
+from scipy import sparse
+
+from main import metrics
+
+# Bytes de sumas densas por bloque de películas en vecinosPeliculas
+MEMORIA_BLOQUE = 64 << 20
+
+
+class SparsePrefs(Mapping):
+    """
+    Matriz dispersa usuario x película (CSR) con los mismos datos que prefs
+    Los ids de usuario y de película se remapean a índices densos
+    Se comporta como el diccionario prefs ({idUsuario: {idPelicula: puntuacion}}),
+    pero de solo lectura (los cambios dan una copia, ver con) y sin copias por
+    proceso: todos los arrays pueden ser ficheros mapeados en memoria de solo
+    lectura compartidos entre procesos
+    """
+
+    def __init__(self, arrays):
+        # usuarios: ids en el orden de las filas; orden: permutación que los ordena
+        # peliculas: ids ordenados de las columnas
+        self.usuarios = arrays['usuarios']
+        self.orden = arrays['orden']
+        self.peliculas = arrays['peliculas']
+        forma = (len(self.usuarios), len(self.peliculas))
+        self.matriz = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                        shape=forma, copy=False)
+        # Índice invertido película -> usuarios: la misma matriz en CSC
+        self.columnas = sparse.csc_matrix((arrays['csc_data'], arrays['csc_indices'], arrays['csc_indptr']),
+                                          shape=forma, copy=False)
+        # Usuarios modificados desde que se construyó la matriz (ver con)
+        self.modificados = {}
+
+    @classmethod
+    def from_arrays(cls, usuarios, peliculas, puntuaciones):
+        """
+        Construye la matriz a partir de tres columnas paralelas
+        (idUsuario, idPelicula, puntuacion)
+        Las filas siguen el orden de primera aparición de cada usuario
+        """
+        usuarios = np.asarray(usuarios, dtype=np.int64)
+        peliculas = np.asarray(peliculas, dtype=np.int64)
+        puntuaciones = np.asarray(puntuaciones, dtype=np.int16)
+
+        ids_usuarios, primera, filas = np.unique(usuarios, return_index=True, return_inverse=True)
+        # Renumera las filas por orden de aparición
+        orden = np.argsort(primera, kind='stable')
+        rango = np.empty_like(orden)
+        rango[orden] = np.arange(len(orden))
+        ids_peliculas, columnas = np.unique(peliculas, return_inverse=True)
+
+        matriz = sparse.csr_matrix(
+            (puntuaciones, (rango[filas], columnas)),
+            shape=(len(ids_usuarios), len(ids_peliculas))
+        )
+        matriz.sort_indices()
+        columnas = matriz.tocsc()
+        columnas.sort_indices()
+        return cls({
+            'usuarios': ids_usuarios[orden],
+            'orden': rango.astype(np.int64),
+            'peliculas': ids_peliculas,
+            'indptr': matriz.indptr,
+            'indices': matriz.indices,
+            'data': matriz.data,
+            'csc_indptr': columnas.indptr,
+            'csc_indices': columnas.indices,
+            'csc_data': columnas.data,
+        })
+
+    @classmethod
+    def from_prefs(cls, prefs):
+        """
+        Construye la matriz a partir del diccionario prefs
+        Las filas conservan el orden de iteración de prefs
+        """
+        usuarios = []
+        peliculas = []
+        puntuaciones = []
+        for person in prefs:
+            for item, rating in prefs[person].items():
+                usuarios.append(person)
+                peliculas.append(item)
+                puntuaciones.append(rating)
+        return cls.from_arrays(usuarios, peliculas, puntuaciones)
+
+    def to_arrays(self):
+        """
+        Retorna: diccionario con los arrays que necesita el constructor
+        No incluye las actualizaciones pendientes de modificados
+        """
+        return {
+            'usuarios': self.usuarios,
+            'orden': self.orden,
+            'peliculas': self.peliculas,
+            'indptr': self.matriz.indptr,
+            'indices': self.matriz.indices,
+            'data': self.matriz.data,
+            'csc_indptr': self.columnas.indptr,
+            'csc_indices': self.columnas.indices,
+            'csc_data': self.columnas.data,
+        }
+
+    def _fila(self, person):
+        # Índice de fila de person, o None si no está en la matriz
+        k = np.searchsorted(self.usuarios, person, sorter=self.orden)
+        if k < len(self.orden) and self.usuarios[self.orden[k]] == person:
+            return int(self.orden[k])
+        return None
+
+    def _columna(self, item):
+        j = np.searchsorted(self.peliculas, item)
+        if j < len(self.peliculas) and self.peliculas[j] == item:
+            return int(j)
+        return None
+
+    def __contains__(self, person):
+        if person in self.modificados:
+            return len(self.modificados[person]) > 0
+        return self._fila(person) is not None
+
+    def __getitem__(self, person):
+        if person in self.modificados:
+            if not self.modificados[person]:
+                raise KeyError(person)
+            return self.modificados[person]
+        i = self._fila(person)
+        if i is None:
+            raise KeyError(person)
+        return self._dict_fila(i)
+
+    def __iter__(self):
+        for person in self.usuarios.tolist():
+            if person not in self.modificados or self.modificados[person]:
+                yield person
+        for person, ratings in list(self.modificados.items()):
+            if ratings and self._fila(person) is None:
+                yield person
+
+    def items(self):
+        # Recorre las filas en orden sin buscar cada usuario
+        for i, person in enumerate(self.usuarios.tolist()):
+            if person in self.modificados:
+                if self.modificados[person]:
+                    yield person, self.modificados[person]
+            else:
+                yield person, self._dict_fila(i)
+        for person, ratings in list(self.modificados.items()):
+            if ratings and self._fila(person) is None:
+                yield person, ratings
+
+    def __len__(self):
+        n = len(self.usuarios)
+        for person, ratings in self.modificados.items():
+            en_matriz = self._fila(person) is not None
+            if en_matriz and not ratings:
+                n -= 1
+            elif not en_matriz and ratings:
+                n += 1
+        return n
+
+    def puntuaciones(self, person):
+        """
+        Retorna: diccionario {idPelicula: puntuacion} de person
+        """
+        if person in self.modificados:
+            return self.modificados[person]
+        return self._dict_fila(self._fila(person))
+
+    def _dict_fila(self, i):
+        # Cada llamada construye un diccionario nuevo: quien recorre una fila
+        # varias veces debe leerla una sola vez
+        inicio, fin = self.matriz.indptr[i], self.matriz.indptr[i + 1]
+        return dict(zip(self.peliculas[self.matriz.indices[inicio:fin]].tolist(),
+                        self.matriz.data[inicio:fin].tolist()))
+
+    def con(self, person, ratings):
+        """
+        Copia de la matriz con las puntuaciones de person sustituidas por
+        ratings, sin reconstruirla ni modificar esta: los arrays se comparten,
+        solo se copia el diccionario de modificados, y las consultas leen
+        ratings en lugar de la fila de person (si existe)
+        Un diccionario vacío equivale a eliminar al usuario
+        Coste proporcional a las puntuaciones de ese usuario
+        """
+        nueva = copy.copy(self)
+        nueva.modificados = dict(self.modificados)
+        nueva.modificados[person] = ratings
+        return nueva
+
+    def valoraciones(self, item):
+        """
+        Retorna: diccionario {idUsuario: puntuacion} de los usuarios que han
+        puntuado item, leído del índice invertido
+        """
+        result = {}
+        j = self._columna(item)
+        if j is not None:
+            inicio, fin = self.columnas.indptr[j], self.columnas.indptr[j + 1]
+            filas = self.columnas.indices[inicio:fin]
+            result = dict(zip(self.usuarios[filas].tolist(), self.columnas.data[inicio:fin].tolist()))
+        for person, ratings in self.modificados.items():
+            result.pop(person, None)
+            if item in ratings:
+                result[person] = ratings[item]
+        return result
+
+    def _columnas_de(self, person):
+        # Columnas y puntuaciones de person (solo películas presentes en la matriz)
+        if person in self.modificados:
+            pares = [(self._columna(item), rating) for item, rating in self.modificados[person].items()]
+            pares = sorted((j, rating) for j, rating in pares if j is not None)
+            return (np.array([j for j, _ in pares], dtype=np.int64),
+                    np.array([rating for _, rating in pares], dtype=np.int64))
+        i = self._fila(person)
+        inicio, fin = self.matriz.indptr[i], self.matriz.indptr[i + 1]
+        return self.matriz.indices[inicio:fin].astype(np.int64), self.matriz.data[inicio:fin].astype(np.int64)
+
+    def _filas_excluidas(self, person):
+        # Filas que no cuentan como vecinos: person y las sustituidas
+        filas = (self._fila(other) for other in [person, *self.modificados])
+        return np.array([i for i in filas if i is not None], dtype=np.int64)
+
+    def _sim_modificados(self, person):
+        # Similaridades con los usuarios sustituidos, calculadas sobre diccionarios
+        ratings = self.puntuaciones(person)
+        return [(_pearson(ratings, others), other)
+                for other, others in self.modificados.items() if other != person and others]
+
+    def similaridades(self, person, min_comunes=1):
+        """
+        Coeficiente de Pearson de person contra los usuarios que comparten
+        al menos min_comunes películas con él (el resto tiene similaridad 0)
+        Los candidatos y las sumas sobre películas comunes salen de una sola
+        pasada por las listas de usuarios de cada película de person
+        Las sumas son enteras, así que el resultado coincide bit a bit con
+        sim_pearson de recommendations
+        Retorna: (filas de los candidatos en orden ascendente, similaridades)
+        """
+        return self.similaridades_varias([person], min_comunes)[0]
+
+    def similaridades_varias(self, personas, min_comunes=1):
+        """
+        Como similaridades, pero para varios usuarios a la vez: las listas de
+        todas sus películas se recorren en una única pasada y las sumas de
+        cada par (usuario, candidato) se acumulan con un solo bincount
+        Retorna: lista de (filas, similaridades) en el orden de personas
+        """
+        columnas, ratings1, consulta = [], [], []
+        for k, person in enumerate(personas):
+            c, r = self._columnas_de(person)
+            columnas.append(c)
+            ratings1.append(r)
+            consulta.append(np.full(len(c), k, dtype=np.int64))
+        columnas = np.concatenate(columnas) if columnas else np.zeros(0, dtype=np.int64)
+
+        posiciones, longitudes = _tramos(self.columnas.indptr, columnas)
+        filas = self.columnas.indices[posiciones].astype(np.int64)
+        ratings2 = self.columnas.data[posiciones].astype(np.float64)
+        ratings1 = np.repeat(np.concatenate(ratings1 or [np.zeros(0)]), longitudes).astype(np.float64)
+        consulta = np.repeat(np.concatenate(consulta or [np.zeros(0, dtype=np.int64)]), longitudes)
+
+        # Clave única por par; ordenar por clave agrupa por consulta y
+        # deja los candidatos de cada una en orden ascendente de fila
+        num_filas = len(self.usuarios)
+        claves, grupo = np.unique(consulta * num_filas + filas, return_inverse=True)
+        n, r = _pearson_agrupado(grupo, ratings1, ratings2, len(claves))
+
+        limites = np.searchsorted(claves // max(num_filas, 1), np.arange(len(personas) + 1))
+        result = []
+        for k, person in enumerate(personas):
+            candidatos = claves[limites[k]:limites[k + 1]] % max(num_filas, 1)
+            sims = r[limites[k]:limites[k + 1]]
+            validos = (n[limites[k]:limites[k + 1]] >= min_comunes) & \
+                ~np.isin(candidatos, self._filas_excluidas(person))
+            result.append((candidatos[validos], sims[validos]))
+        return result
+
+    def similaridades_filas(self, person, filas, min_comunes=1):
+        """
+        Como similaridades, pero solo contra las filas indicadas (por ejemplo
+        los candidatos de un índice aproximado): se recorren sus filas y no
+        las listas completas de cada película de person
+        Retorna: (filas de los candidatos en orden ascendente, similaridades)
+        """
+        columnas, ratings1 = self._columnas_de(person)
+        filas = np.setdiff1d(np.asarray(filas, dtype=np.int64), self._filas_excluidas(person))
+        posiciones, longitudes = _tramos(self.matriz.indptr, filas)
+        otras = self.matriz.indices[posiciones]
+        k = np.minimum(np.searchsorted(columnas, otras), max(len(columnas) - 1, 0))
+        comunes = (columnas[k] == otras) if len(columnas) else np.zeros(len(otras), dtype=bool)
+
+        grupo = np.repeat(np.arange(len(filas)), longitudes)[comunes]
+        ratings2 = self.matriz.data[posiciones][comunes].astype(np.float64)
+        n, r = _pearson_agrupado(grupo, ratings1[k[comunes]].astype(np.float64), ratings2, len(filas))
+        validos = (n > 0) & (n >= min_comunes)
+        return filas[validos], r[validos]
+
+    def _mayores_ids(self, excluidas, n):
+        # Los n usuarios de mayor id fuera de excluidas: son los primeros
+        # entre los que tienen similaridad 0 en un orden (score, id) descendente
+        ids = []
+        for k in range(len(self.orden) - 1, -1, -1):
+            i = int(self.orden[k])
+            if i not in excluidas:
+                ids.append(int(self.usuarios[i]))
+                if n is not None and len(ids) >= n:
+                    break
+        return ids
+
+    def topMatches(self, person, n=5, min_comunes=1, filas=None):
+        """
+        Equivalente a recommendations.topMatches con sim_pearson
+        Solo se calcula la similaridad de los candidatos del índice invertido;
+        los demás usuarios cuentan con similaridad 0
+        Con filas (candidatos de un índice aproximado, ver ann.IndiceLSH) solo
+        se compara con esas filas y con los usuarios sustituidos
+        Retorna: lista de tuplas (similaridad, idUsuario)
+        """
+        if filas is None:
+            return self.topMatchesVarios([person], n, min_comunes)[person]
+
+        filas, sims = self.similaridades_filas(person, filas, min_comunes)
+        extra = self._sim_modificados(person) if self.modificados else []
+        scores = np.concatenate([sims, np.array([sim for sim, _ in extra], dtype=np.float64)])
+        ids = np.concatenate([self.usuarios[filas], np.array([other for _, other in extra], dtype=np.int64)])
+        return _ordenar(scores, ids, n)
+
+    def topMatchesVarios(self, personas, n=5, min_comunes=1):
+        """
+        topMatches de varios usuarios compartiendo una sola pasada por el
+        índice invertido
+        Retorna: diccionario {idUsuario: lista de tuplas (similaridad, idUsuario)}
+        """
+        result = {}
+        for person, (filas, sims) in zip(personas, self.similaridades_varias(personas, min_comunes)):
+            excluidas = set(filas.tolist())
+            excluidas.update(self._filas_excluidas(person).tolist())
+            ceros = self._mayores_ids(excluidas, n)
+
+            extra = self._sim_modificados(person) if self.modificados else []
+            scores = np.concatenate([sims, np.zeros(len(ceros)),
+                                     np.array([sim for sim, _ in extra], dtype=np.float64)])
+            ids = np.concatenate([self.usuarios[filas], np.array(ceros, dtype=np.int64),
+                                  np.array([other for _, other in extra], dtype=np.int64)])
+            result[person] = _ordenar(scores, ids, n)
+        return result
+
+    def getRecommendations(self, person, candidatas=None, n=None, min_comunes=1, filas=None):
+        """
+        Equivalente a recommendations.getRecommendations con sim_pearson
+        candidatas (opcional) limita las películas que se puntúan, por ejemplo
+        a las anteriores a una fecha (ver IndiceFechas.anteriores)
+        Con n solo se seleccionan y ordenan las n mejores
+        Con filas solo se usan como vecinos esas filas (ver topMatches)
+        Retorna: lista de tuplas (recomendacion, idPelicula)
+        """
+        with metrics.etapa('similitud'):
+            if filas is None:
+                filas, sims = self.similaridades(person, min_comunes)
+            else:
+                filas, sims = self.similaridades_filas(person, filas, min_comunes)
+        with metrics.etapa('puntuacion'):
+            return self._puntuar(person, filas, sims, candidatas, n)
+
+    def _puntuar(self, person, filas, sims, candidatas, n):
+        # ignore scores of zero or lower
+        positivas = sims > 0
+        filas, sims = filas[positivas], sims[positivas]
+
+        # Una pasada por las filas de los vecinos en orden ascendente: cada
+        # película acumula en el mismo orden que el bucle sobre prefs
+        posiciones, longitudes = _tramos(self.matriz.indptr, filas)
+        columnas = self.matriz.indices[posiciones]
+        pesos = np.repeat(sims, longitudes)
+        totals = np.bincount(columnas, weights=self.matriz.data[posiciones] * pesos, minlength=len(self.peliculas))
+        simSums = np.bincount(columnas, weights=pesos, minlength=len(self.peliculas))
+        vecinos = np.bincount(columnas, minlength=len(self.peliculas))
+
+        # only score movies I haven't seen yet
+        mascara = vecinos > 0
+        mascara[self._columnas_de(person)[0]] = False
+        if candidatas is not None:
+            mascara &= candidatas.mascara(self.peliculas)
+
+        extra = [(s, other) for s, other in self._sim_modificados(person) if s > 0] if self.modificados else []
+        if extra:
+            # Los usuarios sustituidos se suman aparte, sobre diccionarios
+            ratings = self.puntuaciones(person)
+            ids = self.peliculas[mascara].tolist()
+            totals = dict(zip(ids, totals[mascara].tolist()))
+            simSums = dict(zip(ids, simSums[mascara].tolist()))
+            for s, other in extra:
+                for item, rating in self.modificados[other].items():
+                    if (item not in ratings or ratings[item] == 0) and (candidatas is None or item in candidatas):
+                        totals[item] = totals.get(item, 0) + rating * s
+                        simSums[item] = simSums.get(item, 0) + s
+            items = list(totals)
+            return _ordenar(np.array([totals[i] / simSums[i] for i in items], dtype=np.float64),
+                            np.array(items, dtype=np.int64), n)
+
+        if not mascara.any():
+            return []
+
+        return _ordenar(totals[mascara] / simSums[mascara], self.peliculas[mascara], n)
+
+    def vecinosPeliculas(self, n=10):
+        """
+        Las n películas más similares a cada película (Pearson entre
+        columnas), equivalente a recommendations.calculateSimilarItems
+        Las sumas sobre los usuarios comunes de cada par salen de productos
+        de la matriz CSC por su traspuesta, un bloque de películas a la vez
+        para no pasar de MEMORIA_BLOQUE; como son sumas enteras, el resultado
+        coincide bit a bit con el de topMatches sobre diccionarios
+        No incluye las actualizaciones pendientes de modificados
+        Retorna: ListasVecinos
+        """
+        # Película x usuario (CSR) y usuario x película (CSR) en float64
+        puntos = self.columnas.T.astype(np.float64).tocsr()
+        unos = puntos.copy()
+        unos.data[:] = 1.0
+        cuadrados = puntos.multiply(puntos).tocsr()
+        puntos_t, unos_t, cuadrados_t = (m.T.tocsr() for m in (puntos, unos, cuadrados))
+
+        num_peliculas = len(self.peliculas)
+        # Seis matrices densas de bloque x películas
+        bloque = max(1, MEMORIA_BLOQUE // (6 * 8 * max(num_peliculas, 1)))
+        claves, indptr, vecinos, sims = [], [0], [], []
+        for a in range(0, num_peliculas, bloque):
+            b = min(a + bloque, num_peliculas)
+            n_comunes = (unos[a:b] @ unos_t).toarray()
+            sum1 = (puntos[a:b] @ unos_t).toarray()
+            sum2 = (unos[a:b] @ puntos_t).toarray()
+            sum1Sq = (cuadrados[a:b] @ unos_t).toarray()
+            sum2Sq = (unos[a:b] @ cuadrados_t).toarray()
+            pSum = (puntos[a:b] @ puntos_t).toarray()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                num = pSum - (sum1 * sum2 / n_comunes)
+                den = np.sqrt((sum1Sq - sum1 ** 2 / n_comunes) * (sum2Sq - sum2 ** 2 / n_comunes))
+                r = num / den
+            r[(den == 0) | np.isnan(den)] = 0.0
+            for k in range(b - a):
+                otras = np.ones(num_peliculas, dtype=bool)
+                otras[a + k] = False
+                mejores = _ordenar(r[k][otras], self.peliculas[otras], n)
+                claves.append(int(self.peliculas[a + k]))
+                indptr.append(indptr[-1] + len(mejores))
+                sims.extend(sim for sim, _ in mejores)
+                vecinos.extend(other for _, other in mejores)
+        return ListasVecinos({
+            'claves': np.array(claves, dtype=np.int64),
+            'indptr': np.array(indptr, dtype=np.int64),
+            'vecinos': np.array(vecinos, dtype=np.int64),
+            'sims': np.array(sims, dtype=np.float64),
+        })
+
+    def vecinosPelicula(self, item, n=10):
+        """
+        Las n películas más similares a item con las puntuaciones actuales,
+        incluidas las de modificados: la lista de vecinosPeliculas que
+        saldría al reconstruir la matriz
+        Las sumas de cada película en común se acumulan recorriendo las
+        filas de los usuarios que han puntuado item
+        Retorna: lista de tuplas (similaridad, idPelicula)
+        """
+        ratings1 = self.valoraciones(item)
+        sums = {}
+        for person, r1 in ratings1.items():
+            for other, r2 in self[person].items():
+                if other == item:
+                    continue
+                acc = sums.get(other)
+                if acc is None:
+                    acc = sums[other] = [0, 0, 0, 0, 0, 0]
+                acc[0] += 1
+                acc[1] += r1
+                acc[2] += r2
+                acc[3] += r1 * r1
+                acc[4] += r2 * r2
+                acc[5] += r1 * r2
+
+        sims = {}
+        for other, (comunes, sum1, sum2, sum1Sq, sum2Sq, pSum) in sums.items():
+            num = pSum - (sum1 * sum2 / comunes)
+            den = (sum1Sq - sum1 ** 2 / comunes) * (sum2Sq - sum2 ** 2 / comunes)
+            sims[other] = num / sqrt(den) if den > 0 else 0.0
+
+        # El resto de películas puntuadas cuenta con similaridad 0: solo hacen
+        # falta las n de mayor id
+        todas = set(self.peliculas.tolist())
+        todas.update(other for ratings in self.modificados.values() for other in ratings)
+        ceros = []
+        for other in sorted(todas, reverse=True):
+            if n is not None and len(ceros) >= n:
+                break
+            if other == item or other in sims:
+                continue
+            j = self._columna(other)
+            # Una columna con pocas puntuaciones puede haberse quedado vacía
+            if j is None or self.columnas.indptr[j + 1] - self.columnas.indptr[j] <= len(self.modificados):
+                if not self.valoraciones(other):
+                    continue
+            ceros.append(other)
+        ids = list(sims) + ceros
+        scores = [sims[other] for other in sims] + [0.0] * len(ceros)
+        return _ordenar(np.array(scores, dtype=np.float64), np.array(ids, dtype=np.int64), n)
+
+
+class IndiceInvertido(Mapping):
+    """
+    Vista película -> {idUsuario: puntuacion} sobre una SparsePrefs,
+    equivalente a transformPrefs(prefs) pero sin copiar nada
+    """
+
+    def __init__(self, prefs):
+        self.prefs = prefs
+
+    def __getitem__(self, item):
+        result = self.prefs.valoraciones(item)
+        if not result:
+            raise KeyError(item)
+        return result
+
+    def __iter__(self):
+        vistas = set()
+        for item in self.prefs.peliculas.tolist():
+            vistas.add(item)
+            if item in self:
+                yield item
+        for ratings in list(self.prefs.modificados.values()):
+            for item in ratings:
+                if item not in vistas:
+                    vistas.add(item)
+                    yield item
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ListasVecinos(Mapping):
+    """
+    Listas de vecinos por película ({idPelicula: [(similaridad, idPelicula)]})
+    guardadas en arrays planos, como itemsim pero compartible entre procesos
+    """
+
+    def __init__(self, arrays):
+        self.claves = arrays['claves']
+        self.indptr = arrays['indptr']
+        self.vecinos = arrays['vecinos']
+        self.sims = arrays['sims']
+
+    @classmethod
+    def from_dict(cls, listas):
+        claves = sorted(listas)
+        return cls({
+            'claves': np.array(claves, dtype=np.int64),
+            'indptr': np.cumsum([0] + [len(listas[c]) for c in claves], dtype=np.int64),
+            'vecinos': np.array([other for c in claves for (_, other) in listas[c]], dtype=np.int64),
+            'sims': np.array([sim for c in claves for (sim, _) in listas[c]], dtype=np.float64),
+        })
+
+    def to_arrays(self):
+        return {'claves': self.claves, 'indptr': self.indptr, 'vecinos': self.vecinos, 'sims': self.sims}
+
+    def __getitem__(self, clave):
+        k = np.searchsorted(self.claves, clave)
+        if k == len(self.claves) or self.claves[k] != clave:
+            raise KeyError(clave)
+        inicio, fin = self.indptr[k], self.indptr[k + 1]
+        return list(zip(self.sims[inicio:fin].tolist(), self.vecinos[inicio:fin].tolist()))
+
+    def __iter__(self):
+        return iter(self.claves.tolist())
+
+    def __len__(self):
+        return len(self.claves)
+
+
+class ListasActualizadas(Mapping):
+    """
+    Listas de vecinos por película en las que las de pendientes se
+    recalculan al leerlas con calcular(idPelicula); el resto sale de base
+    """
+
+    def __init__(self, base, pendientes, calcular):
+        self.base = base
+        self.pendientes = pendientes
+        self.calcular = calcular
+
+    def __getitem__(self, clave):
+        if clave in self.pendientes:
+            return self.calcular(clave)
+        return self.base[clave]
+
+    def __iter__(self):
+        yield from self.base
+        for clave in self.pendientes:
+            if clave not in self.base:
+                yield clave
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class IndiceFechas:
+    """
+    Fechas de estreno de las películas en arrays ordenados
+    - fechas / peliculas: ordinales de fecha ascendentes y sus películas,
+      para localizar con bisección las películas anteriores a una fecha
+    - ids / ordinales: ids ascendentes y su fecha, para consultar una película
+    Las películas sin fecha no aparecen
+    """
+
+    def __init__(self, arrays):
+        self.fechas = arrays['fechas']
+        self.peliculas = arrays['peliculas']
+        self.ids = arrays['ids']
+        self.ordinales = arrays['ordinales']
+
+    @classmethod
+    def from_pares(cls, pares):
+        """
+        Construye el índice a partir de tuplas (idPelicula, fecha)
+        """
+        pares = [(item, fecha.toordinal()) for item, fecha in pares if fecha]
+        ids = np.array([item for item, _ in pares], dtype=np.int64)
+        ordinales = np.array([ordinal for _, ordinal in pares], dtype=np.int64)
+        por_fecha = np.lexsort((ids, ordinales))
+        por_id = np.argsort(ids, kind='stable')
+        return cls({
+            'fechas': ordinales[por_fecha],
+            'peliculas': ids[por_fecha],
+            'ids': ids[por_id],
+            'ordinales': ordinales[por_id],
+        })
+
+    def to_arrays(self):
+        return {'fechas': self.fechas, 'peliculas': self.peliculas, 'ids': self.ids, 'ordinales': self.ordinales}
+
+    def posicion(self, fecha):
+        """
+        Retorna: número de películas estrenadas antes de fecha (bisección)
+        """
+        return int(np.searchsorted(self.fechas, fecha.toordinal(), side='left'))
+
+    def anteriores(self, fecha):
+        """
+        Retorna: filtro con las películas estrenadas antes de fecha
+        """
+        return PeliculasAnteriores(self, fecha.toordinal())
+
+
+class PeliculasAnteriores:
+    """
+    Conjunto de películas anteriores a una fecha, sin materializarlo:
+    admite "item in filtro" y máscaras sobre arrays de ids
+    """
+
+    def __init__(self, indice, limite):
+        self.indice = indice
+        self.limite = limite
+
+    def mascara(self, ids):
+        indice = self.indice
+        if len(indice.ids) == 0:
+            return np.zeros(len(ids), dtype=bool)
+        k = np.minimum(np.searchsorted(indice.ids, ids), len(indice.ids) - 1)
+        return (indice.ids[k] == ids) & (indice.ordinales[k] < self.limite)
+
+    def __contains__(self, item):
+        k = np.searchsorted(self.indice.ids, item)
+        return bool(k < len(self.indice.ids) and self.indice.ids[k] == item and self.indice.ordinales[k] < self.limite)
+
+
+class RankingPopular:
+    """
+    Las k películas mejor valoradas por media bayesiana antes de cada fecha,
+    para recomendar cuando el filtrado colaborativo no da bastantes
+    - fechas: ordinales ascendentes en los que cambia la lista; la lista de
+      cada uno vale para los límites posteriores hasta el siguiente. El
+      último, SIN_LIMITE, es la lista sin límite de fecha (incluye las
+      películas sin fecha)
+    - indptr / peliculas / medias: la lista de cada fecha, de mejor a peor
+    Una consulta es una bisección más la lectura del principio de una lista
+    """
+
+    SIN_LIMITE = np.iinfo(np.int64).max
+
+    def __init__(self, arrays):
+        self.fechas = arrays['fechas']
+        self.indptr = arrays['indptr']
+        self.peliculas = arrays['peliculas']
+        self.medias = arrays['medias']
+
+    @classmethod
+    def from_prefs(cls, prefs, fechas, k=100, peso=None):
+        """
+        Construye el ranking sobre la matriz (sin las actualizaciones
+        pendientes) y el IndiceFechas de las películas (o None)
+        media bayesiana = (peso * media global + suma) / (peso + puntuaciones)
+        peso: puntuaciones "virtuales" con la media global; por defecto, las
+        que tiene de media cada película puntuada
+        """
+        csr = prefs.matriz
+        cuentas = np.bincount(csr.indices, minlength=len(prefs.peliculas))
+        sumas = np.bincount(csr.indices, weights=csr.data, minlength=len(prefs.peliculas))
+        puntuadas = cuentas > 0
+        ids = np.asarray(prefs.peliculas)[puntuadas]
+        cuentas, sumas = cuentas[puntuadas], sumas[puntuadas]
+        if len(ids) == 0:
+            return cls({'fechas': np.array([cls.SIN_LIMITE], dtype=np.int64), 'indptr': np.zeros(2, dtype=np.int64),
+                        'peliculas': np.zeros(0, dtype=np.int64), 'medias': np.zeros(0, dtype=np.float64)})
+        if peso is None:
+            peso = cuentas.mean()
+        medias = (peso * sumas.sum() / cuentas.sum() + sumas) / (peso + cuentas)
+
+        # Fecha de cada película puntuada (las que no tienen solo van en la última lista)
+        con_fecha = np.zeros(len(ids), dtype=bool)
+        ordinales = np.zeros(len(ids), dtype=np.int64)
+        if fechas is not None and len(fechas.ids):
+            k_fecha = np.minimum(np.searchsorted(fechas.ids, ids), len(fechas.ids) - 1)
+            con_fecha = fechas.ids[k_fecha] == ids
+            ordinales = fechas.ordinales[k_fecha]
+
+        # Se recorren por fecha con un montículo de las k mejores; solo se
+        # guarda la lista tras las fechas en las que cambia
+        claves, listas = [], []
+        mejores = []
+        orden = np.argsort(ordinales[con_fecha], kind='stable')
+        fechas_orden = ordinales[con_fecha][orden].tolist()
+        candidatas = list(zip(medias[con_fecha][orden].tolist(), ids[con_fecha][orden].tolist()))
+        cambiada = False
+        for i, candidata in enumerate(candidatas):
+            if len(mejores) < k:
+                heapq.heappush(mejores, candidata)
+                cambiada = True
+            elif candidata > mejores[0]:
+                heapq.heapreplace(mejores, candidata)
+                cambiada = True
+            if cambiada and (i + 1 == len(candidatas) or fechas_orden[i + 1] != fechas_orden[i]):
+                claves.append(fechas_orden[i] + 1)
+                listas.append(sorted(mejores, reverse=True))
+                cambiada = False
+        claves.append(cls.SIN_LIMITE)
+        listas.append(heapq.nlargest(k, zip(medias.tolist(), ids.tolist())))
+
+        return cls({
+            'fechas': np.array(claves, dtype=np.int64),
+            'indptr': np.cumsum([0] + [len(lista) for lista in listas], dtype=np.int64),
+            'peliculas': np.array([item for lista in listas for (_, item) in lista], dtype=np.int64),
+            'medias': np.array([media for lista in listas for (media, _) in lista], dtype=np.float64),
+        })
+
+    def to_arrays(self):
+        return {'fechas': self.fechas, 'indptr': self.indptr, 'peliculas': self.peliculas, 'medias': self.medias}
+
+    def mejores(self, fecha=None, n=10, excluidas=()):
+        """
+        Las n películas mejor valoradas estrenadas antes de fecha (o todas),
+        sin las de excluidas; como mucho k
+        Retorna: lista de tuplas (media, idPelicula)
+        """
+        if fecha is None:
+            k = len(self.fechas) - 1
+        else:
+            # La última lista que empieza a valer antes del límite
+            k = int(np.searchsorted(self.fechas, fecha.toordinal(), side='right')) - 1
+        if k < 0 or n <= 0:
+            return []
+        inicio, fin = self.indptr[k], self.indptr[k + 1]
+        resultado = []
+        for media, item in zip(self.medias[inicio:fin].tolist(), self.peliculas[inicio:fin].tolist()):
+            if item not in excluidas:
+                resultado.append((media, item))
+                if len(resultado) == n:
+                    break
+        return resultado
+
+
+def _pearson(ratings1, ratings2):
+    # Mismas operaciones que recommendations.sim_pearson sobre dos diccionarios
+    si = [item for item in ratings1 if item in ratings2]
+    n = len(si)
+    if n == 0:
+        return 0.0
+
+    sum1 = sum(ratings1[it] for it in si)
+    sum2 = sum(ratings2[it] for it in si)
+    sum1Sq = sum(ratings1[it] ** 2 for it in si)
+    sum2Sq = sum(ratings2[it] ** 2 for it in si)
+    pSum = sum(ratings1[it] * ratings2[it] for it in si)
+
+    num = pSum - (sum1 * sum2 / n)
+    den = (sum1Sq - sum1 ** 2 / n) * (sum2Sq - sum2 ** 2 / n)
+    if den <= 0:
+        return 0.0
+    return num / sqrt(den)
+
+
+def _pearson_agrupado(grupo, ratings1, ratings2, m):
+    # Sumas sobre películas comunes de cada grupo y coeficiente de Pearson,
+    # con la misma fórmula que recommendations.sim_pearson
+    # Retorna: (películas en común, similaridad) de cada grupo
+    n = np.bincount(grupo, minlength=m)
+    sum1 = np.bincount(grupo, weights=ratings1, minlength=m)
+    sum2 = np.bincount(grupo, weights=ratings2, minlength=m)
+    sum1Sq = np.bincount(grupo, weights=ratings1 * ratings1, minlength=m)
+    sum2Sq = np.bincount(grupo, weights=ratings2 * ratings2, minlength=m)
+    pSum = np.bincount(grupo, weights=ratings1 * ratings2, minlength=m)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num = pSum - (sum1 * sum2 / n)
+        den = np.sqrt((sum1Sq - sum1 ** 2 / n) * (sum2Sq - sum2 ** 2 / n))
+        r = num / den
+    r[(den == 0) | np.isnan(den)] = 0.0
+    return n, r
+
+
+def _tramos(indptr, filas):
+    # Posiciones de los tramos indptr[f]:indptr[f+1] de cada fila, concatenadas
+    inicios = np.asarray(indptr[filas], dtype=np.int64)
+    longitudes = np.asarray(indptr[filas + 1], dtype=np.int64) - inicios
+    desplazamientos = np.repeat(inicios - (np.cumsum(longitudes) - longitudes), longitudes)
+    return np.arange(longitudes.sum()) + desplazamientos, longitudes
+
+
+def _ordenar(scores, ids, n=None):
+    # Orden descendente por (score, id), como sort() + reverse() sobre tuplas
+    if n is not None and n <= 0:
+        return []
+    if n is not None and n < len(scores):
+        # Selección acotada: solo se ordenan las n mayores y sus empates
+        umbral = np.partition(scores, len(scores) - n)[len(scores) - n]
+        seleccion = scores >= umbral
+        scores, ids = scores[seleccion], ids[seleccion]
+    orden = np.lexsort((ids, scores))[::-1][:n]
+    return list(zip(scores[orden].tolist(), ids[orden].tolist()))
@@ -0,0 +1,78 @@
+#encoding:utf-8
+"""
+Generador de datos sintéticos con el formato de data/movies1.txt y
+data/ratings.txt, para medir el rendimiento a distintas escalas
+
+escala multiplica los usuarios y las puntuaciones del dataset incluido
+(522 usuarios, 24752 puntuaciones); las películas crecen con la raíz
+cuadrada de la escala, como suele crecer un catálogo frente a su público.
+La popularidad de las películas, la actividad de los usuarios y el reparto
+siguen distribuciones de cola larga (Zipf / Pareto), y las puntuaciones
+(de 5 a 50 en pasos de 5) salen de la calidad de cada película, el sesgo de
+cada usuario y ruido
+"""
+import os
+
+import numpy as np
+
+USUARIOS = 522
+PUNTUACIONES = 24752
+PELICULAS = 1641
+# Actores distintos por película del dataset incluido, aproximadamente
+ACTORES = 5000
+
+# Usuarios generados a la vez: la memoria no depende de la escala
+BLOQUE = 20000
+
+
+def generar(directorio, escala=1, semilla=0):
+    """
+    Escribe movies1.txt y ratings.txt en directorio
+    Retorna: diccionario con el número de películas, usuarios y puntuaciones
+    """
+    rng = np.random.default_rng(semilla)
+    os.makedirs(directorio, exist_ok=True)
+    num_peliculas = max(int(PELICULAS * np.sqrt(escala)), 10)
+    num_usuarios = max(int(USUARIOS * escala), 2)
+
+    # Popularidad Zipf en un orden aleatorio de ids
+    popularidad = 1.0 / np.arange(1, num_peliculas + 1)
+    popularidad /= popularidad.sum()
+    ids_peliculas = rng.permutation(num_peliculas) + 1
+    calidad = rng.normal(0, 1, num_peliculas)
+
+    with open(os.path.join(directorio, 'movies1.txt'), 'w', encoding='utf-8') as f:
+        actores = 1.0 / np.arange(1, ACTORES + 1) ** 0.8
+        actores /= actores.sum()
+        for i, id_pelicula in enumerate(ids_peliculas.tolist()):
+            anyo = int(min(2020, 2020 - rng.exponential(20)))
+            reparto = np.unique(rng.choice(ACTORES, size=rng.integers(1, 10), p=actores))
+            f.write('%d\tPelícula sintética %d (%d)\t%d-%02d-%02d\tDirector %d\t%s\n' % (
+                id_pelicula, id_pelicula, anyo, anyo, rng.integers(1, 13), rng.integers(1, 29),
+                rng.integers(1, max(num_peliculas // 5, 2)), ', '.join('Actor %d' % a for a in reparto)))
+
+    # Actividad de los usuarios: Pareto escalada a la media del dataset
+    media = PUNTUACIONES / USUARIOS
+    total = 0
+    with open(os.path.join(directorio, 'ratings.txt'), 'w', encoding='utf-8') as f:
+        for inicio in range(0, num_usuarios, BLOQUE):
+            fin = min(inicio + BLOQUE, num_usuarios)
+            # (la media de Pareto(1.5) + 1 es 3; se pide algo más para compensar
+            # las repeticiones que se descartan)
+            actividad = (rng.pareto(1.5, fin - inicio) + 1) * media / 2
+            actividad = np.clip(actividad.astype(np.int64), 1, num_peliculas)
+            usuarios = np.repeat(np.arange(inicio, fin), actividad)
+            peliculas = rng.choice(num_peliculas, size=len(usuarios), p=popularidad)
+            # Una sola puntuación por usuario y película
+            pares = np.unique(usuarios * num_peliculas + peliculas)
+            usuarios, peliculas = pares // num_peliculas, pares % num_peliculas
+
+            sesgo = rng.normal(0, 1, fin - inicio)
+            valores = 33 + 6 * calidad[peliculas] + 4 * sesgo[usuarios - inicio] + rng.normal(0, 7, len(pares))
+            valores = np.clip(np.round(valores / 5) * 5, 5, 50).astype(np.int64)
+            lineas = ['%d\t%d\t%d\n' % fila for fila in
+                      zip((usuarios + 100000).tolist(), ids_peliculas[peliculas].tolist(), valores.tolist())]
+            f.writelines(lineas)
+            total += len(lineas)
+
+    return {'peliculas': num_peliculas, 'usuarios': num_usuarios, 'puntuaciones': total}
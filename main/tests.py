@@ -1,3 +1,960 @@
-from django.test import TestCase
+#encoding:utf-8
+"""
+Pruebas de regresión del sistema de recomendación
 
-# Create your tests here.
+Cada clase crea un conjunto pequeño de películas y puntuaciones aleatorias
+(con semilla fija) y trabaja con snapshots en un directorio temporal
+"""
+import contextvars
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future
+from datetime import date
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from main import columnar, ejecutor, factorization, jobs, populateDB, precompute, recommendations, signals, snapshot, views
+from main.admin import PeliculaAdmin, PuntuacionAdmin
+from main.ann import IndiceLSH
+from main.cache import CacheResultados
+from main.factorization import FactoresLatentes
+from main.modelo import Modelo
+from main.models import ActividadUsuario, Pelicula, PrecalculoUsuario, Puntuacion, RecomendacionPrecalculada
+
+USUARIOS = 40
+PELICULAS = 60
+
+
+class RecomendadorTestCase(TestCase):
+    """
+    Base de las pruebas: datos aleatorios y un modelo nuevo en cada prueba
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directorio = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directorio, True)
+        cls.enterClassContext(override_settings(
+            RECSYS_SNAPSHOT_DIR=os.path.join(directorio, 'snapshots'),
+            RECSYS_COLUMNAR_DIR=os.path.join(directorio, 'columnas'),
+            RECSYS_CACHE=False,
+        ))
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        Pelicula.objects.bulk_create([
+            Pelicula(idPelicula=i, titulo='Película %d' % i, fecha=date(rng.randint(1950, 2010), rng.randint(1, 12), 1),
+                     director='Director %d' % (i % 7), actoresPrincipales='Actor %d, Actor %d' % (i % 11, i % 13))
+            for i in range(1, PELICULAS + 1)
+        ])
+        Puntuacion.objects.bulk_create([
+            Puntuacion(idUsuario=u, pelicula_id=p, puntuacion=rng.randint(1, 5) * 10)
+            for u in range(1, USUARIOS + 1)
+            for p in rng.sample(range(1, PELICULAS + 1), rng.randint(5, 25))
+        ])
+
+    def setUp(self):
+        recommendations.publicar(Modelo())
+        recommendations._precalculadas.clear()
+
+    def prefs(self, m):
+        # Copia en diccionarios, como el prefs original
+        return {u: dict(ratings) for u, ratings in m.prefs.items()}
+
+    def assertMismasRecomendaciones(self, recs, esperadas):
+        # Mismas películas en el mismo orden; las puntuaciones pueden diferir
+        # en el último bit si las sumas se hacen en otro orden
+        self.assertEqual([p for (_, p) in recs], [p for (_, p) in esperadas])
+        for (rec, _), (esperada, _) in zip(recs, esperadas):
+            self.assertAlmostEqual(rec, esperada, places=9)
+
+
+class MotoresTest(RecomendadorTestCase):
+    """
+    La matriz dispersa da exactamente lo mismo que los bucles sobre prefs
+    """
+
+    def test_vecinos(self):
+        m = recommendations.asegurarModelo()
+        prefs = self.prefs(m)
+        for u in prefs:
+            esperado = recommendations.topMatches(prefs, u, n=5)
+            self.assertEqual(m.matriz.topMatches(u, n=5), esperado)
+            self.assertEqual(recommendations.topMatches(prefs, u, n=5, itemPrefs=m.raters), esperado)
+        self.assertEqual(m.matriz.topMatchesVarios(list(prefs), n=3),
+                         {u: recommendations.topMatches(prefs, u, n=3) for u in prefs})
+
+    def test_recomendaciones(self):
+        m = recommendations.asegurarModelo()
+        prefs = self.prefs(m)
+        for u in prefs:
+            for n in (None, 2, 10):
+                self.assertEqual(m.matriz.getRecommendations(u, n=n), recommendations.getRecommendations(prefs, u, n=n))
+
+    def test_n_cero(self):
+        m = recommendations.asegurarModelo()
+        prefs = self.prefs(m)
+        for u in list(prefs)[:5]:
+            for n in (0, -1):
+                self.assertEqual(m.matriz.topMatches(u, n=n), [])
+                self.assertEqual(m.matriz.getRecommendations(u, n=n), [])
+                self.assertEqual(recommendations.topMatches(prefs, u, n=n), [])
+        self.assertEqual(m.matriz.topMatchesVarios(list(prefs)[:5], n=0), {u: [] for u in list(prefs)[:5]})
+
+    def test_motor_dict(self):
+        m = recommendations.asegurarModelo()
+        for u in m.prefs:
+            sparse = recommendations.calcularRecomendaciones(u, date(1990, 1, 1), n=5, m=m)
+            with override_settings(RECSYS_ENGINE='dict'):
+                self.assertEqual(recommendations.calcularRecomendaciones(u, date(1990, 1, 1), n=5, m=m), sparse)
+
+    def test_vecinos_por_pelicula(self):
+        m = recommendations.asegurarModelo()
+        esperado = recommendations.calculateSimilarItems(m.prefs, n=20)
+        vecinos = m.matriz.vecinosPeliculas(n=20)
+        self.assertEqual(set(vecinos), set(esperado))
+        for item, lista in esperado.items():
+            self.assertEqual(vecinos[item], lista)
+
+
+class HuellaTest(RecomendadorTestCase):
+    """
+    Cualquier cambio en películas o puntuaciones cambia la huella de la BD,
+    y un proceso nuevo no usa un snapshot que ya no la refleja
+    """
+
+    def assertCambiaHuella(self, cambiar):
+        antes = snapshot.huella_bd()
+        cambiar()
+        self.assertNotEqual(snapshot.huella_bd(), antes)
+
+    def test_cambios(self):
+        puntuacion = Puntuacion.objects.filter(idUsuario=1).first()
+        otra = next(p for p in range(1, PELICULAS + 1)
+                    if not Puntuacion.objects.filter(idUsuario=1, pelicula_id=p).exists())
+
+        def mover():
+            puntuacion.pelicula_id = otra
+            puntuacion.save()
+
+        def compensar():
+            # La suma de las puntuaciones no cambia
+            a = Puntuacion.objects.filter(idUsuario=2).exclude(puntuacion=50).first()
+            b = Puntuacion.objects.filter(idUsuario=2).exclude(pk=a.pk).exclude(puntuacion=10).first()
+            a.puntuacion += 10
+            a.save()
+            b.puntuacion -= 10
+            b.save()
+
+        def cambiar_fecha():
+            pelicula = Pelicula.objects.get(pk=1)
+            pelicula.fecha = date(1900, 1, 1)
+            pelicula.save()
+
+        for cambiar in (mover, compensar, cambiar_fecha, lambda: Puntuacion.objects.first().delete()):
+            self.assertCambiaHuella(cambiar)
+
+    def test_proceso_nuevo(self):
+        recommendations.asegurarModelo()
+        puntuacion = Puntuacion.objects.filter(idUsuario=1).first()
+        puntuacion.pelicula_id = next(p for p in range(1, PELICULAS + 1)
+                                      if not Puntuacion.objects.filter(idUsuario=1, pelicula_id=p).exists())
+        puntuacion.save()
+
+        # Sin el modelo cargado, como un proceso que acaba de arrancar
+        recommendations.publicar(Modelo())
+        m = recommendations.asegurarModelo()
+        self.assertEqual(m.huella, snapshot.huella_bd())
+        self.assertEqual(dict(m.prefs[1]), dict(Puntuacion.objects.filter(idUsuario=1).values_list(
+            'pelicula_id', 'puntuacion')))
+
+
+class ActualizacionesTest(RecomendadorTestCase):
+    """
+    Las actualizaciones incrementales dan lo mismo que reconstruir el modelo
+    """
+
+    def modificar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            nueva = Puntuacion.objects.filter(idUsuario=1).values_list('pelicula_id', flat=True)
+            Puntuacion.objects.create(idUsuario=1, pelicula_id=next(p for p in range(1, PELICULAS + 1)
+                                                                   if p not in set(nueva)), puntuacion=50)
+            editada = Puntuacion.objects.filter(idUsuario=2).first()
+            editada.puntuacion = 10 if editada.puntuacion != 10 else 20
+            editada.save()
+            Puntuacion.objects.filter(idUsuario=3).first().delete()
+            Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=1, puntuacion=40)
+            Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=2, puntuacion=20)
+
+    def test_igual_que_reconstruir(self):
+        recommendations.asegurarModelo()
+        self.modificar()
+        incremental = recommendations.modelo
+        self.assertEqual(len(incremental.matriz.modificados), 4)
+        self.assertEqual(incremental.huella, snapshot.huella_bd())
+
+        recommendations.reconstruirModelo()
+        completo = recommendations.modelo
+        self.assertFalse(completo.matriz.modificados)
+        self.assertEqual(self.prefs(incremental), self.prefs(completo))
+        for u in completo.prefs:
+            self.assertEqual(recommendations._usuariosSimilares(incremental, u, 3),
+                             recommendations._usuariosSimilares(completo, u, 3))
+            # Los usuarios sustituidos se suman después del resto (ver SparsePrefs._puntuar)
+            self.assertMismasRecomendaciones(recommendations.calcularRecomendaciones(u, n=5, m=incremental),
+                                             recommendations.calcularRecomendaciones(u, n=5, m=completo))
+
+    @override_settings(RECSYS_METHOD='item')
+    def test_vecinos_por_pelicula_pendientes(self):
+        recommendations.asegurarModelo()
+        self.modificar()
+        incremental = recommendations.modelo
+        self.assertTrue(incremental.itemsim_pendientes)
+        esperado = recommendations.calculateSimilarItems(incremental.prefs, n=20)
+        vecinos = recommendations.vecinosItems(incremental)
+        for item in incremental.itemsim_pendientes:
+            self.assertEqual(vecinos[item], esperado[item])
+        for u in incremental.prefs:
+            self.assertEqual(recommendations.calcularRecomendaciones(u, n=5, m=incremental),
+                             recommendations.getRecommendedItems(incremental.prefs, esperado, u, n=5))
+
+    def test_escritura_no_aplicada(self):
+        recommendations.asegurarModelo()
+        # El borrado no llega al modelo, como si lo hiciera otro proceso
+        Puntuacion.objects.filter(idUsuario=4).first().delete()
+        huellas = set()
+        for puntuacion in Puntuacion.objects.filter(idUsuario=5)[:3]:
+            with self.captureOnCommitCallbacks(execute=True):
+                puntuacion.puntuacion = 10 if puntuacion.puntuacion != 10 else 20
+                puntuacion.save()
+            self.assertNotEqual(recommendations.modelo.huella, snapshot.huella_bd())
+            huellas.add(recommendations.modelo.huella)
+        # Cada versión publicada tiene su propia huella (ver claveModelo)
+        self.assertEqual(len(huellas), 3)
+
+
+class FiltroFechaTest(RecomendadorTestCase):
+    """
+    Con fecha_limite solo se recomiendan películas anteriores, en el mismo
+    orden que sin filtro
+    """
+
+    def test_anteriores(self):
+        m = recommendations.asegurarModelo()
+        fechas = dict(Pelicula.objects.values_list('idPelicula', 'fecha'))
+        for fecha in (date(1960, 1, 1), date(1985, 6, 1), date(2000, 1, 1)):
+            for u in m.prefs:
+                todas = recommendations.calcularRecomendaciones(u, n=None, m=m)
+                esperado = [(rec, p) for (rec, p) in todas if fechas[p] < fecha][:5]
+                self.assertEqual(recommendations.calcularRecomendaciones(u, fecha, n=5, m=m), esperado)
+
+    def test_sin_peliculas_anteriores(self):
+        m = recommendations.asegurarModelo()
+        for u in m.prefs:
+            self.assertEqual(recommendations.calcularRecomendaciones(u, date(1900, 1, 1), n=5, m=m), [])
+
+
+class ActoresTest(RecomendadorTestCase):
+    """
+    Las películas de un actor se buscan en el índice de actores por nombre
+    exacto, no por subcadena
+    """
+
+    def setUp(self):
+        super().setUp()
+        populateDB.indexarActores(Pelicula.objects.values_list('idPelicula', 'actoresPrincipales'))
+
+    def test_coincidencia_exacta(self):
+        esperadas = {p.pk for p in Pelicula.objects.all() if 'Actor 1' in p.reparto()}
+        self.assertEqual({p.pk for p in recommendations.obtener_peliculas_por_actor('Actor 1')}, esperadas)
+        # 'Actor 10', 'Actor 11'... contienen 'Actor 1' pero son otros actores
+        self.assertTrue(Pelicula.objects.filter(actoresPrincipales__icontains='Actor 1').exclude(pk__in=esperadas))
+        self.assertEqual({p.pk for p in recommendations.obtener_peliculas_por_actor('  Actor   1 ')}, esperadas)
+
+    def test_actores_unicos(self):
+        self.assertEqual(recommendations.obtener_actores_unicos(),
+                         sorted({a for p in Pelicula.objects.all() for a in p.reparto()}))
+
+    def test_vista(self):
+        response = self.client.post(reverse('peliculas_por_actor'), {'actor': 'Actor 3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({p.pk for p in response.context['peliculas']},
+                         {p.pk for p in Pelicula.objects.all() if 'Actor 3' in p.reparto()})
+
+
+def escribirDatos(directorio, peliculas, puntuaciones):
+    """
+    Escribe movies1.txt y ratings.txt en directorio a partir de listas de
+    tuplas (idPelicula, titulo, fecha, director, actores) y
+    (idUsuario, idPelicula, puntuacion)
+    """
+    os.makedirs(directorio, exist_ok=True)
+    for nombre, filas in (('movies1.txt', peliculas), ('ratings.txt', puntuaciones)):
+        with open(os.path.join(directorio, nombre), 'w', encoding='utf-8') as f:
+            f.writelines('\t'.join(str(v) for v in fila) + '\n' for fila in filas)
+
+
+class ImportacionTest(RecomendadorTestCase):
+    """
+    populate deja la BD igual que los ficheros (truncate) o les añade lo
+    nuevo y actualiza lo existente (append)
+    """
+
+    PELICULAS = [
+        (1, 'Uno', '1990-01-01', 'Director A', 'Actor 1, Actor 2'),
+        (2, 'Dos', '1991-02-01', 'Director B', 'Actor 2'),
+        (3, 'Tres', '1992-03-01', 'Director A', 'Actor 3,  Actor 1'),
+    ]
+    PUNTUACIONES = [(1, 1, 50), (1, 2, 30), (2, 1, 40), (2, 3, 20), (3, 99, 10)]
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        escribirDatos(self.directorio, self.PELICULAS, self.PUNTUACIONES)
+
+    def puntuaciones(self):
+        return set(Puntuacion.objects.values_list('idUsuario', 'pelicula_id', 'puntuacion'))
+
+    def test_truncate(self):
+        antes = snapshot.huella_bd()
+        stats = populateDB.populate(directorio=self.directorio, batch_size=2)
+        self.assertEqual((stats['peliculas'], stats['puntuaciones']), (3, 4))
+        self.assertEqual(stats['huella'], snapshot.huella_bd())
+        self.assertNotEqual(stats['huella'], antes)
+        self.assertEqual(set(Pelicula.objects.values_list('pk', flat=True)), {1, 2, 3})
+        # La puntuación de la película 99, que no existe, se descarta
+        self.assertEqual(self.puntuaciones(), set(self.PUNTUACIONES[:4]))
+        self.assertEqual(set(ActividadUsuario.objects.values_list('idUsuario', 'numPuntuaciones')), {(1, 2), (2, 2)})
+        self.assertEqual({p.pk for p in recommendations.obtener_peliculas_por_actor('Actor 1')}, {1, 3})
+
+    def test_append(self):
+        populateDB.populate(directorio=self.directorio)
+        escribirDatos(self.directorio, [(2, 'Dos (editada)', '1991-02-01', 'Director B', 'Actor 4'),
+                                        (4, 'Cuatro', '1993-04-01', 'Director C', 'Actor 1')],
+                      [(1, 2, 50), (3, 4, 20)])
+        stats = populateDB.populate(modo='append', directorio=self.directorio)
+        self.assertEqual((stats['peliculas'], stats['puntuaciones']), (2, 2))
+        self.assertEqual(Pelicula.objects.get(pk=2).titulo, 'Dos (editada)')
+        self.assertEqual(set(Pelicula.objects.values_list('pk', flat=True)), {1, 2, 3, 4})
+        self.assertEqual(self.puntuaciones(), {(1, 1, 50), (1, 2, 50), (2, 1, 40), (2, 3, 20), (3, 4, 20)})
+        self.assertEqual(set(ActividadUsuario.objects.values_list('idUsuario', 'numPuntuaciones')),
+                         {(1, 2), (2, 2), (3, 1)})
+        self.assertEqual({p.pk for p in recommendations.obtener_peliculas_por_actor('Actor 1')}, {1, 3, 4})
+        self.assertFalse(recommendations.obtener_peliculas_por_actor('Actor 2').filter(pk=2).exists())
+
+    def test_modo_invalido(self):
+        with self.assertRaises(ValueError):
+            populateDB.populate(modo='replace', directorio=self.directorio)
+
+
+class ColumnarTest(RecomendadorTestCase):
+    """
+    La caché columnar se reutiliza mientras el contenido del fichero no
+    cambie, aunque cambie su fecha, y se vuelve a convertir si cambia
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        self.fichero = os.path.join(self.directorio, 'ratings.txt')
+        convertir = columnar._convertir_puntuaciones
+        self.conversiones = mock.patch.object(columnar, '_convertir_puntuaciones', side_effect=convertir).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def escribir(self, puntuaciones, mtime):
+        escribirDatos(self.directorio, [], puntuaciones)
+        os.utime(self.fichero, ns=(mtime, mtime))
+
+    def leer(self):
+        columnas = columnar.puntuaciones(self.fichero)
+        return list(zip(*(columnas[c].tolist() for c in ('usuarios', 'peliculas', 'puntuaciones'))))
+
+    def test_invalidacion(self):
+        self.escribir([(1, 1, 50), (2, 3, 20)], 10 ** 18)
+        self.assertEqual(self.leer(), [(1, 1, 50), (2, 3, 20)])
+        self.assertEqual(self.leer(), [(1, 1, 50), (2, 3, 20)])
+        self.assertEqual(self.conversiones.call_count, 1)
+
+        # Mismo contenido con otra fecha: se reutiliza y se anota la fecha
+        self.escribir([(1, 1, 50), (2, 3, 20)], 2 * 10 ** 18)
+        self.assertEqual(self.leer(), [(1, 1, 50), (2, 3, 20)])
+        self.assertEqual(self.conversiones.call_count, 1)
+        with mock.patch.object(columnar, '_hash') as resumen:
+            self.leer()
+        resumen.assert_not_called()
+
+        # Otro contenido del mismo tamaño y otro tamaño: se vuelve a convertir
+        self.escribir([(1, 1, 40), (2, 3, 20)], 3 * 10 ** 18)
+        self.assertEqual(self.leer(), [(1, 1, 40), (2, 3, 20)])
+        self.escribir([(1, 1, 40), (2, 3, 20), (3, 2, 10)], 3 * 10 ** 18)
+        self.assertEqual(self.leer(), [(1, 1, 40), (2, 3, 20), (3, 2, 10)])
+        self.assertEqual(self.conversiones.call_count, 3)
+
+        columnar.puntuaciones(self.fichero, forzar=True)
+        self.assertEqual(self.conversiones.call_count, 4)
+
+
+class ActividadTest(RecomendadorTestCase):
+    """
+    Los recuentos de ActividadUsuario siguen a las altas, ediciones y
+    borrados de puntuaciones
+    """
+
+    def setUp(self):
+        super().setUp()
+        populateDB.contarActividad()
+
+    def assertRecuentos(self):
+        esperados = Puntuacion.objects.values_list('idUsuario').annotate(n=Count('id')).order_by()
+        self.assertEqual(set(ActividadUsuario.objects.values_list('idUsuario', 'numPuntuaciones')), set(esperados))
+
+    def test_senales(self):
+        self.assertRecuentos()
+        nuevo = Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=1, puntuacion=30)
+        Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=2, puntuacion=30)
+        self.assertRecuentos()
+        # Pasa a otro usuario
+        nuevo.idUsuario = USUARIOS + 2
+        nuevo.save()
+        self.assertRecuentos()
+        nuevo.delete()
+        self.assertRecuentos()
+        self.assertFalse(ActividadUsuario.objects.filter(pk=USUARIOS + 2).exists())
+        Pelicula.objects.get(pk=1).delete()
+        self.assertRecuentos()
+
+    def test_mas_activos(self):
+        esperados = list(Puntuacion.objects.values_list('idUsuario').annotate(n=Count('id'))
+                         .order_by('-n', 'idUsuario')[:5])
+        self.assertEqual(recommendations.getUsuariosMasActivos(5), esperados)
+        # Cargado aquí: el pool de main/ejecutor.py usa otra conexión
+        recommendations.asegurarModelo()
+        response = self.client.get(reverse('usuarios_mas_activos'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(u['id_usuario'], u['num_peliculas']) for u in response.context['usuarios']], esperados)
+        self.assertEqual(response.context['usuarios'][0]['similares'],
+                         recommendations.getUsuariosSimilares(esperados[0][0], 3))
+
+
+class AnnTest(RecomendadorTestCase):
+    """
+    Los candidatos del índice LSH son los usuarios que comparten cubo, y con
+    pocos usuarios se usa siempre la búsqueda exacta
+    """
+
+    def test_candidatos(self):
+        matriz = recommendations.asegurarModelo().matriz
+        indice = IndiceLSH.from_prefs(matriz, tablas=4, bits=3)
+        # Código de cada fila en cada tabla
+        codigos = np.empty_like(indice.codigos)
+        np.put_along_axis(codigos, indice.filas, indice.codigos, axis=1)
+        for u in matriz:
+            fila = matriz._fila(u)
+            esperados = {i for t in range(indice.tablas) for i in np.flatnonzero(codigos[t] == codigos[t, fila])}
+            self.assertEqual(set(indice.candidatos(matriz, u).tolist()), esperados)
+            self.assertIn(fila, esperados)
+            self.assertLessEqual(esperados, set(indice.candidatos(matriz, u, sondeos=2).tolist()))
+
+    def test_exhaustivo(self):
+        # Con 1 bit y 1 sondeo todos los usuarios son candidatos: mismo resultado que la búsqueda exacta
+        matriz = recommendations.asegurarModelo().matriz
+        indice = IndiceLSH.from_prefs(matriz, tablas=1, bits=1)
+        for u in matriz:
+            filas = indice.candidatos(matriz, u, sondeos=1)
+            self.assertEqual(len(filas), len(matriz))
+            self.assertEqual(matriz.topMatches(u, n=5, filas=filas), matriz.topMatches(u, n=5))
+
+    def test_umbral(self):
+        m = recommendations.asegurarModelo()
+        with override_settings(RECSYS_ANN=True):
+            self.assertFalse(recommendations.usar_ann(m))
+            self.assertIsNone(recommendations.candidatosAnn(1, m))
+        with override_settings(RECSYS_ANN=True, RECSYS_ANN_MIN_USUARIOS=USUARIOS):
+            self.assertTrue(recommendations.usar_ann(m))
+            filas = recommendations.candidatosAnn(1, m)
+            self.assertIn(m.matriz._fila(1), filas.tolist())
+            self.assertEqual(recommendations.getUsuariosSimilares(1, 3),
+                             m.matriz.topMatches(1, n=3, filas=filas))
+
+    def test_informe(self):
+        recommendations.asegurarModelo()
+        salida = io.StringIO()
+        call_command('informe_ann', muestra=USUARIOS, stdout=salida)
+        recall = float(re.search(r'recall@10: ([\d.]+)', salida.getvalue()).group(1))
+        self.assertGreaterEqual(recall, 0.8)
+
+@override_settings(RECSYS_METHOD='mf', RECSYS_MF_FACTORES=5, RECSYS_MF_ITERACIONES=5, RECSYS_MF_HILOS=1)
+class FactoresTest(RecomendadorTestCase):
+    """
+    Con RECSYS_METHOD = 'mf' se recomienda por la puntuación prevista con
+    los factores de ALS, también con fecha_limite
+    """
+
+    def previstas(self, m, u):
+        # Todas las películas no vistas por u, ordenadas por puntuación prevista
+        factores = m.factores
+        vector = factores.usuarios[m.matriz._fila(u)].astype(np.float64)
+        scores = factores.media + factores.peliculas.astype(np.float64) @ vector
+        return sorted(((s, p) for s, p in zip(scores.tolist(), m.matriz.peliculas.tolist()) if p not in m.prefs[u]),
+                      reverse=True)
+
+    def test_recomendaciones(self):
+        m = recommendations.asegurarModelo()
+        self.assertIsNotNone(m.factores)
+        self.assertTrue(m.factores.compatible(m.matriz))
+        for u in m.prefs:
+            self.assertEqual(recommendations.calcularRecomendaciones(u, n=5, m=m), self.previstas(m, u)[:5])
+
+    def test_fecha_limite(self):
+        m = recommendations.asegurarModelo()
+        fechas = dict(Pelicula.objects.values_list('idPelicula', 'fecha'))
+        fecha = date(1985, 6, 1)
+        for u in m.prefs:
+            esperadas = [(s, p) for (s, p) in self.previstas(m, u) if fechas[p] < fecha][:5]
+            self.assertEqual(recommendations.calcularRecomendaciones(u, fecha, n=5, m=m), esperadas)
+        self.assertEqual(recommendations.calcularRecomendaciones(1, date(1900, 1, 1), n=5, m=m), [])
+
+    def test_bloques(self):
+        # Con un presupuesto de memoria mínimo cada fila se resuelve por separado
+        matriz = recommendations.asegurarModelo().matriz
+        completo = FactoresLatentes.entrenar(matriz, factores=5, iteraciones=3, hilos=1)
+        with mock.patch.object(factorization, 'MEMORIA_BLOQUE', 1):
+            por_filas = FactoresLatentes.entrenar(matriz, factores=5, iteraciones=3, hilos=1)
+        np.testing.assert_allclose(por_filas.usuarios, completo.usuarios, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(por_filas.peliculas, completo.peliculas, rtol=1e-4, atol=1e-5)
+
+    def test_usuario_actualizado(self):
+        recommendations.asegurarModelo()
+        recs = recommendations.calcularRecomendaciones(1, n=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Puntuacion.objects.create(idUsuario=1, pelicula_id=recs[0][1], puntuacion=10)
+        m = recommendations.modelo
+        nuevas = recommendations.calcularRecomendaciones(1, n=3, m=m)
+        self.assertNotIn(recs[0][1], [p for (_, p) in nuevas])
+        self.assertEqual(len(nuevas), 3)
+
+
+class TrabajosTest(RecomendadorTestCase):
+    """
+    Estados de los trabajos de reconstrucción en segundo plano
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        escribirDatos(self.directorio, ImportacionTest.PELICULAS, ImportacionTest.PUNTUACIONES)
+        self.addCleanup(setattr, jobs, '_pendiente', None)
+
+    def test_reconstruccion(self):
+        estados = []
+        trabajo = jobs.ejecutar(informar=lambda t: estados.append((t['estado'], t['etapa'])))
+        self.assertEqual(trabajo['etapas'], ['preferencias', 'publicacion'])
+        self.assertEqual(estados, [('ejecutando', None), ('ejecutando', 'preferencias'),
+                                   ('ejecutando', 'publicacion'), ('completado', 'publicacion')])
+        self.assertEqual(trabajo['progreso'], 1.0)
+        self.assertEqual(trabajo['version'], recommendations.modelo.version)
+        self.assertEqual(jobs.estado(), trabajo)
+
+    def test_importacion(self):
+        etapas = []
+        trabajo = jobs.ejecutar(importar=True, opciones={'directorio': self.directorio},
+                                informar=lambda t: etapas.append(t['etapa']))
+        self.assertEqual(trabajo['estado'], 'completado')
+        self.assertEqual(list(dict.fromkeys(etapas)), [None, 'importacion', 'preferencias', 'publicacion'])
+        self.assertEqual(trabajo['importacion']['puntuaciones'], 4)
+        self.assertEqual(recommendations.modelo.huella, snapshot.huella_bd())
+        self.assertEqual(self.prefs(recommendations.modelo), {1: {1: 50, 2: 30}, 2: {1: 40, 3: 20}})
+
+    @override_settings(RECSYS_METHOD='item')
+    def test_etapas_por_metodo(self):
+        self.assertEqual(jobs.ejecutar()['etapas'], ['preferencias', 'similitud', 'publicacion'])
+
+    def test_error(self):
+        with mock.patch.object(recommendations, 'construirModelo', side_effect=RuntimeError('sin datos')), \
+                self.assertLogs('main.jobs', 'ERROR'):
+            trabajo = jobs.ejecutar()
+        self.assertEqual((trabajo['estado'], trabajo['error']), ('error', 'sin datos'))
+        self.assertEqual(jobs.estado()['estado'], 'error')
+
+    def test_encolar(self):
+        # Un pool que no ejecuta nada: los trabajos se quedan en cola
+        with mock.patch.object(jobs, '_pool') as pool:
+            pool.submit.return_value = Future()
+            reconstruccion = jobs.encolar()
+            self.assertEqual(reconstruccion['estado'], 'en_cola')
+            self.assertIs(jobs.encolar(), reconstruccion)
+            importacion = jobs.encolar(importar=True, modo='append')
+            self.assertIsNot(importacion, reconstruccion)
+            self.assertEqual(importacion['etapas'][0], 'importacion')
+            self.assertIs(jobs.encolar(), importacion)
+            self.assertIs(jobs.encolar(importar=True, modo='append'), importacion)
+            self.assertIsNot(jobs.encolar(importar=True), importacion)
+            self.assertEqual(pool.submit.call_count, 3)
+
+    def test_carga_masiva_en_otro_hilo(self):
+        # Mientras un hilo importa, las puntuaciones de los demás siguen
+        # actualizando los recuentos (aquí, otro contexto del mismo hilo)
+        populateDB.contarActividad()
+        with signals.sin_actualizaciones():
+            Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=1, puntuacion=50)
+            contextvars.Context().run(Puntuacion.objects.create, idUsuario=USUARIOS + 2, pelicula_id=1,
+                                      puntuacion=50)
+        self.assertFalse(ActividadUsuario.objects.filter(pk=USUARIOS + 1).exists())
+        self.assertEqual(ActividadUsuario.objects.get(pk=USUARIOS + 2).numPuntuaciones, 1)
+        Puntuacion.objects.create(idUsuario=USUARIOS + 3, pelicula_id=1, puntuacion=50)
+        self.assertEqual(ActividadUsuario.objects.get(pk=USUARIOS + 3).numPuntuaciones, 1)
+
+
+class CacheTest(RecomendadorTestCase):
+    """
+    Aciertos y fallos de la caché de resultados; al cambiar el modelo las
+    claves cambian y no se sirven resultados antiguos
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(RECSYS_CACHE=True))
+        patcher = mock.patch.object(recommendations, 'resultados', CacheResultados())
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def contadores(self, *nombres):
+        stats = self.cache.estadisticas()
+        return tuple(stats[nombre] for nombre in nombres)
+
+    def test_aciertos(self):
+        primera = recommendations.getUsuariosSimilares(1, 3)
+        self.assertEqual(self.contadores('aciertos', 'fallos'), (0, 1))
+        segunda = recommendations.getUsuariosSimilares(1, 3)
+        self.assertEqual(segunda, primera)
+        self.assertEqual(self.contadores('aciertos', 'fallos'), (1, 1))
+        # Se devuelven copias: modificar el resultado no cambia la caché
+        segunda.clear()
+        self.assertEqual(recommendations.getUsuariosSimilares(1, 3), primera)
+        recommendations.recomendar_peliculas_usuario(1, n=3)
+        recommendations.recomendar_peliculas_usuario(1, date(1990, 1, 1), n=3)
+        self.assertEqual(self.contadores('aciertos', 'fallos'), (2, 3))
+
+    def test_cambio_de_modelo(self):
+        recs = recommendations.recomendar_peliculas_usuario(1, n=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Puntuacion.objects.create(idUsuario=1, pelicula_id=recs[0][1], puntuacion=10)
+        nuevas = recommendations.recomendar_peliculas_usuario(1, n=3)
+        self.assertEqual(self.contadores('aciertos', 'fallos'), (0, 2))
+        self.assertNotIn(recs[0][1], [p for (_, p) in nuevas])
+
+        version = recommendations.modelo.version
+        self.assertNotEqual(recommendations.reconstruirModelo(), version)
+        self.assertEqual(recommendations.recomendar_peliculas_usuario(1, n=3), nuevas)
+        self.assertEqual(self.contadores('aciertos', 'fallos'), (0, 3))
+
+    def test_caducidad_y_expulsion(self):
+        with override_settings(RECSYS_CACHE_TTL=0):
+            recommendations.getUsuariosSimilares(1, 3)
+            recommendations.getUsuariosSimilares(1, 3)
+        self.assertEqual(self.contadores('aciertos', 'caducadas', 'fallos'), (0, 1, 2))
+        with override_settings(RECSYS_CACHE_MAX=2):
+            for u in (1, 2, 3):
+                recommendations.getUsuariosSimilares(u, 3)
+        self.assertEqual(self.contadores('expulsadas', 'entradas'), (1, 2))
+
+    @override_settings(RECSYS_CACHE_BACKEND='recsys',
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                               'recsys': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                          'LOCATION': 'recsys-pruebas'}})
+    def test_compartida(self):
+        similares = recommendations.getUsuariosSimilares(1, 3)
+        # Otro proceso, con su propia caché local
+        with mock.patch.object(recommendations, 'resultados', CacheResultados()) as otra:
+            self.assertEqual(recommendations.getUsuariosSimilares(1, 3), similares)
+            self.assertEqual(otra.estadisticas()['aciertos_compartida'], 1)
+
+    @override_settings(RECSYS_CACHE=False)
+    def test_desactivada(self):
+        recommendations.getUsuariosSimilares(1, 3)
+        self.assertEqual(self.contadores('aciertos', 'fallos', 'entradas'), (0, 0, 0))
+
+
+class ApiTest(RecomendadorTestCase):
+    """
+    API JSON / NDJSON de recomendaciones
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Cargado aquí: el pool de main/ejecutor.py usa otra conexión
+        recommendations.asegurarModelo()
+
+    def esperado(self, u, fecha=None, n=2, similares=3):
+        return {
+            'idUsuario': u,
+            'recomendaciones': [{'idPelicula': p, 'recomendacion': rec}
+                                for (rec, p) in recommendations.recomendar_peliculas_usuario(u, fecha, n)],
+            'similares': [{'idUsuario': otro, 'similaridad': sim}
+                          for (sim, otro) in recommendations.getUsuariosSimilares(u, similares)],
+        }
+
+    def lineas(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_json(self):
+        response = self.client.get(reverse('api_recomendaciones'), {'usuarios': '1,2,999', 'n': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['resultados'], [self.esperado(u, n=3) for u in (1, 2, 999)])
+
+    def test_cuerpo_json(self):
+        response = self.client.post(reverse('api_recomendaciones'),
+                                    {'usuarios': [3, 4], 'fecha': '1990-01-01', 'similares': 0},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        esperados = [dict(self.esperado(u, date(1990, 1, 1)), similares=[]) for u in (3, 4)]
+        self.assertEqual(response.json()['resultados'], esperados)
+
+    def test_ndjson(self):
+        response = self.client.get(reverse('api_recomendaciones'), {'usuarios': '1,2', 'formato': 'ndjson'})
+        self.assertEqual(self.lineas(response), [self.esperado(u) for u in (1, 2)])
+        with override_settings(RECSYS_API_MAX_JSON=2, RECSYS_API_LOTE=2):
+            response = self.client.get(reverse('api_recomendaciones'), {'usuarios': '1,2,3'})
+            self.assertEqual(self.lineas(response), [self.esperado(u) for u in (1, 2, 3)])
+
+    def test_todos(self):
+        with override_settings(RECSYS_API_LOTE=7):
+            response = self.client.get(reverse('api_recomendaciones_todos'), {'n': 1, 'similares': 1})
+            lineas = self.lineas(response)
+        self.assertEqual(lineas, [self.esperado(u, n=1, similares=1) for u in recommendations.modelo.prefs])
+
+    async def test_asgi(self):
+        response = await self.async_client.get(reverse('api_recomendaciones_todos'), {'n': 1})
+        lineas = [json.loads(linea) async for trozo in response.streaming_content
+                  for linea in trozo.decode().splitlines()]
+        self.assertEqual([linea['idUsuario'] for linea in lineas], list(recommendations.modelo.prefs))
+        response = await self.async_client.get(reverse('api_recomendaciones'), {'usuarios': '5', 'n': 3})
+        self.assertEqual(response.json()['resultados'][0]['idUsuario'], 5)
+        self.assertEqual(len(response.json()['resultados'][0]['recomendaciones']), 3)
+
+    def test_errores(self):
+        url = reverse('api_recomendaciones')
+        for parametros in ({'usuarios': '1,a'}, {}, {'usuarios': '1', 'n': 0}, {'usuarios': '1', 'fecha': 'ayer'},
+                           {'usuarios': '1', 'formato': 'xml'}):
+            response = self.client.get(url, parametros)
+            self.assertEqual(response.status_code, 400, parametros)
+            self.assertIn('error', response.json())
+        for cuerpo in ('{no es json', '[1, 2]'):
+            response = self.client.post(url, cuerpo, content_type='application/json')
+            self.assertEqual(response.status_code, 400, cuerpo)
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertEqual(self.client.get(reverse('api_recomendaciones_todos'), {'n': 'x'}).status_code, 400)
+
+
+class EjecutorTest(RecomendadorTestCase):
+    """
+    Rechazo (503) y caducidad (504) de las consultas de main/ejecutor.py
+    """
+
+    def setUp(self):
+        super().setUp()
+        recommendations.asegurarModelo()
+
+    def lento(self, *args):
+        time.sleep(0.5)
+        return iter([])
+
+    def esperarLibre(self):
+        # Las tareas caducadas liberan su plaza al terminar
+        for _ in range(50):
+            if ejecutor.estadisticas()['pendientes'] == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(ejecutor.estadisticas()['pendientes'], 0)
+
+    def comprobar(self, response, estado, json_=True):
+        self.assertEqual(response.status_code, estado)
+        self.assertEqual(response['Retry-After'], '1')
+        if json_:
+            self.assertIn('error', response.json())
+        else:
+            self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_saturado(self):
+        with override_settings(RECSYS_ASYNC_HILOS=1, RECSYS_ASYNC_COLA=0), \
+                mock.patch.object(ejecutor, '_pendientes', 1):
+            self.comprobar(self.client.get(reverse('api_recomendaciones'), {'usuarios': '1'}), 503)
+            self.comprobar(self.client.get(reverse('api_recomendaciones_todos')), 503)
+            response = self.client.post(reverse('recomendar_peliculas'), {'idUsuario': 1, 'fecha': '01/01/2000'})
+            self.comprobar(response, 503, json_=False)
+
+    def test_caducada(self):
+        with override_settings(RECSYS_ASYNC_TIMEOUT=0.05), \
+                mock.patch.object(views, '_resultados_api', self.lento):
+            self.comprobar(self.client.get(reverse('api_recomendaciones'), {'usuarios': '1'}), 504)
+        with override_settings(RECSYS_ASYNC_TIMEOUT=0.05), \
+                mock.patch.object(recommendations, 'recomendar_peliculas_usuario', self.lento):
+            response = self.client.post(reverse('recomendar_peliculas'), {'idUsuario': 1, 'fecha': '01/01/2000'})
+            self.comprobar(response, 504, json_=False)
+        self.esperarLibre()
+
+    async def test_ndjson(self):
+        # En streaming el estado ya se ha enviado: el error va en la última línea
+        async def lineas(parametros):
+            response = await self.async_client.get(reverse('api_recomendaciones'), parametros)
+            self.assertEqual(response.status_code, 200)
+            return [json.loads(linea) async for trozo in response.streaming_content
+                    for linea in trozo.decode().splitlines()]
+
+        with override_settings(RECSYS_ASYNC_HILOS=1, RECSYS_ASYNC_COLA=0), \
+                mock.patch.object(ejecutor, '_pendientes', 1):
+            self.assertEqual(await lineas({'usuarios': '1,2', 'formato': 'ndjson'}), [{'error': 'servidor saturado'}])
+        with override_settings(RECSYS_ASYNC_TIMEOUT=0.05), \
+                mock.patch.object(views, '_resultados_api', self.lento):
+            self.assertEqual(await lineas({'usuarios': '1,2', 'formato': 'ndjson'}),
+                             [{'error': 'la consulta ha superado el tiempo máximo'}])
+        self.esperarLibre()
+
+
+class PaginacionAdminTest(RecomendadorTestCase):
+    """
+    Las listas de puntuaciones y de películas del admin recorren la tabla
+    por clave sin repetir ni saltarse filas
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def recorrer(self, consulta='', admin=PuntuacionAdmin, url='admin:main_puntuacion_changelist'):
+        url = reverse(url)
+        siguiente = '?' + consulta
+        claves = []
+        with mock.patch.object(admin, 'list_per_page', 7):
+            while siguiente:
+                response = self.client.get(url + siguiente)
+                self.assertEqual(response.status_code, 200)
+                cl = response.context['cl']
+                claves.extend(p.pk for p in cl.result_list)
+                siguiente = cl.url_siguiente
+        return claves
+
+    def test_todas_las_paginas(self):
+        self.assertEqual(self.recorrer(), list(Puntuacion.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_con_filtro(self):
+        self.assertEqual(self.recorrer('usuario=5'),
+                         list(Puntuacion.objects.filter(idUsuario=5).order_by('pk').values_list('pk', flat=True)))
+
+    def test_peliculas(self):
+        recorrer = lambda consulta='': self.recorrer(consulta, PeliculaAdmin, 'admin:main_pelicula_changelist')
+        self.assertEqual(recorrer(), list(Pelicula.objects.order_by('pk').values_list('pk', flat=True)))
+        palabra = Pelicula.objects.order_by('pk').first().titulo.split()[-1]
+        self.assertEqual(recorrer('q=' + palabra),
+                         list(Pelicula.objects.filter(titulo__icontains=palabra).order_by('pk')
+                              .values_list('pk', flat=True)))
+        # El autocompletado sigue paginando por número de página
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'main', 'model_name': 'puntuacion', 'field_name': 'pelicula', 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), min(20, Pelicula.objects.count() - 20))
+
+
+
+class PrecalculadasTest(RecomendadorTestCase):
+    """
+    Las recomendaciones leídas de RecomendacionPrecalculada coinciden con
+    las calculadas en el momento
+    """
+
+    def test_igual_que_calcular(self):
+        m = recommendations.asegurarModelo()
+        self.assertFalse(recommendations.hayPrecalculadas(m))
+        precompute.precalcular(n=5, procesos=1)
+        self.assertTrue(recommendations.hayPrecalculadas(m))
+
+        leidas = 0
+        for u in m.prefs:
+            for fecha in (None, date(1990, 1, 1)):
+                for n in (1, 3, 5):
+                    recs = recommendations.recomendacionesPrecalculadas(u, fecha, n, m)
+                    if recs is not None:
+                        leidas += 1
+                        self.assertEqual(recs, recommendations.calcularRecomendaciones(u, fecha, n, m))
+        self.assertGreater(leidas, 0)
+
+    def test_por_lotes(self):
+        m = recommendations.asegurarModelo()
+        precompute.precalcular(n=5, procesos=1)
+        usuarios = list(m.prefs)
+        with self.assertNumQueries(1):
+            varios = recommendations.recomendar_peliculas_varios(usuarios, n=3)
+        self.assertEqual(varios, {u: recommendations._recomendarPeliculas(m, u, None, 3, []) for u in usuarios})
+
+    def test_reanudar(self):
+        # Un usuario sin recomendaciones: no tiene filas, pero cuenta como hecho
+        with self.captureOnCommitCallbacks(execute=True):
+            Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=1, puntuacion=50)
+        recommendations.reconstruirModelo()
+        self.assertEqual(recommendations.calcularRecomendaciones(USUARIOS + 1, n=5), [])
+        primera = precompute.precalcular(n=5, procesos=1, lote=7)
+        self.assertEqual((primera['usuarios'], primera['saltados']), (USUARIOS + 1, 0))
+        self.assertFalse(RecomendacionPrecalculada.objects.filter(idUsuario=USUARIOS + 1).exists())
+
+        segunda = precompute.precalcular(n=5, procesos=1)
+        self.assertEqual((segunda['usuarios'], segunda['saltados']), (0, USUARIOS + 1))
+        # Interrumpido a medias: solo se calculan los que faltan
+        PrecalculoUsuario.objects.filter(idUsuario__in=[1, USUARIOS + 1]).delete()
+        tercera = precompute.precalcular(n=5, procesos=1)
+        self.assertEqual((tercera['usuarios'], tercera['saltados']), (2, USUARIOS - 1))
+        self.assertEqual(precompute.precalcular(n=5, procesos=1, reiniciar=True)['usuarios'], USUARIOS + 1)
+
+
+class PopularesTest(RecomendadorTestCase):
+    """
+    Las listas cortas se completan con las películas populares
+    """
+
+    def test_usuario_sin_vecinos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Puntuacion.objects.create(idUsuario=USUARIOS + 1, pelicula_id=1, puntuacion=50)
+        m = recommendations.asegurarModelo()
+        self.assertEqual(recommendations.calcularRecomendaciones(USUARIOS + 1, n=4, m=m), [])
+        recs = recommendations.recomendar_peliculas_usuario(USUARIOS + 1, n=4)
+        self.assertEqual(recs, recommendations.rankingPopular(m).mejores(None, 4, {1}))
+        self.assertNotIn(1, [p for (_, p) in recs])
+
+    def test_usuario_desconocido(self):
+        m = recommendations.asegurarModelo()
+        fecha = date(1990, 1, 1)
+        recs = recommendations.recomendar_peliculas_usuario(USUARIOS + 100, fecha, n=3)
+        self.assertEqual(recs, recommendations.rankingPopular(m).mejores(fecha, 3))
+        fechas = dict(Pelicula.objects.values_list('idPelicula', 'fecha'))
+        self.assertTrue(all(fechas[p] < fecha for (_, p) in recs))
+
+    def test_completa_sin_repetir(self):
+        m = recommendations.asegurarModelo()
+        for u in m.prefs:
+            vivas = recommendations.calcularRecomendaciones(u, n=8, m=m)
+            recs = recommendations.recomendar_peliculas_usuario(u, n=8)
+            self.assertEqual(recs[:len(vivas)], vivas)
+            self.assertEqual(len({p for (_, p) in recs}), len(recs))
+            self.assertFalse({p for (_, p) in recs} & set(m.prefs[u]))
+
+    @override_settings(RECSYS_POPULARES=False)
+    def test_desactivado(self):
+        recommendations.asegurarModelo()
+        self.assertEqual(recommendations.recomendar_peliculas_usuario(USUARIOS + 100, n=3), [])
@@ -1,11 +1,46 @@
 #encoding:utf-8
 
+import asyncio
+import contextvars
+import functools
+import json
+
 from django.shortcuts import render
-from django.http import HttpResponseRedirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
 from main.models import Pelicula, Puntuacion
-from main import populateDB, recommendations
-from main.forms import FormularioConfirmacion, FormularioPeliculasPorActor, FormularioRecomendarPeliculas
+from main import ejecutor, jobs, metrics, recommendations, snapshot
+from main.populateDB import lotes
+from main.forms import (FormularioApiRecomendaciones, FormularioConfirmacion, FormularioPeliculasPorActor,
+                        FormularioRecomendarPeliculas)
+
+def acotada(json=False):
+    """
+    Para vistas asíncronas que calculan en main/ejecutor.py: responde 503 si
+    la cola está llena y 504 si el cálculo supera RECSYS_ASYNC_TIMEOUT
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        async def envoltorio(request, *args, **kwargs):
+            try:
+                return await vista(request, *args, **kwargs)
+            except ejecutor.Saturado:
+                return _no_disponible(json, 503, 'Servidor saturado, inténtelo de nuevo en unos segundos')
+            except asyncio.TimeoutError:
+                return _no_disponible(json, 504, 'La consulta ha superado el tiempo máximo')
+        return envoltorio
+    return decorador
+
+def _no_disponible(json, estado, mensaje):
+    if json:
+        respuesta = JsonResponse({'error': mensaje}, status=estado)
+    else:
+        respuesta = HttpResponse(mensaje, status=estado, content_type='text/plain; charset=utf-8')
+    respuesta['Retry-After'] = '1'
+    return respuesta
 
 def index(request):
     """
@@ -17,54 +52,102 @@ def cargar_bd(request):
     """
     Vista para cargar la base de datos desde el dataset
     Muestra un formulario de confirmación antes de proceder
+    La importación y la reconstrucción del modelo se lanzan en segundo plano
+    (ver main/jobs.py); el progreso se consulta en estado_recsys
     """
     formulario = FormularioConfirmacion()
-    stats = None
+    trabajo = None
     
     if request.method == 'POST':
         formulario = FormularioConfirmacion(request.POST)
         
         if formulario.is_valid():
-            populateDB.populate()
-            stats = populateDB.get_database_stats()
+            trabajo = jobs.encolar(importar=True)
     
     return render(request, 'cargar_bd.html', {
         'formulario': formulario,
-        'stats': stats,
+        'trabajo': trabajo,
         'STATIC_URL': settings.STATIC_URL
     })
 
 def cargar_recsys(request):
     """
     Vista para cargar el sistema de recomendación
+    La reconstrucción se lanza en segundo plano; mientras tanto se sigue
+    sirviendo el modelo anterior
     """
     mensaje = None
     
     if request.method == 'POST':
-        recommendations.loadPrefs()
-        mensaje = "Sistema de recomendación cargado correctamente"
+        trabajo = jobs.encolar()
+        mensaje = "Reconstrucción del sistema de recomendación en marcha (trabajo %s)" % trabajo['id']
     
     return render(request, 'cargar_recsys.html', {
         'mensaje': mensaje,
         'STATIC_URL': settings.STATIC_URL
     })
 
-def peliculas_por_actor(request):
+def estado_recsys(request):
+    """
+    Estado del último trabajo de reconstrucción, del modelo servido y de la
+    caché de resultados del proceso, en JSON
+    Responde 503 mientras no haya ningún modelo publicado
+    """
+    publicada = snapshot.version_actual()
+    servido = recommendations.modelo
+    modelo = {
+        'version': servido.version,
+        'publicada': publicada,
+        'usuarios': len(servido.matriz.usuarios) if servido.matriz is not None else None,
+        'actualizaciones_pendientes': len(servido.matriz.modificados) if servido.matriz is not None else 0,
+    }
+    if servido.factores is not None:
+        modelo['rmse_factores'] = servido.factores.rmse()
+    return JsonResponse({'ok': publicada is not None, 'modelo': modelo, 'trabajo': jobs.estado(),
+                         'cache': recommendations.resultados.estadisticas()},
+                        status=200 if publicada is not None else 503)
+
+@require_GET
+def metricas(request):
+    """
+    Métricas del proceso en el formato de texto de Prometheus: duración y
+    consultas SQL por petición y por etapa, cargas del modelo (ver
+    main/metrics.py), estado del modelo servido, de la caché de resultados y
+    del pool de las vistas asíncronas
+    """
+    extra = [('recsys_cache_' + nombre, valor, {})
+             for nombre, valor in recommendations.resultados.estadisticas().items()]
+    extra += [('recsys_ejecutor_' + nombre, valor, {}) for nombre, valor in ejecutor.estadisticas().items()]
+    servido = recommendations.modelo
+    if servido.matriz is not None:
+        extra += [
+            ('recsys_modelo_info', 1, {'version': servido.version,
+                                       'metodo': getattr(settings, 'RECSYS_METHOD', 'user')}),
+            ('recsys_modelo_usuarios', len(servido.matriz.usuarios), {}),
+            ('recsys_modelo_peliculas', len(servido.matriz.peliculas), {}),
+            ('recsys_modelo_actualizaciones_pendientes', len(servido.matriz.modificados), {}),
+        ]
+    return HttpResponse(metrics.exportar(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+async def peliculas_por_actor(request):
     """
     Vista para mostrar películas por actor
+    Solo lee la BD, con el ORM asíncrono
     """
-    formulario = FormularioPeliculasPorActor()
+    # Un único formulario por petición, con la lista de actores leída una vez
+    formulario = FormularioPeliculasPorActor(request.POST if request.method == 'POST' else None,
+                                             actores=await recommendations.aobtener_actores_unicos())
     peliculas = None
     actor_seleccionado = None
     num_peliculas = 0
     
     if request.method == 'POST':
-        formulario = FormularioPeliculasPorActor(request.POST)
-        
         if formulario.is_valid():
             actor_seleccionado = formulario.cleaned_data['actor']
-            peliculas = recommendations.obtener_peliculas_por_actor(actor_seleccionado)
-            num_peliculas = peliculas.count()
+            with metrics.etapa('metadatos'):
+                peliculas = [pelicula async for pelicula in
+                             recommendations.obtener_peliculas_por_actor(actor_seleccionado)]
+            num_peliculas = len(peliculas)
     
     return render(request, 'peliculas_por_actor.html', {
         'formulario': formulario,
@@ -74,20 +157,23 @@ def peliculas_por_actor(request):
         'STATIC_URL': settings.STATIC_URL
     })
 
-def usuarios_mas_activos(request):
+@acotada()
+async def usuarios_mas_activos(request):
     """
     Vista para mostrar los 5 usuarios más activos
     y los 3 usuarios más similares a cada uno
+    Los similares se calculan en el pool de main/ejecutor.py
     """
-    usuarios_activos = recommendations.getUsuariosMasActivos(n=5)
+    usuarios_activos = await recommendations.agetUsuariosMasActivos(n=5)
+    similares = await ejecutor.ejecutar(recommendations.getUsuariosSimilaresVarios,
+                                        [id_usuario for (id_usuario, _) in usuarios_activos], n=3)
     
     usuarios_con_similares = []
     for (id_usuario, num_peliculas) in usuarios_activos:
-        similares = recommendations.getUsuariosSimilares(id_usuario, n=3)
         usuarios_con_similares.append({
             'id_usuario': id_usuario,
             'num_peliculas': num_peliculas,
-            'similares': similares
+            'similares': similares[id_usuario]
         })
     
     return render(request, 'usuarios_mas_activos.html', {
@@ -95,10 +181,13 @@ def usuarios_mas_activos(request):
         'STATIC_URL': settings.STATIC_URL
     })
 
-def recomendar_peliculas(request):
+@acotada()
+async def recomendar_peliculas(request):
     """
     Vista para recomendar películas a un usuario
     Recomienda 2 películas anteriores a una fecha dada
+    El filtrado colaborativo se calcula en el pool de main/ejecutor.py y los
+    datos de las películas se leen con el ORM asíncrono
     """
     formulario = FormularioRecomendarPeliculas()
     recomendaciones = None
@@ -112,21 +201,22 @@ def recomendar_peliculas(request):
             usuario = formulario.cleaned_data['idUsuario']
             fecha = formulario.cleaned_data['fecha']
             
-            recs = recommendations.recomendar_peliculas_usuario(usuario, fecha, n=2)
+            recs = await ejecutor.ejecutar(recommendations.recomendar_peliculas_usuario, usuario, fecha, n=2)
+            with metrics.etapa('metadatos'):
+                peliculas = await Pelicula.objects.ain_bulk([id_pelicula for (_, id_pelicula) in recs])
             
             recomendaciones = []
             for (rec, id_pelicula) in recs:
-                try:
-                    pelicula = Pelicula.objects.get(pk=id_pelicula)
-                    recomendaciones.append({
-                        'titulo': pelicula.titulo,
-                        'fecha': pelicula.fecha,
-                        'director': pelicula.director,
-                        'actores': pelicula.actoresPrincipales,
-                        'recomendacion': round(rec, 2)
-                    })
-                except Pelicula.DoesNotExist:
+                pelicula = peliculas.get(id_pelicula)
+                if pelicula is None:
                     continue
+                recomendaciones.append({
+                    'titulo': pelicula.titulo,
+                    'fecha': pelicula.fecha,
+                    'director': pelicula.director,
+                    'actores': pelicula.actoresPrincipales,
+                    'recomendacion': round(rec, 2)
+                })
     
     return render(request, 'recomendar_peliculas.html', {
         'formulario': formulario,
@@ -135,3 +225,107 @@ def recomendar_peliculas(request):
         'fecha': fecha,
         'STATIC_URL': settings.STATIC_URL
     })
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+@acotada(json=True)
+async def api_recomendaciones(request):
+    """
+    Recomendaciones y usuarios similares de una lista de usuarios, en JSON
+    Parámetros (querystring, formulario o cuerpo JSON): usuarios, fecha
+    (AAAA-MM-DD), n (películas por usuario, 2 por defecto), similares
+    (usuarios similares, 3 por defecto) y formato ('json' o 'ndjson')
+    Las listas de más de RECSYS_API_MAX_JSON usuarios se devuelven siempre
+    como NDJSON en streaming (una línea por usuario)
+    Cada respuesta JSON o lote de NDJSON se calcula en el pool de
+    main/ejecutor.py
+    """
+    datos = request.GET if request.method == 'GET' else request.POST
+    if request.content_type == 'application/json':
+        try:
+            datos = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'cuerpo JSON no válido'}, status=400)
+        if not isinstance(datos, dict):
+            return JsonResponse({'error': 'el cuerpo JSON debe ser un objeto'}, status=400)
+        if isinstance(datos.get('usuarios'), list):
+            datos['usuarios'] = ','.join(str(u) for u in datos['usuarios'])
+
+    formulario = FormularioApiRecomendaciones(datos)
+    if not formulario.is_valid():
+        return JsonResponse({'error': formulario.errors}, status=400)
+    parametros = formulario.cleaned_data
+    usuarios = parametros['usuarios']
+    if not usuarios:
+        return JsonResponse({'error': 'usuarios es obligatorio'}, status=400)
+
+    if parametros['formato'] == 'ndjson' or len(usuarios) > getattr(settings, 'RECSYS_API_MAX_JSON', 100):
+        if isinstance(request, ASGIRequest):
+            contenido = _ndjson_async(usuarios, parametros, contextvars.copy_context())
+        else:
+            # Con WSGI la respuesta se envía desde un hilo del servidor, que calcula cada lote
+            contenido = _ndjson(_resultados_api(usuarios, parametros))
+        return StreamingHttpResponse(contenido, content_type='application/x-ndjson')
+    resultados = await ejecutor.ejecutar(lambda: list(_resultados_api(usuarios, parametros)))
+    return JsonResponse({'resultados': resultados})
+
+@require_GET
+@acotada(json=True)
+async def api_recomendaciones_todos(request):
+    """
+    Exportación NDJSON en streaming de las recomendaciones y usuarios
+    similares de todos los usuarios; admite fecha, n y similares como
+    api_recomendaciones
+    Cada lote se calcula en el pool de main/ejecutor.py
+    """
+    formulario = FormularioApiRecomendaciones(request.GET)
+    if not formulario.is_valid():
+        return JsonResponse({'error': formulario.errors}, status=400)
+    modelo = await ejecutor.ejecutar(recommendations.asegurarModelo)
+    if isinstance(request, ASGIRequest):
+        contenido = _ndjson_async(iter(modelo.prefs), formulario.cleaned_data, contextvars.copy_context())
+    else:
+        # Con WSGI la respuesta se envía desde un hilo del servidor, que calcula cada lote
+        contenido = _ndjson(_resultados_api(iter(modelo.prefs), formulario.cleaned_data))
+    return StreamingHttpResponse(contenido, content_type='application/x-ndjson')
+
+def _ndjson(resultados):
+    for resultado in resultados:
+        yield json.dumps(resultado) + '\n'
+
+async def _ndjson_async(usuarios, parametros, contexto):
+    # Un lote por tarea del ejecutor; a mitad de respuesta ya no se puede
+    # cambiar el estado HTTP, así que un error se notifica en una última línea
+    # Los lotes se lanzan con el contexto de la vista (contexto), no con el del
+    # envío: así se atribuyen a la petición y se perfilan si se eligió
+    for lote in lotes(usuarios, getattr(settings, 'RECSYS_API_LOTE', 100)):
+        try:
+            resultados = await asyncio.create_task(
+                ejecutor.ejecutar(lambda lote=lote: list(_resultados_api(lote, parametros))),
+                context=contexto.copy())
+        except ejecutor.Saturado:
+            yield json.dumps({'error': 'servidor saturado'}) + '\n'
+            return
+        except asyncio.TimeoutError:
+            yield json.dumps({'error': 'la consulta ha superado el tiempo máximo'}) + '\n'
+            return
+        for resultado in resultados:
+            yield json.dumps(resultado) + '\n'
+
+def _resultados_api(usuarios, parametros):
+    # Un diccionario por usuario; los similares y las precalculadas se leen
+    # por lotes, así que la memoria no crece con el número de usuarios
+    n = parametros['n'] or 2
+    num_similares = parametros['similares']
+    if num_similares is None:
+        num_similares = 3
+    for lote in lotes(usuarios, getattr(settings, 'RECSYS_API_LOTE', 100)):
+        similares = recommendations.getUsuariosSimilaresVarios(lote, n=num_similares) if num_similares else {}
+        recomendaciones = recommendations.recomendar_peliculas_varios(lote, parametros['fecha'], n=n)
+        for id_usuario in lote:
+            recs = recomendaciones[id_usuario]
+            yield {
+                'idUsuario': id_usuario,
+                'recomendaciones': [{'idPelicula': id_pelicula, 'recomendacion': rec} for (rec, id_pelicula) in recs],
+                'similares': [{'idUsuario': otro, 'similaridad': sim} for (sim, otro) in similares.get(id_usuario, [])],
+            }